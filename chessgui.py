@@ -189,7 +189,7 @@ if __name__ == '__main__':
     import sys
     import chess 
     import chessnet 
-    matchset = chessnet.MatchSet()
+    matchset = chessnet.MatchSet(games=True)
 
 
     # ~ gmoves=list(g.mainline())
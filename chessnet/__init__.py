@@ -1,21 +1,53 @@
 from __future__ import print_function
 
+import importlib
+
 from . import util
 from . import parse
+from . import pgn
+from . import ingest
+from . import memo
+from . import cache
+from . import corpus
+from . import instrument
+from . import table
+from . import aggregate
+from .corpus import Corpus
+from .ingest import iter_matches
 from . import constants as K
-from .compute import compute_match, compute_state, compute_board_matrices
+from .compute import (
+    compute_match, compute_state, compute_board_matrices, compute_boards,
+    compute_epd)
 from .classes import MatchSet, Match, BoardState
-from . import test
 
 __all__ = [
     'util',
     'K',
     'parse',
+    'pgn',
+    'ingest',
+    'memo',
+    'cache',
+    'corpus',
+    'Corpus',
+    'instrument',
+    'table',
+    'aggregate',
+    'iter_matches',
     'compute_match',
     'compute_state',
     'compute_board_matrices',
+    'compute_boards',
+    'compute_epd',
     'MatchSet',
     'Match',
     'BoardState',
     'test',
     ]
+
+
+def __getattr__(name):
+    # The test module (with its test data) is imported on first access
+    if name == 'test':
+        return importlib.import_module('.test', __name__)
+    raise AttributeError("module 'chessnet' has no attribute %r" % name)
@@ -0,0 +1,215 @@
+from collections import OrderedDict
+
+from numpy import zeros, full, inf, sqrt, minimum, maximum, stack, float64, \
+    int64
+
+from .metrics import vector_names
+
+# Groups of board states aggregated, by alignment: the metrics of each
+# color, or the ones of the winner and the loser of decisive games.
+ALIGNMENTS = {
+    None: ('w', 'b'),
+    'winner': ('winner', 'loser'),
+    }
+
+# Colors of the winner and the loser, by Match.winner
+WINNER_COLORS = {'White': ('w', 'b'), 'Black': ('b', 'w')}
+
+
+# Per ply statistics are updated one match at a time with Welford's
+# algorithm, vectorized over the plies of the match and the metrics, so a
+# single streaming pass over any number of games holds only one row per
+# ply. Partial results (e.g. of several pgn files) are combined with the
+# parallel version of the same update (Chan et al.).
+
+class PlyStats:
+
+    def __init__(self, vec=None, align=None):
+        """Streaming count, mean, variance, min and max of per ply metrics
+        across matches.
+
+        INPUT:
+            vec: (list(str), None)
+                metric names, defaults to all vector_names.
+            align: (str, None)
+                None aggregates the 'w_' and 'b_' metrics of each color.
+                'winner' aggregates the metrics of the winner and of the
+                loser of each game as 'winner_' and 'loser_', and skips
+                drawn games.
+        """
+        if align not in ALIGNMENTS:
+            raise ValueError('Unknown alignment: %s' % align)
+        self.vec = list(vector_names if vec is None else vec)
+        self.align = align
+        self.groups = ALIGNMENTS[align]
+        self.matches = 0
+        self.skipped = 0
+        self.length = dict((g, 0) for g in self.groups)
+        self.count = dict((g, zeros(0, int64)) for g in self.groups)
+        self._mean = dict((g, zeros((len(self.vec), 0))) for g in self.groups)
+        self._m2 = dict((g, zeros((len(self.vec), 0))) for g in self.groups)
+        self._min = dict((g, zeros((len(self.vec), 0))) for g in self.groups)
+        self._max = dict((g, zeros((len(self.vec), 0))) for g in self.groups)
+
+    def __len__(self):
+        """Number of plies of the longest match added"""
+        return max(self.length.values())
+
+    def grow(self, group, L):
+        # Room for L plies in the arrays of a group
+        self.length[group] = max(self.length[group], L)
+        n = len(self.count[group])
+        if L <= n:
+            return
+        size = max(L, 2*n)
+        rows = len(self.vec)
+        count = zeros(size, int64)
+        count[:n] = self.count[group]
+        self.count[group] = count
+        for arrays, fill in ((self._mean, 0.), (self._m2, 0.),
+                             (self._min, inf), (self._max, -inf)):
+            value = full((rows, size), fill)
+            value[:, :n] = arrays[group]
+            arrays[group] = value
+
+    def colors(self, match):
+        # Metric prefix of each group for a match, None to skip it
+        if self.align is None:
+            return dict((g, g) for g in self.groups)
+        colors = WINNER_COLORS.get(match.winner[0])
+        if colors is None:
+            return None
+        return dict(zip(self.groups, colors))
+
+    def add(self, match):
+        """Adds the per ply metrics of a match. Invalid matches (and, for
+        the winner alignment, drawn games) are skipped.
+        """
+        colors = self.colors(match) if match.is_valid_match else None
+        if colors is None:
+            self.skipped += 1
+            return
+        values = match.metrics(self.vec)
+        for group, color in colors.items():
+            v = stack([values[color + '_' + name]
+                       for name in self.vec]).astype(float64)
+            L = v.shape[1]
+            self.grow(group, L)
+            count = self.count[group][:L]
+            count += 1
+            mean = self._mean[group][:, :L]
+            delta = v - mean
+            mean += delta / count
+            self._m2[group][:, :L] += delta * (v - mean)
+            minimum(self._min[group][:, :L], v, out=self._min[group][:, :L])
+            maximum(self._max[group][:, :L], v, out=self._max[group][:, :L])
+        self.matches += 1
+
+    def update(self, matches):
+        """Adds an iterable of matches (a MatchSet, or the matches or
+        batches of matches of ingest.iter_matches). Returns self.
+        """
+        for item in matches:
+            if isinstance(item, list):
+                for match in item:
+                    self.add(match)
+            else:
+                self.add(item)
+        return self
+
+    def merge(self, other):
+        """Adds the statistics of another PlyStats of the same metrics
+        and alignment. Returns self.
+        """
+        if other.vec != self.vec or other.align != self.align:
+            raise ValueError('Can not merge statistics of other metrics')
+        for group in self.groups:
+            L = other.length[group]
+            nb = other.count[group][:L]
+            self.grow(group, L)
+            na = self.count[group][:L].astype(float64)
+            n = na + nb
+            ma = self._mean[group][:, :L]
+            delta = other._mean[group][:, :L] - ma
+            weight = nb / (n + (n == 0))
+            self._m2[group][:, :L] += other._m2[group][:, :L] + \
+                delta**2 * na * weight
+            ma += delta * weight
+            minimum(self._min[group][:, :L], other._min[group][:, :L],
+                    out=self._min[group][:, :L])
+            maximum(self._max[group][:, :L], other._max[group][:, :L],
+                    out=self._max[group][:, :L])
+            self.count[group][:L] += nb
+        self.matches += other.matches
+        self.skipped += other.skipped
+        return self
+
+    def index(self, key):
+        # Group and metric row of a key such as 'winner_Dconnectance'
+        group, _, name = key.partition('_')
+        if group not in self.groups or name not in self.vec:
+            raise ValueError('Unknown statistic: %s' % key)
+        return group, self.vec.index(name)
+
+    def n(self, key):
+        """Number of matches with each ply"""
+        group, _ = self.index(key)
+        return self.count[group][:self.length[group]].copy()
+
+    def stat(self, key, name):
+        # Per ply statistic name of key
+        group, row = self.index(key)
+        n = self.length[group]
+        if name == 'var':
+            return self._m2[group][row, :n] / self.count[group][:n]
+        arrays = {'mean': self._mean, 'min': self._min, 'max': self._max}
+        return arrays[name][group][row, :n].copy()
+
+    def mean(self, key):
+        """Per ply mean of a metric key ('w_'/'b_' or 'winner_'/'loser_'
+        and its name)
+        """
+        return self.stat(key, 'mean')
+
+    def var(self, key):
+        """Per ply (population) variance of a metric key, as numpy.var"""
+        return self.stat(key, 'var')
+
+    def std(self, key):
+        return sqrt(self.var(key))
+
+    def min(self, key):
+        return self.stat(key, 'min')
+
+    def max(self, key):
+        return self.stat(key, 'max')
+
+    @property
+    def keys(self):
+        return [group + '_' + name for group in self.groups
+                for name in self.vec]
+
+    def as_dict(self):
+        """count, mean, std, min and max of each key, one value per ply"""
+        out = OrderedDict()
+        for key in self.keys:
+            out[key] = OrderedDict([
+                ('count', self.n(key)), ('mean', self.mean(key)),
+                ('std', self.std(key)), ('min', self.min(key)),
+                ('max', self.max(key))])
+        return out
+
+    def ToPandas(self):
+        """One row per ply, with (key, statistic) columns"""
+        import pandas as pd
+        columns = OrderedDict()
+        for key, stats in self.as_dict().items():
+            for name, value in stats.items():
+                columns[(key, name)] = value
+        df = pd.DataFrame(columns)
+        df.index.name = 'ply'
+        return df
+
+    def __repr__(self):
+        return 'PlyStats(%d matches, %d skipped, %d plies, align=%s)' % (
+            self.matches, self.skipped, len(self), self.align)
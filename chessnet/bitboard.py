@@ -0,0 +1,308 @@
+from numpy import zeros, full
+from numpy import uint64 as npuint64
+from numpy import int8 as npint8
+from numba import jit, uint64, int_
+
+from .constants import (
+    MAXI, MAXJ, MAXPIECES, BOARDSZ, PIECENO, INVALID_KING,
+    KNIGHT_MOVES, KING_MOVES, W_KING_IDX, B_KING_IDX,
+    IMAPNUM, IS_EMPTY,
+    IS_CASTLE, IS_BISHOP, IS_QUEEN, IS_KNIGHT, IS_W_PAWN, IS_B_PAWN,
+    IS_W_KING, IS_B_KING, CHECK_KING_AS_QUEEN, JIT_CACHE,
+    )
+
+"""
+/////////////////////////////////////////////////////////////
+//BITBOARD ENGINE
+/////////////////////////////////////////////////////////////
+
+Alternative to compute.compute_board_matrices. Each board state is kept
+as one uint64 attack set per piece code, plus the row of X/S where that
+piece is accounted (promoted pawns go to the row of their new piece) and
+the cell where it stands. Bit n of a bitboard is the cell
+MAPCELL(i, j) = n, so bitboards expand directly to the X/S layout.
+
+Sliders use precomputed rays and a bit scan on the first blocker, the
+other pieces use precomputed attack tables. The quirks of the cell-wise
+kernel are reproduced on purpose (knights stop at their first occupied
+target, pawns always reach both diagonals, pawn double steps ignore the
+intermediate cell) so both engines give bit-identical X/S/Kw/Kb.
+"""
+
+# Ray directions as (di, dj), in the order of the CHECK_* helpers
+RAY_DIRS = (
+    (0, 1),    # UP
+    (0, -1),   # DOWN
+    (-1, 0),   # LEFT
+    (1, 0),    # RIGHT
+    (-1, 1),   # UPLEFT
+    (-1, -1),  # DOWNLEFT
+    (1, 1),    # UPRIGHT
+    (1, -1),   # DOWNRIGHT
+    )
+ROOK_RAYS = (0, 4)
+BISHOP_RAYS = (4, 8)
+
+NONE = npuint64(0)
+ONE = npuint64(1)
+DEBRUIJN = npuint64(0x03f79d71b4cb0a89)
+DEBRUIJN_SHIFT = npuint64(58)
+
+
+def _build_tables():
+    bit = zeros(BOARDSZ, npuint64)
+    rays = zeros((len(RAY_DIRS), BOARDSZ), npuint64)
+    positive = zeros(len(RAY_DIRS), npint8)
+    knight = full((BOARDSZ, len(KNIGHT_MOVES)), -1, npint8)
+    king = zeros(BOARDSZ, npuint64)
+    w_pawn_diag = zeros(BOARDSZ, npuint64)
+    w_pawn_push = zeros(BOARDSZ, npuint64)
+    b_pawn_diag = zeros(BOARDSZ, npuint64)
+    b_pawn_push = zeros(BOARDSZ, npuint64)
+    for d, (di, dj) in enumerate(RAY_DIRS):
+        positive[d] = di*MAXJ + dj > 0
+
+    def add(table, sq, i, j):
+        if 0 <= i < MAXI and 0 <= j < MAXJ:
+            table[sq] |= npuint64(1 << (i*MAXJ + j))
+
+    for i in range(MAXI):
+        for j in range(MAXJ):
+            sq = i*MAXJ + j
+            bit[sq] = npuint64(1 << sq)
+            for d, (di, dj) in enumerate(RAY_DIRS):
+                for n in range(1, max(MAXI, MAXJ)):
+                    add(rays[d], sq, i + n*di, j + n*dj)
+            for n, (x, y) in enumerate(KNIGHT_MOVES):
+                if 0 <= i + x < MAXI and 0 <= j + y < MAXJ:
+                    knight[sq, n] = (i + x)*MAXJ + j + y
+            for (x, y) in KING_MOVES:
+                add(king, sq, i + x, j + y)
+            for x in (-1, 1):
+                add(w_pawn_diag, sq, i + x, j + 1)
+                add(b_pawn_diag, sq, i + x, j - 1)
+            add(w_pawn_push, sq, i, j + 1)
+            add(b_pawn_push, sq, i, j - 1)
+            if j == 1:
+                add(w_pawn_push, sq, i, j + 2)
+            if j == MAXJ - 2:
+                add(b_pawn_push, sq, i, j - 2)
+
+    # Index table of the de Bruijn bit scan. Isolating the lowest set bit
+    # as b ^ (b - 1) and filling down the highest one give the same mask,
+    # so one table serves both scan directions.
+    index = zeros(BOARDSZ, npint8)
+    for sq in range(BOARDSZ):
+        mask = (1 << (sq + 1)) - 1
+        index[((mask * int(DEBRUIJN)) % (1 << 64)) >> int(DEBRUIJN_SHIFT)] = sq
+    return (bit, rays, positive, knight, king, w_pawn_diag, w_pawn_push,
+            b_pawn_diag, b_pawn_push, index)
+
+
+(BIT, RAYS, RAY_POSITIVE, KNIGHT_TARGETS, KING_ATTACKS,
+ W_PAWN_DIAG, W_PAWN_PUSH, B_PAWN_DIAG, B_PAWN_PUSH,
+ DEBRUIJN_INDEX) = _build_tables()
+
+
+@jit(int_(uint64), nopython=True, cache=JIT_CACHE)
+def BITSCAN_FORWARD(b):
+    return DEBRUIJN_INDEX[((b ^ (b - ONE)) * DEBRUIJN) >> DEBRUIJN_SHIFT]
+
+
+@jit(int_(uint64), nopython=True, cache=JIT_CACHE)
+def BITSCAN_REVERSE(b):
+    b |= b >> npuint64(1)
+    b |= b >> npuint64(2)
+    b |= b >> npuint64(4)
+    b |= b >> npuint64(8)
+    b |= b >> npuint64(16)
+    b |= b >> npuint64(32)
+    return DEBRUIJN_INDEX[(b * DEBRUIJN) >> DEBRUIJN_SHIFT]
+
+
+@jit(uint64(int_, uint64, int_, int_), nopython=True, cache=JIT_CACHE)
+def RAY_ATTACKS(sq, occ, d0, d1):
+    att = NONE
+    for d in range(d0, d1):
+        ray = RAYS[d, sq]
+        blockers = ray & occ
+        if blockers != NONE:
+            if RAY_POSITIVE[d]:
+                ray ^= RAYS[d, BITSCAN_FORWARD(blockers)]
+            else:
+                ray ^= RAYS[d, BITSCAN_REVERSE(blockers)]
+        att |= ray
+    return att
+
+
+@jit(uint64(int_, uint64), nopython=True, cache=JIT_CACHE)
+def KNIGHT_ATTACKS(sq, occ):
+    att = NONE
+    for n in range(KNIGHT_TARGETS.shape[1]):
+        cn = KNIGHT_TARGETS[sq, n]
+        if cn < 0:
+            continue
+        att |= BIT[cn]
+        if occ & BIT[cn]:
+            break
+    return att
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def compute_board_bitboards(B, promoted, att, rows, squares, katt, kings):
+    """Bitboard version of compute.compute_board_matrices.
+
+    OUTPUT (filled in place):
+        att: attack set of each piece code (0-based).
+        rows: row of X and S accounting for each piece code.
+        squares: cell of each piece code, -1 if not on the board.
+        katt: white and black king accesibility as queens (Kw, Kb).
+        kings: cells of the white and black kings, -1 if not found.
+    """
+    att[:] = NONE
+    rows[:] = -1
+    squares[:] = -1
+    katt[:] = NONE
+    kings[:] = INVALID_KING
+    wslot = -1
+    bslot = -1
+
+    # First pass: occupancy, and the pieces in board scan order
+    occ = NONE
+    npz = 0
+    found = zeros(BOARDSZ, npint8)
+    for cn in range(BOARDSZ):
+        if not IS_EMPTY(B[cn // MAXJ, cn % MAXJ]):
+            occ |= BIT[cn]
+            found[npz] = cn
+            npz += 1
+
+    for n in range(npz):
+        cn = found[n]
+        p = B[cn // MAXJ, cn % MAXJ]
+        k = IMAPNUM(p)
+        if promoted[k] != 0:
+            p = promoted[k]
+        rows[k] = IMAPNUM(p)
+        squares[k] = cn
+        if IS_CASTLE(p):
+            att[k] = RAY_ATTACKS(cn, occ, ROOK_RAYS[0], ROOK_RAYS[1])
+        elif IS_BISHOP(p):
+            att[k] = RAY_ATTACKS(cn, occ, BISHOP_RAYS[0], BISHOP_RAYS[1])
+        elif IS_QUEEN(p):
+            att[k] = RAY_ATTACKS(cn, occ, ROOK_RAYS[0], BISHOP_RAYS[1])
+        elif IS_KNIGHT(p):
+            att[k] = KNIGHT_ATTACKS(cn, occ)
+        elif IS_W_PAWN(p):
+            att[k] = W_PAWN_DIAG[cn] | (W_PAWN_PUSH[cn] & ~occ)
+        elif IS_B_PAWN(p):
+            att[k] = B_PAWN_DIAG[cn] | (B_PAWN_PUSH[cn] & ~occ)
+        elif IS_B_KING(p):
+            kings[1] = cn
+            bslot = k
+        elif IS_W_KING(p):
+            kings[0] = cn
+            wslot = k
+
+    # Kings can not move to cells reachable by the opponent nor next to
+    # the other king. The white king goes first, so it only sees the black
+    # pieces, while the black king also sees the white king.
+    wking = kings[0]
+    bking = kings[1]
+    if wking != INVALID_KING:
+        acc = NONE
+        for k in range(MAXPIECES):
+            if rows[k] >= PIECENO:
+                acc |= att[k]
+        if bking != INVALID_KING:
+            acc |= KING_ATTACKS[bking] | BIT[bking]
+        att[wslot] = KING_ATTACKS[wking] & ~acc
+        rows[wslot] = W_KING_IDX
+        katt[0] = RAY_ATTACKS(wking, occ, ROOK_RAYS[0], BISHOP_RAYS[1])
+    if bking != INVALID_KING:
+        acc = NONE
+        for k in range(MAXPIECES):
+            if rows[k] >= 0 and rows[k] < PIECENO:
+                acc |= att[k]
+        if wking != INVALID_KING:
+            acc |= KING_ATTACKS[wking] | BIT[wking]
+        att[bslot] = KING_ATTACKS[bking] & ~acc
+        rows[bslot] = B_KING_IDX
+        katt[1] = RAY_ATTACKS(bking, occ, ROOK_RAYS[0], BISHOP_RAYS[1])
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def expand_board_bitboards(B, att, rows, squares, katt, kings, X, S, Kw, Kb):
+    """Accumulates a bitboard state on the X, S, Kw and Kb matrices"""
+    for k in range(MAXPIECES):
+        if squares[k] < 0:
+            continue
+        X[rows[k], squares[k]] = 1
+        a = att[k]
+        while a != NONE:
+            S[rows[k], BITSCAN_FORWARD(a)] += 1
+            a &= a - ONE
+    for c in range(2):
+        K = Kw if c == 0 else Kb
+        if kings[c] == INVALID_KING:
+            # Keep the behaviour of the cell-wise kernel without kings
+            CHECK_KING_AS_QUEEN(B, K, INVALID_KING, INVALID_KING)
+            continue
+        a = katt[c]
+        while a != NONE:
+            K[0, BITSCAN_FORWARD(a)] += 1
+            a &= a - ONE
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def compute_match_bitboards(B, promoted, att, rows, squares, katt, kings):
+    for n in range(B.shape[0]):
+        compute_board_bitboards(
+            B[n], promoted[n], att[n], rows[n], squares[n], katt[n], kings[n])
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def expand_match_bitboards(B, att, rows, squares, katt, kings, X, S, Kw, Kb):
+    for n in range(B.shape[0]):
+        expand_board_bitboards(B[n], att[n], rows[n], squares[n], katt[n],
+                               kings[n], X[n], S[n], Kw[n:n+1], Kb[n:n+1])
+
+
+class BitBoards:
+
+    def __init__(self, B, promoted):
+        """Constructor of class BitBoards. It computes the bitboard
+        representation of a stack of board states, which takes around 350
+        bytes per board instead of the 32 KB of the X and S matrices.
+
+        INPUT:
+            B: (array)
+                (L, MAXI, MAXJ) stack of boards.
+            promoted: (array)
+                (L, MAXPIECES) stack of promoted pieces.
+        """
+        L = B.shape[0]
+        self.att = zeros((L, MAXPIECES), npuint64)
+        self.rows = zeros((L, MAXPIECES), npint8)
+        self.squares = zeros((L, MAXPIECES), npint8)
+        self.katt = zeros((L, 2), npuint64)
+        self.kings = zeros((L, 2), npint8)
+        compute_match_bitboards(B, promoted, self.att, self.rows,
+                                self.squares, self.katt, self.kings)
+
+    def __len__(self):
+        return self.att.shape[0]
+
+    def expand(self, B):
+        """Expands the bitboards to the X, S, Kw and Kb matrices of the
+        cell-wise kernel, with the same dtype as B. B is only needed for
+        boards without kings.
+        """
+        L = len(self)
+        X = zeros((L, MAXPIECES, BOARDSZ), dtype=B.dtype)
+        S = zeros((L, MAXPIECES, BOARDSZ), dtype=B.dtype)
+        Kw = zeros((L, BOARDSZ), dtype=B.dtype)
+        Kb = zeros((L, BOARDSZ), dtype=B.dtype)
+        expand_match_bitboards(B, self.att, self.rows, self.squares,
+                               self.katt, self.kings, X, S, Kw, Kb)
+        return X, S, Kw, Kb
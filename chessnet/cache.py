@@ -0,0 +1,253 @@
+import os
+import json
+import shutil
+import hashlib
+
+from numpy import load, save
+
+from . import util
+from .constants import VERSION, KERNEL_VERSION
+
+# Arrays of a Match stored for each cache entry
+MATCH_ARRAYS = ('B', 'X', 'S', 'Kw', 'Kb', 'pieces', 'promoted')
+
+# Name of the file with the version and size of each entry
+META_FILE = 'meta.json'
+
+
+def version_tag():
+    """Library and kernel versions the cached arrays were computed with"""
+    return '%s-k%d' % (VERSION, KERNEL_VERSION)
+
+
+def match_key(ucimovements, dtype):
+    """Content address of a match: hash of its uci movements, the storage
+    dtype and the version tag.
+    """
+    h = hashlib.sha1(version_tag().encode())
+    h.update(str(dtype).encode())
+    for movement in ucimovements:
+        h.update(b' ' + movement)
+    return h.hexdigest()
+
+
+def file_key(fname):
+    """Content address of a pgn file: hash of its bytes and the version tag"""
+    h = hashlib.sha1(version_tag().encode())
+    with open(fname, 'rb') as pgnfile:
+        for block in iter(lambda: pgnfile.read(2**20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class MatchCache:
+
+    def __init__(self, path, maxbytes=None):
+        """Persistent content addressed cache of computed matches. Every
+        entry is a directory with one .npy file per array, opened memory
+        mapped (copy on write) so arrays are paged in lazily. The parsed
+        movements and metadata of whole pgn files are cached as well, so
+        a cached file is opened without parsing it again.
+
+        INPUT:
+            path: (str)
+                cache directory, created if needed.
+            maxbytes: (int, None)
+                size limit, counting the arrays of the matches and the
+                cached pgn files. The least recently used entries (of
+                either kind) are evicted once exceeded. None for no
+                limit.
+        """
+        self.logger = util.get_logger('MatchCache')
+        self.path = path
+        self.maxbytes = maxbytes
+        os.makedirs(os.path.join(path, 'matches'), exist_ok=True)
+        os.makedirs(os.path.join(path, 'files'), exist_ok=True)
+        self.nbytes = self.disk_bytes()
+
+    def disk_bytes(self):
+        # Size of the match arrays and the pgn files on disk
+        return sum(meta['nbytes'] for _, meta in self.entries()) + \
+            sum(nbytes for _, nbytes in self.file_entries())
+
+    def entry_path(self, key):
+        return os.path.join(self.path, 'matches', key[:2], key)
+
+    def file_path(self, key):
+        return os.path.join(self.path, 'files', key + '.json')
+
+    def entries(self):
+        """Yields (key, meta) of every entry on disk"""
+        root = os.path.join(self.path, 'matches')
+        for prefix in sorted(os.listdir(root)):
+            for key in sorted(os.listdir(os.path.join(root, prefix))):
+                if '.tmp' not in key:
+                    yield key, self.read_meta(key)
+
+    def file_entries(self):
+        """Yields (key, nbytes) of every cached pgn file on disk"""
+        root = os.path.join(self.path, 'files')
+        for name in sorted(os.listdir(root)):
+            if name.endswith('.json'):
+                try:
+                    yield name[:-5], os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    continue
+
+    def read_meta(self, key):
+        try:
+            with open(os.path.join(self.entry_path(key), META_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'version': None, 'nbytes': 0}
+
+    def __contains__(self, key):
+        return os.path.exists(
+            os.path.join(self.entry_path(key), META_FILE))
+
+    def load(self, ucimovements, dtype):
+        """Returns the dict of arrays cached for a match, memory mapped,
+        or None on a miss.
+        """
+        key = match_key(ucimovements, dtype)
+        if key not in self:
+            return None
+        entry = self.entry_path(key)
+        try:
+            arrays = dict((name, load(os.path.join(entry, name + '.npy'),
+                                      mmap_mode='c'))
+                          for name in MATCH_ARRAYS)
+        except (OSError, ValueError):
+            self.logger.warning('Removing corrupt cache entry %s' % key)
+            self.remove(key)
+            return None
+        # Entries are evicted by last use
+        os.utime(os.path.join(entry, META_FILE))
+        return arrays
+
+    def store(self, match):
+        """Writes the arrays of a valid match and evicts entries if the
+        size limit is exceeded.
+        """
+        key = match_key(match.ucimovements, match.dtype)
+        if key in self:
+            return key
+        entry = self.entry_path(key)
+        tmp = entry + '.tmp%d' % os.getpid()
+        os.makedirs(tmp, exist_ok=True)
+        nbytes = 0
+        for name in MATCH_ARRAYS:
+            value = getattr(match, name)
+            save(os.path.join(tmp, name + '.npy'), value)
+            nbytes += value.nbytes
+        with open(os.path.join(tmp, META_FILE), 'w') as f:
+            json.dump({'version': version_tag(), 'nbytes': nbytes}, f)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # Stored meanwhile by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+            return key
+        self.nbytes += nbytes
+        if self.maxbytes is not None and self.nbytes > self.maxbytes:
+            self.evict(self.maxbytes)
+        return key
+
+    def remove(self, key):
+        meta = self.read_meta(key)
+        shutil.rmtree(self.entry_path(key), ignore_errors=True)
+        self.nbytes -= meta['nbytes']
+
+    def remove_file(self, key):
+        fname = self.file_path(key)
+        try:
+            nbytes = os.path.getsize(fname)
+            os.remove(fname)
+        except OSError:
+            return
+        self.nbytes -= nbytes
+
+    def evict(self, maxbytes):
+        """Removes the least recently used entries (matches and pgn
+        files) until the cache holds at most maxbytes.
+        """
+        def last_use(item):
+            try:
+                return os.path.getmtime(item[1])
+            except OSError:
+                return 0.
+        items = [(self.remove, os.path.join(self.entry_path(key), META_FILE),
+                  key) for key, _ in self.entries()] + \
+            [(self.remove_file, self.file_path(key), key)
+             for key, _ in self.file_entries()]
+        for remove, _, key in sorted(items, key=last_use):
+            if self.nbytes <= maxbytes:
+                break
+            remove(key)
+
+    def load_file(self, fname):
+        """Returns the (mov_lst, meta_lst) cached for a pgn file, or None"""
+        path = self.file_path(file_key(fname))
+        try:
+            with open(path) as f:
+                games = json.load(f)['games']
+        except (OSError, ValueError, KeyError):
+            return None
+        # Entries are evicted by last use
+        os.utime(path)
+        mov_lst = [[m.encode() for m in movements]
+                   for movements, _ in games]
+        meta_lst = [metadata for _, metadata in games]
+        return mov_lst, meta_lst
+
+    def store_file(self, fname, mov_lst, meta_lst):
+        """Caches the parsed movements and metadata of a pgn file"""
+        games = [([m.decode() for m in movements], dict(metadata))
+                 for movements, metadata in zip(mov_lst, meta_lst)]
+        key = file_key(fname)
+        self.remove_file(key)
+        with open(self.file_path(key), 'w') as f:
+            json.dump({'version': version_tag(), 'games': games}, f)
+        self.nbytes += os.path.getsize(self.file_path(key))
+        if self.maxbytes is not None and self.nbytes > self.maxbytes:
+            self.evict(self.maxbytes)
+
+    def verify(self):
+        """Removes the entries computed with another library or kernel
+        version, or with missing files. Returns the number removed.
+        """
+        removed = 0
+        tag = version_tag()
+        for key, meta in list(self.entries()):
+            entry = self.entry_path(key)
+            complete = all(os.path.exists(os.path.join(entry, name + '.npy'))
+                           for name in MATCH_ARRAYS)
+            if meta['version'] != tag or not complete:
+                shutil.rmtree(entry, ignore_errors=True)
+                removed += 1
+        root = os.path.join(self.path, 'matches')
+        for prefix in os.listdir(root):
+            # Leftovers of interrupted stores
+            for name in os.listdir(os.path.join(root, prefix)):
+                if '.tmp' in name:
+                    shutil.rmtree(os.path.join(root, prefix, name),
+                                  ignore_errors=True)
+        for name in os.listdir(os.path.join(self.path, 'files')):
+            fname = os.path.join(self.path, 'files', name)
+            try:
+                with open(fname) as f:
+                    stale = json.load(f).get('version') != tag
+            except (OSError, ValueError, AttributeError):
+                stale = True
+            if stale:
+                os.remove(fname)
+                removed += 1
+        self.nbytes = self.disk_bytes()
+        return removed
+
+    def clear(self):
+        """Removes every entry of the cache"""
+        for sub in ('matches', 'files'):
+            shutil.rmtree(os.path.join(self.path, sub), ignore_errors=True)
+            os.makedirs(os.path.join(self.path, sub))
+        self.nbytes = 0
@@ -4,33 +4,35 @@ from numpy import (
 from . import util
 from . import compute
 from . import printers
+from . import ingest
+from . import networks
+from . import metrics
+from . import memo
+from .metrics import vector_names
+from .cache import MatchCache
+from . import corpus
+from . import instrument
+from . import table
+from . import aggregate
+import os
 import math
-import pandas as pd
+import weakref
 
 
 from .parse import parse_match_from_movlst
+from .pgn import MoveBuffer
 
 from .constants import (
     testmultifilename, testfilename, W_KING_IDX, B_KING_IDX,
     BOARDSZ, MAXI, MAXJ, MAXPIECES, PIECENO, NPDTYPE, PAWNNO, UCI_OFFSET,
     )
 
-import matplotlib.pyplot as plt
+# pandas and matplotlib are only imported by the methods that use them, so
+# computing matches (as ingest workers do) needs only numpy and numba
 
 U = matrix(ones((1, PIECENO)))
 V = matrix(ones((1, BOARDSZ)))
 
-vector_names = [
-    'pieceno',
-    'accesible',
-    'Dconnectance',
-    'Aconnectance',
-    'Iconnectance',
-    'Cconnectance',
-    'king_accesibility',
-    'defense_on_king',
-    'attack_on_king',
-    ]
 
 matrix_names = ['B', 'S', 'X', 'Sw', 'Sb', 'Xw', 'Xb', 'Dw', 'Db',
                 'Aw', 'Ab', 'Iw', 'Ib', 'Cw', 'Cb']
@@ -38,7 +40,10 @@ matrix_names = ['B', 'S', 'X', 'Sw', 'Sb', 'Xw', 'Xb', 'Dw', 'Db',
 
 class MatchSet:
 
-    def __init__(self, pgn_fname=None, png_dir=None, recursive=False):
+    def __init__(self, pgn_fname=None, png_dir=None, recursive=False,
+                 workers=None, engine='kernel', dtype=None, packed=False,
+                 cache=None, stats=None, transpositions=None,
+                 share_prefixes=False, threads=None, games=False):
         """Constructor of class MatchSet. This object encapsulates
         the metadata, movements, and states of a set of matches especified
         in the arguments.
@@ -47,45 +52,251 @@ class MatchSet:
             pgn_fname: (str, None)
                 path to a multi match png file.
             pgn_dir: (str, None)
-                path to a directory with multiple pgn files.
+                path to a directory with pgn files, each with one or more
+                matches. See ingest.compute_pgn_directory, the throughput
+                of each file is kept in file_stats.
             recursive: (bool)
                 if a directory was provided, this flag determines
                 the recursive exploration of the directory.
+            workers: (int, None)
+                if larger than one, load, parse and compute the matches of
+                a pgn file or directory in a pool with this number of
+                processes.
+            engine: (str)
+                compute engine of the matches, see Match.
+            dtype: (str, numpy dtype, None)
+                storage dtype of the match arrays, see Match.
+            packed: (bool)
+                store pieces and promoted as bitmasks, see Match.
+            cache: (str, MatchCache, None)
+                on-disk cache (or its directory) of parsed pgn files and
+                computed matches. Cached matches are memory mapped instead
+                of being parsed and computed again, and new ones are added
+                to the cache. Only used for pgn files, not directories.
+            stats: (bool, instrument.Stats, None)
+                if True (or a Stats instance to add to), record the wall
+                time and counters (games, plies, invalid games, bytes
+                read) of each stage of the construction in self.stats.
+                Stage 'total' times the whole constructor. Disabled by
+                default, in which case self.stats is None.
+            transpositions: (bool, TranspositionTable, None)
+                look up repeated board states in a transposition table,
+                see Match. Worker processes use a table of their own.
+            share_prefixes: (bool)
+                replay and compute the board states of the first
+                movements shared by several games only once, in a
+                MoveTrie (see trie.MoveTrie and Match.from_trie) kept in
+                self.trie. The X, S, Kw and Kb arrays of the matches are
+                shared read only views of the trie. Only used to load a
+                pgn file in this process (no workers, cache or directory).
+            threads: (bool, int, None)
+                replay and compute all the games of a pgn file at once
+                in a parallel kernel with this number of threads (True
+                for all the numba threads), see
+                compute.parse_compute_corpus. The arrays of the matches
+                are views of arrays shared by all of them. Only used to
+                load a pgn file in this process with the kernel engine
+                (no workers, cache, directory or share_prefixes).
+            games: (bool)
+                read the pgn file with python-chess (instead of the
+                native reader of pgn.py) and keep the game object of
+                each match in self._game_set, e.g. for chessgui. Only
+                used to load a pgn file in this process (no workers,
+                cached file or directory), otherwise the games are None.
         """
         # Initialize instance logger
         self.logger = util.get_logger('MatchSet')
+        if stats is True:
+            stats = instrument.Stats()
+        self.stats = stats or None
+        self.transpositions = transpositions
+        self.share_prefixes = share_prefixes
+        self.threads = threads
+        self.games = games
+        self.trie = None
+        with instrument.timer(self.stats, 'total'):
+            self.load(pgn_fname, png_dir, recursive, workers, engine, dtype,
+                      packed, cache)
+
+    def load(self, pgn_fname, png_dir, recursive, workers, engine, dtype,
+             packed, cache):
+        # Body of the constructor, see MatchSet
+        if isinstance(cache, str):
+            cache = MatchCache(cache)
+        self.cache = cache
+        fname = pgn_fname if pgn_fname is not None else testmultifilename
+        # Per file throughput, only for directories
+        self.file_stats = None
+        if cache is not None and (pgn_fname is not None or png_dir is None):
+            if self.load_cached(fname, engine, dtype, packed):
+                return
+
+        if pgn_fname is None and png_dir is not None:
+            # We have a directory with pgn files
+            self.logger.info('Loading multi pgn directory: ' + png_dir)
+            matches, invalid, self.file_stats = ingest.compute_pgn_directory(
+                png_dir, recursive,
+                workers if workers is not None and workers > 1 else 1,
+                engine=engine, dtype=dtype, stats=self.stats,
+                transpositions=bool(self.transpositions))
+            self.set_computed(matches, invalid, packed)
+            return
+
+        if workers is not None and workers > 1:
+            self.logger.info(
+                'Loading multi match pgn file with %d workers: %s' %
+                (workers, fname))
+            matches, invalid = ingest.compute_pgn_file(
+                fname, workers, engine=engine, dtype=dtype, stats=self.stats,
+                transpositions=bool(self.transpositions))
+            self.set_computed(matches, invalid, packed)
+            if cache is not None:
+                self.store_cached(fname)
+            return
+
         # Load match set with the method required by the input arguments
-        # !TODO: A hibrid loader, with multiple files in a path each of which
-        # can be either single or multimatch pgn files.
         if pgn_fname is not None:
             # We have a multi match pgn
             self.logger.info('Loading multi match pgn file: ' + pgn_fname)
-            self._movements_set, self._metadata_set, self._game_set =\
-                util.load_multipgn_file(pgn_fname)
-        elif png_dir is not None:
-            # We have a directory with multiple one-match pgn files
-            self.logger.info('Loading multi pgn directory: ' + pgn_fname)
-            self._movements_set, self._metadata_set, self._game_set =\
-                util.load_multipgn_directory(pgn_fname, recursive)
         else:
             # If no input is provided, just load a default test file
             self.logger.info(
                 'Loading default test multi match pgn file: ' + testmultifilename)
+        with instrument.timer(self.stats, 'read'):
             self._movements_set, self._metadata_set, self._game_set =\
-                util.load_multipgn_file(testmultifilename)
+                util.load_multipgn_file(fname, native=not self.games)
+        if self.stats is not None:
+            self.stats.count('read', games=len(self._movements_set),
+                             bytes=os.path.getsize(fname))
 
         # Once the pgn information has been loaded, create Match instances out
         # of each of the matches present.
         L = len(self._movements_set)
         self._match_set = list()
         self.invalid = list()
+        if self.share_prefixes:
+            self.load_trie(engine, dtype, packed)
+            if cache is not None:
+                self.store_cached(fname)
+            return
+        if self.threads and engine == 'kernel':
+            self.load_threaded(dtype, packed)
+            if cache is not None:
+                self.store_cached(fname)
+            return
         for i, (m, h) in enumerate(zip(self._movements_set, self._metadata_set)):
-            match = Match(m, (i+1, L), metadata=h)
+            match = Match(m, (i+1, L), metadata=h, engine=engine,
+                          dtype=dtype, packed=packed, stats=self.stats,
+                          transpositions=self.transpositions)
             # If everything went fine, append match and continue
             if match.is_valid_match:
                 self._match_set.append(match)
             else:
                 self.invalid.append(match)
+        if cache is not None:
+            self.store_cached(fname)
+
+    def load_trie(self, engine, dtype, packed):
+        # Builds the matches of the loaded pgn file from a MoveTrie
+        from .trie import MoveTrie
+        with instrument.timer(self.stats, 'trie'):
+            self.trie = MoveTrie(self._movements_set, engine, dtype)
+        instrument.count(self.stats, 'trie', nodes=len(self.trie),
+                         plies=self.trie.plies)
+        self.logger.info('Computed %d board states for %d plies' %
+                         (len(self.trie), self.trie.plies))
+        L = len(self._movements_set)
+        for i, (m, h) in enumerate(zip(self._movements_set, self._metadata_set)):
+            match = Match.from_trie(self.trie, i, m, (i+1, L), h)
+            if match.is_valid_match:
+                if packed:
+                    match.pack_pieces()
+                self._match_set.append(match)
+            else:
+                self.invalid.append(match)
+
+    def load_threaded(self, dtype, packed):
+        # Builds the matches of the loaded pgn file from the arrays of a
+        # parallel kernel over all of them
+        threads = None if self.threads is True else self.threads
+        with instrument.timer(self.stats, 'corpus'):
+            offsets, arrays = compute.parse_compute_corpus(
+                self._movements_set, dtype, threads)
+        instrument.count(self.stats, 'corpus', games=len(offsets) - 1,
+                         plies=int(offsets[-1]))
+        L = len(self._movements_set)
+        for i, (m, h) in enumerate(zip(self._movements_set, self._metadata_set)):
+            rows = slice(offsets[i], offsets[i+1])
+            match = Match.from_arrays(
+                m, dict((name, value[rows]) for name, value in arrays.items())
+                if offsets[i+1] > offsets[i] else None, (i+1, L), h)
+            if match.is_valid_match:
+                if packed:
+                    match.pack_pieces()
+                self._match_set.append(match)
+            else:
+                self.invalid.append(match)
+
+    def set_computed(self, matches, invalid, packed=False):
+        # Takes the matches computed by the ingest functions, which hold
+        # no python-chess games
+        self._match_set = matches
+        self.invalid = invalid
+        if packed:
+            with instrument.timer(self.stats, 'pack'):
+                for match in self._match_set:
+                    match.pack_pieces()
+        matches = sorted(self._match_set + self.invalid,
+                         key=lambda match: match.idx)
+        self._movements_set = [match.ucimovements for match in matches]
+        self._metadata_set = [match.metadata for match in matches]
+        self._game_set = None
+
+    def load_cached(self, fname, engine, dtype, packed):
+        """Builds the match set of a pgn file from the cache. Returns
+        False if the file is not cached. Matches missing in the cache are
+        computed and stored.
+        """
+        with instrument.timer(self.stats, 'cache_read'):
+            loaded = self.cache.load_file(fname)
+        if loaded is None:
+            return False
+        self.logger.info('Loading cached multi match pgn file: ' + fname)
+        self._movements_set, self._metadata_set = loaded
+        self._game_set = None
+        dtype = util.get_storage_dtype(dtype)
+        L = len(self._movements_set)
+        self._match_set = list()
+        self.invalid = list()
+        for i, (m, h) in enumerate(zip(self._movements_set, self._metadata_set)):
+            with instrument.timer(self.stats, 'cache_load'):
+                arrays = self.cache.load(m, dtype)
+            if arrays is not None:
+                match = Match.from_arrays(m, arrays, (i+1, L), h)
+                if packed:
+                    match.pack_pieces()
+                instrument.count(self.stats, 'cache_load', games=1,
+                                 plies=len(m)+1)
+            else:
+                match = Match(m, (i+1, L), metadata=h, engine=engine,
+                              dtype=dtype, packed=packed, stats=self.stats,
+                              transpositions=self.transpositions)
+                if match.is_valid_match:
+                    with instrument.timer(self.stats, 'cache_store'):
+                        self.cache.store(match)
+            if match.is_valid_match:
+                self._match_set.append(match)
+            else:
+                self.invalid.append(match)
+        return True
+
+    def store_cached(self, fname):
+        """Stores the parsed pgn file and every valid match in the cache"""
+        with instrument.timer(self.stats, 'cache_store'):
+            self.cache.store_file(fname, self._movements_set,
+                                  self._metadata_set)
+            for match in self:
+                self.cache.store(match)
 
     def __getitem__(self, val):
         """Specialized item getter of class MatchSet. It returns the
@@ -112,6 +323,58 @@ class MatchSet:
     def export_to_csv(self):
       for i,match in enumerate(self) : match.ToPandas(None).to_csv(str(i).zfill(math.trunc(math.log10(len(self)))+1)+'.csv',index=False) 
 
+    def to_corpus(self, path, dtype=None):
+        """Writes the valid matches as a memory mapped corpus, see
+        corpus.Corpus.
+        """
+        return corpus.write_corpus(self, path, dtype)
+
+    def to_table(self, path, vec=None, format=None):
+        """Writes the per ply metrics and pgn headers of the valid
+        matches as a single table file, Parquet if pyarrow is installed
+        and npz otherwise. See table.Table and ingest.write_pgn_table.
+
+        INPUT:
+            path: (str)
+                table file.
+            vec: (list(str), None)
+                metric names, defaults to all vector_names.
+            format: (str, None)
+                'parquet' or 'npz', see table.get_format.
+        """
+        return table.write_table(self, path, vec, format)
+
+    def aggregate(self, vec=None, align=None):
+        """Per ply count, mean, variance, min and max of the metrics
+        across the matches, in one streaming pass. See aggregate.PlyStats,
+        which also aggregates the matches of ingest.iter_matches.
+
+        INPUT:
+            vec: (list(str), None)
+                metric names, defaults to all vector_names.
+            align: (str, None)
+                None for the metrics of each color, 'winner' for the ones
+                of the winner and the loser of the decisive games.
+        """
+        return aggregate.PlyStats(vec, align).update(self)
+
+    def ToPandas(self, vec=None):
+        """Per ply metrics of all the matches in a single table, with
+        the index of the match and the ply as first columns.
+
+        INPUT:
+            vec: (list(str), None)
+                metric names, defaults to all vector_names.
+        """
+        import pandas as pd
+        tables = list()
+        for match in self:
+            df = match.ToPandas(vec)
+            df.insert(0, 'ply', range(len(df)))
+            df.insert(0, 'match', match.idx)
+            tables.append(df)
+        return pd.concat(tables, ignore_index=True)
+
     @property
     def B(self):
         return [match.B for match in self]
@@ -293,7 +556,13 @@ class MatchSet:
             self.logger.info(msg)
             match.compute()
 
+    def invalidate(self):
+        """Drops the cached networks and metrics of every match"""
+        for match in self:
+            match.invalidate()
+
     def plot(self, vname):
+        import matplotlib.pyplot as plt
         n = len(self)
         [r, c] = util.get_closest_pair(n)
         fig = plt.figure()
@@ -311,7 +580,9 @@ class MatchSet:
 
 class Match:
 
-    def __init__(self, init_param=testfilename, idx=None, metadata=None):
+    def __init__(self, init_param=testfilename, idx=None, metadata=None,
+                 engine='kernel', dtype=None, packed=False, stats=None,
+                 transpositions=None):
         """Constructor of class Match. This object encapsulates
         the metadata, movements, and board and matrix states
         for a set of movements especified in init_param.
@@ -323,20 +594,125 @@ class Match:
 
             idx: (int, None)
                 an index to order the match within a MatchSet
+
+            engine: (str)
+                'kernel' computes the X, S, Kw and Kb matrices directly.
+                'bitboard' keeps only the bitboards of each board state
+                and expands them to the matrices on first access.
+
+            dtype: (str, numpy dtype, None)
+                storage dtype of the match arrays, one of STORAGE_DTYPES.
+                Defaults to NPDTYPE; int8 and uint8 take 8 times less
+                memory and hold every value the kernels produce.
+
+            packed: (bool)
+                store pieces and promoted as one uint32 bitmask per board
+                state, unpacked on access.
+
+            stats: (instrument.Stats, None)
+                records the time spent in each stage (decode, alloc,
+                replay_compute, pack...) and counts the match and its
+                plies in stage 'match'. None disables instrumentation.
+
+            transpositions: (bool, TranspositionTable, None)
+                look up the board states already computed (e.g. by the
+                matches of the same opening) in a transposition table
+                instead of computing them again. True uses the table
+                shared by all matches (see transposition.get_table).
+                Ignored by the bitboard engine.
         """
         # self.init_match(init_param, idx, metadata)
         # self.init_arrays()
         # self.parse_match()
         # self.compute()
         # self.is_valid_match = True
+        if engine not in ('kernel', 'bitboard'):
+            raise ValueError('Unknown engine: %s' % engine)
+        self.engine = engine
+        self.new_token()
+        self.dtype = util.get_storage_dtype(dtype)
+        self.stats = stats
+        self.transpositions = self.get_transpositions(transpositions)
+        self.trie = self.path = None
         try:
             self.init_match(init_param, idx, metadata)
             self.init_arrays()
-            self.parse_match()
-            self.compute()
+            self.parse_compute()
+            if packed:
+                with instrument.timer(stats, 'pack'):
+                    self.pack_pieces()
             self.is_valid_match = True
+            instrument.count(stats, 'match', games=1,
+                             plies=len(self.ucimovements)+1)
         except:
             self.is_valid_match = False
+            instrument.count(stats, 'match', games=1, invalid=1)
+
+    @classmethod
+    def from_arrays(cls, ucimovements, arrays, idx=None, metadata=None):
+        """Alternative constructor that wraps already computed arrays
+        instead of parsing and computing the movements again.
+
+        INPUT:
+            ucimovements: (list(bytes))
+                uci movements of the match.
+            arrays: (dict, None)
+                B, X, S, Kw, Kb, pieces and promoted arrays of the match.
+                If None, the match is flagged as invalid.
+            idx: (int, tuple, None)
+                an index to order the match within a MatchSet
+            metadata: (dict, None)
+                pgn headers of the match.
+        """
+        match = cls.__new__(cls)
+        match.engine = 'kernel'
+        match.bitboards = None
+        match.stats = None
+        match.transpositions = None
+        match.trie = match.path = None
+        match.new_token()
+        match.pieces_mask = match.promoted_mask = None
+        match.init_match(ucimovements, idx, metadata)
+        if arrays is None:
+            match.dtype = util.get_storage_dtype()
+            match.is_valid_match = False
+            return match
+        match.dtype = util.get_storage_dtype(arrays['B'].dtype)
+        for name, value in arrays.items():
+            setattr(match, name, value)
+        match.movements = match.parse_ucimovements(match.ucimovements)
+        match.is_valid_match = True
+        return match
+
+    @classmethod
+    def from_trie(cls, trie, k, ucimovements, idx=None, metadata=None):
+        """Alternative constructor for game k of a MoveTrie. The X, S, Kw
+        and Kb board states are shared with the other games of the trie:
+        they are gathered from it on access (and kept in
+        memo.derived_cache), read only. See detach.
+
+        INPUT:
+            trie: (MoveTrie)
+                trie of the games, see trie.MoveTrie.
+            k: (int)
+                index of the game in the trie.
+            ucimovements: (list(bytes))
+                uci movements of the match.
+            idx: (int, tuple, None)
+                an index to order the match within a MatchSet
+            metadata: (dict, None)
+                pgn headers of the match.
+        """
+        path = trie.paths[k]
+        if path is None:
+            return cls.from_arrays(ucimovements, None, idx, metadata)
+        arrays = dict((name, trie.gather(path, name))
+                      for name in ('B', 'pieces', 'promoted'))
+        match = cls.from_arrays(ucimovements, arrays, idx, metadata)
+        match._X = match._S = match._Kw = match._Kb = None
+        match.trie = trie
+        match.path = path
+        return match
 
     def __getitem__(self, val):
         """ Get item special method implements specialized access to
@@ -348,7 +724,9 @@ class Match:
         cheap for the few situations where inspecting an individual board
         state is required. Therefore, any modification to the arrays in the
         board state will be propageted back to the original arrays in match
-        instance.
+        instance. The exception are the pieces and promoted vectors of a
+        packed match (see pack_pieces), which are read only copies unpacked
+        from the bitmasks of the board state.
 
         INPUT:
             val: (int)
@@ -360,8 +738,17 @@ class Match:
         board.S = self.S[val, ...]
         board.Kw = self.Kw[val, ...]
         board.Kb = self.Kb[val, ...]
-        board.pieces = self.pieces[val, ...]
-        board.promoted = self.promoted[val, ...]
+        if self.pieces_mask is not None:
+            # Unpack only this board state
+            board.pieces = util.unpack_bitmask(
+                self.pieces_mask[[val]], self.dtype)[0]
+            board.promoted = util.unpack_promoted(
+                self.promoted_mask[[val]], self.dtype)[0]
+            board.pieces.flags.writeable = False
+            board.promoted.flags.writeable = False
+        else:
+            board.pieces = self.pieces[val, ...]
+            board.promoted = self.promoted[val, ...]
         # board.pPawns = self.pPawns[val, ...]
         if val > 0:
             board.ucimovement = self.ucimovements[val]
@@ -394,6 +781,7 @@ class Match:
         # if b.ndim >= 1:
         #    print('This property is network!!')
         if ax is None:
+            import matplotlib.pyplot as plt
             fig = plt.figure()
             ax = fig.add_subplot(1, 1, 1)
             do_label = True
@@ -416,6 +804,7 @@ class Match:
             ax.set_title('-'.join(self.winner))
 
     def plot_all(self):
+        import matplotlib.pyplot as plt
         n = len(vector_names)
         [r, c] = util.get_closest_pair(n)
         fig = plt.figure()
@@ -428,14 +817,33 @@ class Match:
             ax.set_title(vname)
         # ax.legend(['white','black'])
 
+    def metrics(self, vec=None):
+        """Computes the per ply metrics of the match in one pass over
+        the X, S, Kw and Kb arrays.
+
+        INPUT:
+            vec: (list(str), None)
+                metric names, defaults to all vector_names.
+
+        OUTPUT:
+            dict with the 'b_' and 'w_' arrays of each metric.
+        """
+        n = self.plies
+        table = self.cached('metrics', lambda: metrics.compute_metrics(
+            self.X[n], self.S[n], self.Kw[n], self.Kb[n]))
+        if vec is None:
+            return dict(table)
+        out = dict()
+        for name in vec:
+            if 'b_'+name not in table:
+                raise ValueError('Unknown metric: %s' % name)
+            out['b_'+name] = table['b_'+name]
+            out['w_'+name] = table['w_'+name]
+        return out
+
     def ToPandas(self, vec):
-        var_dict={}
-        var_names=vector_names if vec is None else vec
-        
-        for var in var_names:
-            var_dict['b_'+var]= getattr(self, 'b_'+var)
-            var_dict['w_'+var]= getattr(self, 'w_'+var)
-        df=pd.DataFrame(var_dict)
+        import pandas as pd
+        df=pd.DataFrame(self.metrics(vec))
         df['winner']=self.winner[0]
         
         return df
@@ -449,6 +857,66 @@ class Match:
         else:
             return ('tables', 'None')
 
+    @property
+    def X(self):
+        if self._X is None:
+            return self.expand('X')
+        return self._X
+
+    @X.setter
+    def X(self, value):
+        self._X = value
+
+    @property
+    def S(self):
+        if self._S is None:
+            return self.expand('S')
+        return self._S
+
+    @S.setter
+    def S(self, value):
+        self._S = value
+
+    @property
+    def Kw(self):
+        if self._Kw is None:
+            return self.expand('Kw')
+        return self._Kw
+
+    @Kw.setter
+    def Kw(self, value):
+        self._Kw = value
+
+    @property
+    def Kb(self):
+        if self._Kb is None:
+            return self.expand('Kb')
+        return self._Kb
+
+    @Kb.setter
+    def Kb(self, value):
+        self._Kb = value
+
+    @property
+    def pieces(self):
+        if self._pieces is None and self.pieces_mask is not None:
+            return util.unpack_bitmask(self.pieces_mask, self.dtype)
+        return self._pieces
+
+    @pieces.setter
+    def pieces(self, value):
+        self._pieces = value
+
+    @property
+    def promoted(self):
+        if self._promoted is None and self.promoted_mask is not None:
+            return util.unpack_promoted(self.promoted_mask, self.dtype)
+        return self._promoted
+
+    @promoted.setter
+    def promoted(self, value):
+        self._promoted = value
+
     @property
     def Xw(self):
         return self.X[:, :PIECENO, :]
@@ -467,151 +935,166 @@ class Match:
         return self.S[:, PIECENO:, :]
         #return self.S[:, -1:15:-1, :]
 
+    @property
+    def plies(self):
+        # Board states visited when iterating the match. Iteration stops
+        # at the last movement (see __getitem__), so the per-ply
+        # properties do not include the final board state.
+        return slice(0, max(len(self), 1))
+
     @property
     def Dw(self):
         # Defensive network
         #return self.Xw*self.Sw.transpose()
-        return array([board.Dw for board in self])
+        n = self.plies
+        return self.cached('Dw', lambda: networks.defensive_network(self.Xw[n], self.Sw[n]))
 
     @property
     def Db(self):
         # Defensive network for black
         #return self.Xb*self.Sb.transpose()
-        return array([board.Db for board in self])
+        n = self.plies
+        return self.cached('Db', lambda: networks.defensive_network(self.Xb[n], self.Sb[n]))
 
     @property
     def Iw(self):
         # Influence network for white
         #return self.Sw*self.Sw.transpose()
-        return array([board.Iw for board in self])
+        n = self.plies
+        return self.cached('Iw', lambda: networks.influence_network(self.Sw[n]))
 
     @property
     def Ib(self):
         # Influence network for black
         #return self.Sb*self.Sb.transpose()
-        return array([board.Ib for board in self])
+        n = self.plies
+        return self.cached('Ib', lambda: networks.influence_network(self.Sb[n]))
 
     @property
     def Aw(self):
         # Attack network for white
         #return self.Sw*self.Xb.transpose()
-        return array([board.Aw for board in self])
+        n = self.plies
+        return self.cached('Aw', lambda: networks.attack_network(self.Sw[n], self.Xb[n]))
 
     @property
     def Ab(self):
         # Attack network for black
         #return self.Sb*self.Xa.transpose()
-        return array([board.Ab for board in self])
+        n = self.plies
+        return self.cached('Ab', lambda: networks.attack_network(self.Sb[n], self.Xw[n]))
 
     @property
     def Cw(self):
         # Clash network for white
         #return self.Sw*self.Sb.transpose()
-        return array([board.Cw for board in self])
+        n = self.plies
+        return self.cached('Cw', lambda: networks.clash_network(self.Sw[n], self.Sb[n]))
 
     @property
     def Cb(self):
         # Clash network for black
         #return self.Sb*self.Sw.transpose()
-        return array([board.Cb for board in self])
+        n = self.plies
+        return self.cached('Cb', lambda: networks.clash_network(self.Sb[n], self.Sw[n]))
 
     @property
     def cm(self):
-        # Clash network for black
-        #return self.Sb*self.Sw.transpose()
-        return array([board.cm for board in self])
+        # Contact matrix
+        n = self.plies
+        return self.cached('cm', lambda: networks.contact_matrix(self.X[n], self.S[n]))
 
     @property
     def w_pieceno(self):
         #return U*self.Xw*V.transpose()
-        return array([board.w_pieceno for board in self])
+        return self.metrics(['pieceno'])['w_pieceno']
 
     @property
     def b_pieceno(self):
         #return U*self.Xb*V.transpose()
-        return array([board.b_pieceno for board in self])
+        return self.metrics(['pieceno'])['b_pieceno']
 
     @property
     def w_accesible(self):
         #return U*self.Sw*V.transpose()
-        return array([board.w_accesible for board in self])
+        return self.metrics(['accesible'])['w_accesible']
 
     @property
     def b_accesible(self):
         #return U*self.Sb*V.transpose()
-        return array([board.b_accesible for board in self])
+        return self.metrics(['accesible'])['b_accesible']
 
     @property
     def w_Dconnectance(self):
         #return U*self.Dw*U.transpose()
-        return array([board.w_Dconnectance for board in self])
+        return self.metrics(['Dconnectance'])['w_Dconnectance']
 
     @property
     def b_Dconnectance(self):
         #return U*self.Db*U.transpose()
-        return array([board.b_Dconnectance for board in self])
+        return self.metrics(['Dconnectance'])['b_Dconnectance']
 
     @property
     def w_Iconnectance(self):
         #return U*self.Iw*U.transpose()
-        return array([board.w_Iconnectance for board in self])
+        return self.metrics(['Iconnectance'])['w_Iconnectance']
 
     @property
     def b_Iconnectance(self):
         #return U*self.Ib*U.transpose()
-        return array([board.b_Iconnectance for board in self])
+        return self.metrics(['Iconnectance'])['b_Iconnectance']
 
     @property
     def w_Aconnectance(self):
         #return U*self.Aw*U.transpose()
-        return array([board.w_Aconnectance for board in self])
+        return self.metrics(['Aconnectance'])['w_Aconnectance']
 
     @property
     def b_Aconnectance(self):
         #return U*self.Ab*U.transpose()
-        return array([board.b_Aconnectance for board in self])
+        return self.metrics(['Aconnectance'])['b_Aconnectance']
 
     @property
     def w_Cconnectance(self):
         #return U*self.Dw*U.transpose()
-        return array([board.w_Cconnectance for board in self])
+        return self.metrics(['Cconnectance'])['w_Cconnectance']
 
     @property
     def b_Cconnectance(self):
         #return U*self.Db*U.transpose()
-        return array([board.b_Cconnectance for board in self])
+        return self.metrics(['Cconnectance'])['b_Cconnectance']
 
     @property
     def w_king_accesibility(self):
         #return array(matmul(matmul(U, self.Ab), U.transpose())).squeeze()
-        return array([board.w_king_accesibility for board in self])
+        return self.metrics(['king_accesibility'])['w_king_accesibility']
 
     @property
     def b_king_accesibility(self):
         #return array(matmul(matmul(U, self.Aw), U.transpose())).squeeze()
-        return array([board.w_defense_on_king for board in self])
+        return self.metrics(['king_accesibility'])['b_king_accesibility']
 
     @property
     def w_defense_on_king(self):
         #return (array(matmul(matmul(U, self.Sw), self.Kw)).squeeze() / self.Kw.sum())
                #array(matmul(matmul(U, self.Kw), V.transpose())).squeeze())
-        return array([board.w_defense_on_king for board in self])
+        return self.metrics(['defense_on_king'])['w_defense_on_king']
 
     @property
     def b_defense_on_king(self):
         #return (array(matmul(matmul(U, self.Sb), self.Kb)).squeeze() / self.Kb.sum())
                #array(matmul(matmul(U, self.Kb), V.transpose())).squeeze())
-        return array([board.b_defense_on_king for board in self])
+        return self.metrics(['defense_on_king'])['b_defense_on_king']
 
     @property
     def w_attack_on_king(self):
         #return array(matmul(matmul(U, self.Sw), self.Kb)).squeeze()
-        return array([board.w_attack_on_king for board in self])
+        return self.metrics(['attack_on_king'])['w_attack_on_king']
 
     @property
     def b_attack_on_king(self):
         #return array(matmul(matmul(U, self.Sb), self.Kw)).squeeze()
-        return array([board.b_attack_on_king for board in self])
+        return self.metrics(['attack_on_king'])['b_attack_on_king']
 
     def init_match(self, init_param, idx, metadata):
         # Init instance logger
@@ -634,10 +1117,12 @@ class Match:
         if isinstance(init_param, str):
             # We have a file name, load the movements
             self.filename = init_param
+            self._game = None
             self.load_match(init_param)
-        elif isinstance(init_param, list):
+        elif isinstance(init_param, (list, MoveBuffer)):
             # We have a list of movements
             self.filename = None
+            self._game = None
             self.ucimovements = init_param
             self.metadata = metadata
         else:
@@ -656,34 +1141,161 @@ class Match:
             self.ucimovements = movements
 
         L = len(self.ucimovements)+1
-        self.B = zeros((L, MAXI, MAXJ), dtype=NPDTYPE)
-        self.X = zeros((L, MAXPIECES, BOARDSZ), dtype=NPDTYPE)
-        self.S = zeros((L, MAXPIECES, BOARDSZ), dtype=NPDTYPE)
-        self.Kw = zeros((L, BOARDSZ), dtype=NPDTYPE)
-        self.Kb = zeros((L, BOARDSZ), dtype=NPDTYPE)
-        self.pieces = zeros((L, MAXPIECES), dtype=NPDTYPE)
-        self.promoted = zeros((L, MAXPIECES), dtype=NPDTYPE)
-        self.movements = self.parse_ucimovements(self.ucimovements)
+        self.trie = self.path = None
+        with instrument.timer(self.stats, 'alloc'):
+            self.B = zeros((L, MAXI, MAXJ), dtype=self.dtype)
+            self.bitboards = None
+            if self.engine == 'bitboard':
+                # Matrices are expanded from the bitboards when first accessed
+                self._X = self._S = self._Kw = self._Kb = None
+            else:
+                self.X = zeros((L, MAXPIECES, BOARDSZ), dtype=self.dtype)
+                self.S = zeros((L, MAXPIECES, BOARDSZ), dtype=self.dtype)
+                self.Kw = zeros((L, BOARDSZ), dtype=self.dtype)
+                self.Kb = zeros((L, BOARDSZ), dtype=self.dtype)
+            self.pieces_mask = self.promoted_mask = None
+            self.pieces = zeros((L, MAXPIECES), dtype=self.dtype)
+            self.promoted = zeros((L, MAXPIECES), dtype=self.dtype)
+        with instrument.timer(self.stats, 'decode'):
+            self.movements = self.parse_ucimovements(self.ucimovements)
+        self.invalidate()
 
     def parse_match(self, movements=None):
-        if movements is not None:
-            parse_match_from_movlst(self, movements)
-        else:
-            parse_match_from_movlst(self, self.movements)
+        self.detach()
+        packed = self.pieces_mask is not None
+        if packed:
+            self.unpack_pieces()
+        with instrument.timer(self.stats, 'replay'):
+            if movements is not None:
+                parse_match_from_movlst(self, movements)
+            else:
+                parse_match_from_movlst(self, self.movements)
+        if packed:
+            self.pack_pieces()
+        self.invalidate()
 
     def load_match(self, fname):
-        self.ucimovements, self.metadata , self.game= util.load_pgn(fname)
+        self.ucimovements, self.metadata, self._game = util.load_pgn(fname)
+
+    @property
+    def game(self):
+        # python-chess game of a match loaded from a pgn file. The native
+        # reader does not build it, it is read again on first access.
+        if self._game is None and self.filename is not None:
+            self._game = util.load_pgn(self.filename, native=False)[2]
+        return self._game
 
     def parse_ucimovements(self, movements):
-        # mlist = list()
-        # for l in movements:
-        #     print(l)
-        #     mlist.append([*l][:4])
-        # return array(mlist) - UCI_OFFSET
-        return array([[*l][:4] for l in movements]) - UCI_OFFSET
+        # One vectorized decode of the buffer of all the movements
+        if not isinstance(movements, MoveBuffer):
+            movements = MoveBuffer(movements)
+        return movements.decode()
 
     def compute(self):
-        compute.compute_match(self)
+        self.detach()
+        with instrument.timer(self.stats, 'compute'):
+            if self.engine == 'bitboard':
+                # Imported on first use, its kernels are not needed otherwise
+                from .bitboard import BitBoards
+                self.bitboards = BitBoards(self.B, self.promoted)
+                self._X = self._S = self._Kw = self._Kb = None
+            elif self.transpositions is not None:
+                self.transpositions.compute(self)
+            else:
+                compute.compute_match(self)
+        self.invalidate()
+
+    def parse_compute(self):
+        """Replays the movements and computes the matrices of all the
+        board states of the match in a single native call.
+        """
+        if self.engine == 'bitboard':
+            self.parse_match()
+            self.compute()
+            return
+        self.detach()
+        packed = self.pieces_mask is not None
+        if packed:
+            self.unpack_pieces()
+        # Replay and compute are fused, so they are timed as one stage
+        with instrument.timer(self.stats, 'replay_compute'):
+            if self.transpositions is not None:
+                self.transpositions.parse_compute(self)
+            else:
+                compute.parse_compute_match(self)
+        if packed:
+            self.pack_pieces()
+        self.invalidate()
+
+    def get_transpositions(self, transpositions):
+        # Transposition table of the match, see Match
+        if transpositions is None or transpositions is False:
+            return None
+        if transpositions is True:
+            from . import transposition
+            return transposition.get_table()
+        return transpositions
+
+    def pack_pieces(self):
+        """Replaces the pieces and promoted arrays by one uint32 bitmask
+        per board state. Both are unpacked on access.
+        """
+        self.pieces_mask = util.pack_bitmask(self._pieces)
+        self.promoted_mask = util.pack_promoted(self._promoted)
+        self._pieces = self._promoted = None
+
+    def unpack_pieces(self):
+        """Restores the pieces and promoted arrays packed by pack_pieces"""
+        self._pieces, self._promoted = self.pieces, self.promoted
+        self.pieces_mask = self.promoted_mask = None
+
+    def cached(self, name, func):
+        """Returns the derived value name of this match, computed with
+        func on the first access and kept in memo.derived_cache until the
+        base arrays change. Cached arrays are read only.
+        """
+        return memo.derived_cache.get((self.token, name), func)
+
+    def invalidate(self):
+        """Drops the cached networks and metrics of this match. Called
+        whenever the base arrays are rewritten.
+        """
+        memo.derived_cache.discard(self.token)
+        self.new_token()
+
+    def new_token(self):
+        # Token of the current contents of the arrays, the entries cached
+        # under it are also dropped when the match is garbage collected
+        self.token = memo.new_token()
+        weakref.finalize(self, memo.derived_cache.discard, self.token)
+
+    def expand(self, name):
+        # X, S, Kw or Kb of a match that keeps its board states as
+        # bitboards or shares them with the games of a trie
+        if self.bitboards is not None:
+            self.expand_bitboards()
+        elif self.trie is not None:
+            return self.cached('trie_' + name,
+                               lambda: self.trie.gather(self.path, name))
+        return getattr(self, '_' + name)
+
+    def detach(self):
+        """Replaces the board states shared with the games of a trie by
+        private (writable) copies. Called before they are recomputed.
+        """
+        if self.trie is None:
+            return
+        self._X, self._S, self._Kw, self._Kb = (
+            array(self.trie.gather(self.path, name))
+            for name in ('X', 'S', 'Kw', 'Kb'))
+        self.trie = self.path = None
+        self.invalidate()
+
+    def expand_bitboards(self):
+        """Fills the X, S, Kw and Kb matrices from the bitboards computed
+        by the bitboard engine.
+        """
+        self._X, self._S, self._Kw, self._Kb = self.bitboards.expand(self.B)
 
     def print(self, n=None):
         if n:
@@ -720,7 +1332,6 @@ class BoardState:
     def init_board(self, board=None, movement=None):
         """
         """
-        self.set_board(board)
         self.ucimovement = movement
         if movement is not None and len(movement) >= 4:
             self.movement = self.parse_ucimovement(movement)
@@ -733,6 +1344,7 @@ class BoardState:
         self.promoted = zeros((1, MAXPIECES), dtype=NPDTYPE)
         self.Kw = zeros((1, BOARDSZ), dtype=NPDTYPE)
         self.Kb = zeros((1, BOARDSZ), dtype=NPDTYPE)
+        self.set_board(board)
 
     def set_board(self, board=None):
         # This is mostly intended for testing, so we only ask for a board matrix,
@@ -743,11 +1355,10 @@ class BoardState:
         if board is None:
             self.B = zeros((MAXI, MAXJ), dtype=NPDTYPE)
         elif isinstance(board, (str, bytes)):
-            # This should be an epd encoded board
-            self.B = util.parse_epd_board(board)
-            self.logger.info('Parsed EPD board:')
-            self.logger.info(board)
-            self.logger.info(self.board)
+            # This should be an epd encoded board, which may have pawns
+            # promoted to extra pieces
+            self.B, self.promoted[0] = util.parse_epd_board(board, NPDTYPE)
+            self.logger.info('Parsed EPD board: %s' % board)
         else:
             self.B = board
 
@@ -1,6 +1,7 @@
 # from numpy import nonzero
-from numba import jit, void
-from numpy import array
+from numba import jit, prange, config, get_num_threads, set_num_threads
+from numpy import (
+    array, zeros, empty, int8, int64, cumsum, concatenate)
 
 
 from .constants import (
@@ -17,12 +18,64 @@ from .constants import (
     NBDTYPE, NPDTYPE,
     CHECK_KNIGHT, CHECK_W_PAWN, CHECK_B_PAWN, CHECK_KING, CHECK_KING_AS_QUEEN, 
     CHECK_CASTLE, CHECK_BISHOP, CHECK_QUEEN, W_KING_IDX, B_KING_IDX,
+    MAXPIECES, BOARDSZ, UCISZ, JIT_CACHE,
     )
 
+from . import util
+from .pgn import MoveBuffer
+from .parse import replay_match_squares, replay_tree_squares
+
 
 def compute_match(match):
-    for moveno in range(len(match)+1):
-        compute_state(match, moveno)
+    """Computes the X, S, Kw and Kb matrices of every board state of a
+    match with a single call to the whole-match kernel.
+    """
+    compute_match_matrices(match.B, match.X, match.S, match.promoted,
+                           match.Kw, match.Kb)
+
+
+def parse_compute_match(match):
+    """Replays the movements of a match and computes the matrices of
+    every resulting board state in a single native call.
+    """
+    parse_compute_match_matrices(match.movements, match.B, match.X, match.S,
+                                 match.pieces, match.promoted, match.Kw,
+                                 match.Kb)
+
+
+def compute_boards(B, promoted=None):
+    """Computes the matrices of a stack of N independent board states
+    (e.g. positions parsed by util.parse_epd_boards) in a single native
+    call, with no BoardState instances.
+
+    INPUT:
+        B: (numpy array)
+            (N, MAXI, MAXJ) boards.
+        promoted: (numpy array, None)
+            (N, MAXPIECES) promoted vectors, no promoted pawns if None.
+
+    OUTPUT:
+        dict with the B, promoted, X, S, Kw and Kb arrays, stacked as
+        the ones of a Match and of the dtype of B.
+    """
+    N = B.shape[0]
+    if promoted is None:
+        promoted = zeros((N, MAXPIECES), B.dtype)
+    arrays = {'B': B, 'promoted': promoted,
+              'X': zeros((N, MAXPIECES, BOARDSZ), B.dtype),
+              'S': zeros((N, MAXPIECES, BOARDSZ), B.dtype),
+              'Kw': zeros((N, BOARDSZ), B.dtype),
+              'Kb': zeros((N, BOARDSZ), B.dtype)}
+    compute_match_matrices(B, arrays['X'], arrays['S'], promoted,
+                           arrays['Kw'], arrays['Kb'])
+    return arrays
+
+
+def compute_epd(epds, dtype=None):
+    """Parses and computes a batch of EPD (or FEN) positions, see
+    util.parse_epd_boards and compute_boards.
+    """
+    return compute_boards(*util.parse_epd_boards(epds, dtype))
 
 
 def compute_state(board_state, moveno=None):
@@ -54,8 +107,7 @@ def compute_state(board_state, moveno=None):
     compute_board_matrices(B, X, S, promoted, Kw, Kb)
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE[:], NBDTYPE[:,:], NBDTYPE[:,:]), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def compute_board_matrices(B, X, S, promoted, Kw, Kb):
     # Set default king movement for test runs
     bKing = array([INVALID_KING, INVALID_KING])
@@ -85,25 +137,7 @@ def compute_board_matrices(B, X, S, promoted, Kw, Kb):
             #Store position of this piece in the board using matrix X
             X[pn, cn] = 1
 
-            if IS_CASTLE(p):
-                CHECK_CASTLE(B, S, i, j, p, pn)
-
-            elif IS_BISHOP(p):
-                CHECK_BISHOP(B, S, i, j, p, pn)
-
-            elif IS_QUEEN(p):
-                CHECK_QUEEN(B, S, i, j, p, pn)
-
-            elif IS_KNIGHT(p):
-                CHECK_KNIGHT(B, S, i, j, p, pn)
-
-            elif IS_W_PAWN(p):
-                CHECK_W_PAWN(B, S, i, j, p, pn)
-
-            elif IS_B_PAWN(p):
-                CHECK_B_PAWN(B, S, i, j, p, pn)
-
-            elif IS_B_KING(p):
+            if IS_B_KING(p):
                 # Only store movements, we need to know all threats before
                 bKing[0] = i
                 bKing[1] = j
@@ -113,6 +147,68 @@ def compute_board_matrices(B, X, S, promoted, Kw, Kb):
                 wKing[0] = i
                 wKing[1] = j
 
+            else:
+                CHECK_PIECE(B, S, i, j, p, pn)
+
+    CHECK_KINGS(B, S, Kw, Kb, wKing, bKing)
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def compute_board_matrices_squares(B, squares, X, S, promoted, Kw, Kb):
+    """compute_board_matrices enumerating the pieces from the piece list
+    of the board (see parse.replay_match_squares) instead of searching
+    the 64 cells.
+    """
+    bKing = array([INVALID_KING, INVALID_KING])
+    wKing = array([INVALID_KING, INVALID_KING])
+    for k in range(MAXPIECES):
+        cn = squares[k]
+        if cn < 0:
+            continue
+        i = cn // MAXI
+        j = cn % MAXI
+        p = B[i, j]
+        pn = IMAPNUM(p)
+        if promoted[pn] != 0:
+            p = promoted[pn]
+            pn = IMAPNUM(p)
+        X[pn, cn] = 1
+        if IS_B_KING(p):
+            bKing[0] = i
+            bKing[1] = j
+        elif IS_W_KING(p):
+            wKing[0] = i
+            wKing[1] = j
+        else:
+            CHECK_PIECE(B, S, i, j, p, pn)
+
+    CHECK_KINGS(B, S, Kw, Kb, wKing, bKing)
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def CHECK_PIECE(B, S, i, j, p, pn):
+    # Accesibility of any piece but the kings
+    if IS_CASTLE(p):
+        CHECK_CASTLE(B, S, i, j, p, pn)
+
+    elif IS_BISHOP(p):
+        CHECK_BISHOP(B, S, i, j, p, pn)
+
+    elif IS_QUEEN(p):
+        CHECK_QUEEN(B, S, i, j, p, pn)
+
+    elif IS_KNIGHT(p):
+        CHECK_KNIGHT(B, S, i, j, p, pn)
+
+    elif IS_W_PAWN(p):
+        CHECK_W_PAWN(B, S, i, j, p, pn)
+
+    elif IS_B_PAWN(p):
+        CHECK_B_PAWN(B, S, i, j, p, pn)
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def CHECK_KINGS(B, S, Kw, Kb, wKing, bKing):
     # WHITE KING: check now with all potential threats computed
     Accb = SUMDIM2(S[16:, :])
     CHECK_KING(B, S, Accb, wKing, bKing, W_KING_IDX)
@@ -125,3 +221,130 @@ def compute_board_matrices(B, X, S, promoted, Kw, Kb):
     CHECK_KING_AS_QUEEN(B, Kw, wKing[0], wKing[1])
     CHECK_KING_AS_QUEEN(B, Kb, bKing[0], bKing[1])
 
+
+@jit(nopython=True, cache=JIT_CACHE)
+def compute_match_matrices(B, X, S, promoted, Kw, Kb):
+    # The board kernel accumulates on S, Kw and Kb, so clear them first
+    # to make recomputations of the same match idempotent
+    X[...] = 0
+    S[...] = 0
+    Kw[...] = 0
+    Kb[...] = 0
+    for n in range(B.shape[0]):
+        compute_board_matrices(
+            B[n], X[n], S[n], promoted[n], Kw[n:n+1], Kb[n:n+1])
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def parse_compute_match_matrices(movements, B, X, S, pieces, promoted, Kw, Kb):
+    # The pieces of each board state come from the piece list of replay
+    squares = empty((B.shape[0], MAXPIECES), NPDTYPE)
+    replay_match_squares(movements, B, pieces, promoted, squares)
+    X[...] = 0
+    S[...] = 0
+    Kw[...] = 0
+    Kb[...] = 0
+    for n in range(B.shape[0]):
+        compute_board_matrices_squares(
+            B[n], squares[n], X[n], S[n], promoted[n], Kw[n:n+1], Kb[n:n+1])
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def parse_compute_tree_matrices(parents, movements, B, X, S, pieces,
+                                promoted, Kw, Kb):
+    # Board states of a tree of movements, see parse.replay_tree_squares
+    squares = empty((B.shape[0], MAXPIECES), NPDTYPE)
+    replay_tree_squares(parents, movements, B, pieces, promoted, squares)
+    X[...] = 0
+    S[...] = 0
+    Kw[...] = 0
+    Kb[...] = 0
+    for n in range(B.shape[0]):
+        compute_board_matrices_squares(
+            B[n], squares[n], X[n], S[n], promoted[n], Kw[n:n+1], Kb[n:n+1])
+
+
+@jit(nopython=True, parallel=True, cache=JIT_CACHE)
+def parse_compute_corpus_matrices(movements, moffsets, offsets, B, X, S,
+                                  pieces, promoted, Kw, Kb):
+    """parse_compute_match_matrices over all the matches of a corpus in
+    parallel threads. The movements and board states of all the matches
+    are concatenated: match k has the movements moffsets[k]:moffsets[k+1]
+    and the board states offsets[k]:offsets[k+1]. Matches are replayed in
+    parallel, and then every ply of the corpus is computed in parallel
+    from its piece list.
+    """
+    squares = empty((B.shape[0], MAXPIECES), NPDTYPE)
+    for k in prange(offsets.shape[0] - 1):
+        o0 = offsets[k]
+        o1 = offsets[k+1]
+        if o1 > o0:
+            replay_match_squares(movements[moffsets[k]:moffsets[k+1]],
+                                 B[o0:o1], pieces[o0:o1], promoted[o0:o1],
+                                 squares[o0:o1])
+    for n in prange(B.shape[0]):
+        # Explicit loops, row slices are much slower in nopython mode
+        for pn in range(MAXPIECES):
+            for cn in range(BOARDSZ):
+                X[n, pn, cn] = 0
+                S[n, pn, cn] = 0
+        for cn in range(BOARDSZ):
+            Kw[n, cn] = 0
+            Kb[n, cn] = 0
+        compute_board_matrices_squares(
+            B[n], squares[n], X[n], S[n], promoted[n], Kw[n:n+1], Kb[n:n+1])
+
+
+def parse_compute_corpus(movements_set, dtype=None, threads=None):
+    """Replays and computes a list of games in a single parallel native
+    call (see parse_compute_corpus_matrices), writing into arrays shared
+    by all of them.
+
+    INPUT:
+        movements_set: (list(MoveBuffer, list(bytes)))
+            uci movements of each game.
+        dtype: (str, numpy dtype, None)
+            storage dtype of the arrays, see Match.
+        threads: (int, None)
+            number of threads, defaults to all the numba threads.
+
+    OUTPUT:
+        (offsets, arrays), with arrays a dict with the B, X, S, Kw, Kb,
+        pieces and promoted arrays of all the games, game k being the rows
+        offsets[k]:offsets[k+1]. Invalid games (see Match) have no rows.
+    """
+    dtype = util.get_storage_dtype(dtype)
+    decoded = list()
+    moffsets = zeros(len(movements_set) + 1, int64)
+    for k, movements in enumerate(movements_set):
+        if not isinstance(movements, MoveBuffer):
+            movements = MoveBuffer(movements)
+        try:
+            decoded.append(movements.decode())
+            moffsets[k+1] = moffsets[k] + len(movements)
+        except ValueError:
+            moffsets[k+1] = moffsets[k]
+    # One more board state than movements for each valid game
+    valid = moffsets[1:] > moffsets[:-1]
+    offsets = moffsets.copy()
+    offsets[1:] += cumsum(valid)
+    movements = concatenate(decoded) if decoded else zeros((0, UCISZ), int8)
+    L = offsets[-1]
+    arrays = {'B': zeros((L, MAXI, MAXJ), dtype),
+              'X': zeros((L, MAXPIECES, BOARDSZ), dtype),
+              'S': zeros((L, MAXPIECES, BOARDSZ), dtype),
+              'Kw': zeros((L, BOARDSZ), dtype),
+              'Kb': zeros((L, BOARDSZ), dtype),
+              'pieces': zeros((L, MAXPIECES), dtype),
+              'promoted': zeros((L, MAXPIECES), dtype)}
+    previous = get_num_threads()
+    if threads is not None:
+        set_num_threads(max(1, min(threads, config.NUMBA_NUM_THREADS)))
+    try:
+        parse_compute_corpus_matrices(
+            movements, moffsets, offsets, arrays['B'], arrays['X'],
+            arrays['S'], arrays['pieces'], arrays['promoted'], arrays['Kw'],
+            arrays['Kb'])
+    finally:
+        set_num_threads(previous)
+    return offsets, arrays
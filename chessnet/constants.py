@@ -11,10 +11,26 @@ data_path = os.path.join(install_path, 'data')
 testdirectory = data_path
 testfilename = os.path.join(testdirectory, 'test', 'enroque_rey.pgn')
 testmultifilename = os.path.join(testdirectory, 'fischer_60_mem.pgn')
-EPD_init_board = b'RNBKQBNR/PPPPPPPP/8/8/8/8/pppppppp/rnbkqbnr'
+# Piece placement of the initial board, see util.parse_epd_boards
+EPD_init_board = b'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR'
 
 VERBOSITY = False
 
+# Compiled kernels are cached on disk (in __pycache__, or NUMBA_CACHE_DIR if
+# set), so only the first import after a change pays the compilation. Numba
+# only checks the source file of each cached function, so clear the cache
+# after editing the macros of this module. CHESSNET_JIT_CACHE=0 disables it.
+JIT_CACHE = os.environ.get('CHESSNET_JIT_CACHE', '1') != '0'
+# Macros with explicit signatures are compiled at import, the ones no kernel
+# uses (the _VEC versions, IS_PAWN and IS_PROMOTED) only on first call.
+
+# Library version, also read by setup.py
+VERSION = '0.3.0'
+
+# Version of the board replay and compute kernels. Bump it whenever a change
+# alters the arrays they produce, so results cached on disk are recomputed.
+KERNEL_VERSION = 1
+
 
 """
 /////////////////////////////////////////////////////////////
@@ -65,9 +81,11 @@ TRUE = not FALSE
 EMPTY = 0
 
 NPDTYPE = npint_
-# NPDTYPE = npuint8
 NBDTYPE = nbint_
-# NBDTYPE = nbuint8
+
+# Dtypes accepted for the stored match arrays (B, X, S, Kw, Kb, pieces,
+# promoted). The array kernels are compiled lazily for each of them.
+STORAGE_DTYPES = ('int64', 'int8', 'uint8')
 
 BOARDX = 8
 BOARDY = 8
@@ -76,6 +94,9 @@ MAXPIECES = BOARDX*4
 
 UCISZ = 4
 UCISZ_NUM = 4
+# Bytes of each movement in a MoveBuffer: the uci movement and the
+# promotion suffix, padded with spaces
+UCIWIDTH = UCISZ + 1
 MAXI = 8
 MAXJ = 8
 PIECENO = MAXI*2
@@ -161,35 +182,35 @@ B_PAWN_KNIGHT_KING  = 31 + EMPTY
 B_PAWN_CASTLE_KING  = 32 + EMPTY
 
 
-@jit(NBDTYPE(NBDTYPE), nopython=True)
+@jit(NBDTYPE(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def MAPNUM(X):
     return X + EMPTY + 1
 
 
-@jit(NBDTYPE(NBDTYPE,NBDTYPE), nopython=True)
+@jit(NBDTYPE(NBDTYPE,NBDTYPE), nopython=True, cache=JIT_CACHE)
 def MAPCELL(i, j):
     return i*MAXI + j
 
 
-@jit(NBDTYPE(NBDTYPE), nopython=True)
+@jit(NBDTYPE(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IMAPNUM(X):
     return X - EMPTY - 1
 
 
-@jit(NBDTYPE[:](NBDTYPE[:]), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def MAPNUM_VEC(X):
     return X + EMPTY + 1
 
 
-@jit(NBDTYPE[:](NBDTYPE[:]), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def IMAPNUM_VEC(X):
     return X - EMPTY - 1
 
 
-@jit(NBDTYPE[:](NBDTYPE[:, :]), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def SUMDIM1(A):    
     n,m = A.shape
-    out = zeros((n,), dtype=NPDTYPE)
+    out = zeros((n,), dtype=A.dtype)
     #sum(A,axis=0,out=Aout)
     #return Aout 
     for i in range(n):
@@ -198,10 +219,10 @@ def SUMDIM1(A):
     return out
 
 
-@jit(NBDTYPE[:](NBDTYPE[:, :]), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def SUMDIM2(A):    
     n, m = A.shape
-    out = zeros((m,), dtype=NPDTYPE)
+    out = zeros((m,), dtype=A.dtype)
     #sum(A,axis=0,out=Aout)
     #return Aout 
     for i in range(n):
@@ -211,27 +232,27 @@ def SUMDIM2(A):
 
 
 # Macros to detect if a cell is empty or occupied
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_EMPTY(X):
     return X == EMPTY
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def IS_PROMOTED(X):
     return X != 0
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_OCCUPIED(X):
     return X != EMPTY
 
 
-@jit(bool_(NBDTYPE, NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE, NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_OUTSIDE(I, J):
     return I < 0 or I >= MAXI or J < 0 or J >= MAXJ
 
 
-@jit(bool_(NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_KING_ACCESIBLE(x1, y1, x2, y2):
     """Checks if the (x1,y1) position can be accesed by a king in (x2,y2)"""
     if x2 == INVALID_KING or y2 == INVALID_KING:
@@ -244,239 +265,239 @@ def IS_KING_ACCESIBLE(x1, y1, x2, y2):
 
 
 # Macros to detect the identity of a piece
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_PAWN(X):
     return X >= W_PAWN_CASTLE_QUEEN and X <= W_PAWN_CASTLE_KING
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_PAWN(X):
     return X >= B_PAWN_CASTLE_QUEEN and X <= B_PAWN_CASTLE_KING
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def IS_PAWN(X):
     return IS_W_PAWN(X) or IS_B_PAWN(X)
 
 
-@jit(bool_[:](NBDTYPE[:]), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def IS_W_PAWN_VEC(X):
     return logical_and(X >= W_PAWN_CASTLE_QUEEN, X <= W_PAWN_CASTLE_KING)
 
 
-@jit(bool_[:](NBDTYPE[:]), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def IS_B_PAWN_VEC(X):
     return logical_and(X >= B_PAWN_CASTLE_QUEEN, X <= B_PAWN_CASTLE_KING)
 
 
-@jit(bool_[:](NBDTYPE[:]), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def IS_PAWN_VEC(X):
     return logical_or(IS_W_PAWN_VEC(X), IS_B_PAWN_VEC(X))
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_CASTLE_QUEEN(X):
     return X == W_CASTLE_QUEEN
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_CASTLE_KING(X):
     return X == W_CASTLE_KING
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_CASTLE(X):
     return IS_W_CASTLE_QUEEN(X) or IS_W_CASTLE_KING(X)
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_CASTLE_QUEEN(X):
     return X == B_CASTLE_QUEEN
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_CASTLE_KING(X):
     return X == B_CASTLE_KING
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_CASTLE(X):
     return IS_B_CASTLE_QUEEN(X) or IS_B_CASTLE_KING(X)
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_CASTLE(X):
     return IS_B_CASTLE(X) or IS_W_CASTLE(X)
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_KNIGHT_QUEEN(X):
     return X == W_KNIGHT_QUEEN
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_KNIGHT_KING(X):
     return X == W_KNIGHT_KING
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_KNIGHT(X):
     return IS_W_KNIGHT_QUEEN(X) or IS_W_KNIGHT_KING(X)
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_KNIGHT_QUEEN(X):
     return X == B_KNIGHT_QUEEN
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_KNIGHT_KING(X):
     return X == B_KNIGHT_KING
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_KNIGHT(X):
     return IS_B_KNIGHT_QUEEN(X) or IS_B_KNIGHT_KING(X)
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_KNIGHT(X):
     return IS_B_KNIGHT(X) or IS_W_KNIGHT(X)
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_BISHOP_QUEEN(X):
     return X == W_BISHOP_QUEEN
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_BISHOP_KING(X):
     return X == W_BISHOP_KING
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_BISHOP(X):
     return IS_W_BISHOP_QUEEN(X) or IS_W_BISHOP_KING(X)
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_BISHOP_QUEEN(X):
     return X == B_BISHOP_QUEEN
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_BISHOP_KING(X):
     return X == B_BISHOP_KING
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_BISHOP(X):
     return IS_B_BISHOP_QUEEN(X) or IS_B_BISHOP_KING(X)
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_BISHOP(X):
     return IS_B_BISHOP(X) or IS_W_BISHOP(X)
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_QUEEN(X):
     return X == W_QUEEN
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_KING(X):
     return X == W_KING
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_QUEEN(X):
     return X == B_QUEEN
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_KING(X):
     return X == B_KING
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_KING(X):
     return IS_W_KING(X) or IS_B_KING(X)
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_QUEEN(X):
     return IS_W_QUEEN(X) or IS_B_QUEEN(X)
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_WHITE(X):
     return X >= W_CASTLE_QUEEN and X <= W_PAWN_CASTLE_KING
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_BLACK(X):
     return X >= B_CASTLE_QUEEN and X <= B_PAWN_CASTLE_KING
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_EMPTY(X):
     return not IS_WHITE(X)
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_EMPTY(X):
     return not IS_BLACK(X)
 
 
 # Macros to detect special movements that are not evident
 # in algebraic coding (castling and enpassant captures)
-@jit(bool_(NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE, NBDTYPE, NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_KING_CASTLING(PZ, X0, XF):
     return IS_KING(PZ) and X0 == KING_X and XF == CASTLING_KING_KING_DEST_X
 
 
-@jit(bool_(NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE, NBDTYPE, NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_QUEEN_CASTLING(PZ, X0, XF):
     return IS_KING(PZ) and X0 == KING_X and XF == CASTLING_QUEEN_KING_DEST_X
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_ENPASSANT_ROW(X):
     return X == 4  # ROW BEFORE WHITE CAPTURES BLACK
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_ENPASSANT_ROW(X):
     return X == 3  # ROW BEFORE BLACK CAPTURES WHITE
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_PAWN_ROW(X):
     return X == 1
 
 
-@jit(bool_(NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_PAWN_ROW(X):
     return X == 6
 
 
-@jit(bool_(NBDTYPE, NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE, NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_PAWN_CAPTURE(Y0, YF):
     return Y0 != YF
 
 
-@jit(bool_(NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_W_ENPASSANT(PZ1, DEST, X0, YF):
     return IS_W_PAWN(PZ1) and IS_PAWN_CAPTURE(X0, YF) and IS_W_ENPASSANT_ROW(X0) and IS_W_EMPTY(DEST)
 
 
-@jit(bool_(NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_B_ENPASSANT(PZ1, DEST, X0, YF):
     return IS_B_PAWN(PZ1) and IS_PAWN_CAPTURE(X0, YF) and IS_B_ENPASSANT_ROW(X0) and IS_B_EMPTY(DEST)
 
 
-@jit(bool_(NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(bool_(NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True, cache=JIT_CACHE)
 def IS_ENPASSANT(PZ, DEST, Y0, YF):
     return IS_W_ENPASSANT(PZ, DEST, Y0, YF) or IS_B_ENPASSANT(PZ, DEST, Y0, YF)
 
@@ -484,8 +505,7 @@ def IS_ENPASSANT(PZ, DEST, Y0, YF):
 # Check the different directions of movement
 # The position of IS_OCCUPIED call determines
 # whether we check until last free place
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_DOWN(B, S, i, j, p, pn):
     for n in range(j-1, -1, -1):
         c = B[i, n]
@@ -495,8 +515,7 @@ def CHECK_DOWN(B, S, i, j, p, pn):
             break
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_UP(B, S, i, j, p, pn):
     for n in range(j+1, MAXJ):
         c = B[i, n]
@@ -506,8 +525,7 @@ def CHECK_UP(B, S, i, j, p, pn):
             break
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_LEFT(B, S, i, j, p, pn):
     for n in range(i-1, -1, -1):
         c = B[n, j]
@@ -517,8 +535,7 @@ def CHECK_LEFT(B, S, i, j, p, pn):
             break
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_RIGHT(B, S, i, j, p, pn):
     for n in range(i+1, MAXI):
         c = B[n, j]
@@ -529,8 +546,7 @@ def CHECK_RIGHT(B, S, i, j, p, pn):
 
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_UPLEFT(B, S, i, j, p, pn):
     m = i
     for n in range(j+1, MAXJ):
@@ -544,8 +560,7 @@ def CHECK_UPLEFT(B, S, i, j, p, pn):
             break
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_DOWNLEFT(B, S, i, j, p, pn):
     m = i
     for n in range(j-1, -1, -1):
@@ -559,8 +574,7 @@ def CHECK_DOWNLEFT(B, S, i, j, p, pn):
             break
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_UPRIGHT(B, S, i, j, p, pn):
     m = i
     for n in range(j+1, MAXJ):
@@ -574,8 +588,7 @@ def CHECK_UPRIGHT(B, S, i, j, p, pn):
             break
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_DOWNRIGHT(B, S, i, j, p, pn):
     m = i
     for n in range(j-1, -1, -1):
@@ -589,8 +602,7 @@ def CHECK_DOWNRIGHT(B, S, i, j, p, pn):
             break
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_CASTLE(B, S, i, j, p, pn):
     CHECK_UP(B, S, i, j, p, pn)
     CHECK_DOWN(B, S, i, j, p, pn)
@@ -598,8 +610,7 @@ def CHECK_CASTLE(B, S, i, j, p, pn):
     CHECK_RIGHT(B, S, i, j, p, pn)
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_BISHOP(B, S, i, j, p, pn):
     CHECK_UPLEFT(B, S, i, j, p, pn)
     CHECK_DOWNLEFT(B, S, i, j, p, pn)
@@ -607,8 +618,7 @@ def CHECK_BISHOP(B, S, i, j, p, pn):
     CHECK_DOWNRIGHT(B, S, i, j, p, pn)
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_QUEEN(B, S, i, j, p, pn):
     CHECK_UP(B, S, i, j, p, pn)
     CHECK_DOWN(B, S, i, j, p, pn)
@@ -620,13 +630,12 @@ def CHECK_QUEEN(B, S, i, j, p, pn):
     CHECK_DOWNRIGHT(B, S, i, j, p, pn)
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :], NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_KING_AS_QUEEN(B, S, i, j):
     CHECK_QUEEN(B, S, i, j, 0, 0)
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_KNIGHT(B, S, i, j, p, pn):
     for (x, y) in KNIGHT_MOVES:
         x += i
@@ -640,8 +649,7 @@ def CHECK_KNIGHT(B, S, i, j, p, pn):
             break
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_W_PAWN(B, S, i, j, p, pn):
     for (x, y) in PAWN_MOVES_W:
         if y == 2 and not IS_W_PAWN_ROW(j):
@@ -661,8 +669,7 @@ def CHECK_W_PAWN(B, S, i, j, p, pn):
     
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :],
-          NBDTYPE, NBDTYPE, NBDTYPE, NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_B_PAWN(B, S, i, j, p, pn):
     for (x, y) in PAWN_MOVES_B:
         if y == -2 and not IS_B_PAWN_ROW(j):
@@ -681,8 +688,7 @@ def CHECK_B_PAWN(B, S, i, j, p, pn):
             S[pn, cn] += 1
 
 
-@jit(void(NBDTYPE[:, :], NBDTYPE[:, :], NBDTYPE[:],
-          NBDTYPE[:], NBDTYPE[:], NBDTYPE), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def CHECK_KING(B, S, A2, king1, king2, pn):
     if king1[0] != INVALID_KING:
         # for (n = 0; n < KING_MOVENO; n += 1 )
@@ -701,4 +707,7 @@ def CHECK_KING(B, S, A2, king1, king2, pn):
             S[pn, cn] += 1
 
 W_KING_IDX = IMAPNUM(W_KING)
-B_KING_IDX = IMAPNUM(B_KING)
\ No newline at end of file
+B_KING_IDX = IMAPNUM(B_KING)
+# Piece code stored in promoted for each slot: pawns always promote to a
+# queen of their color (see parse.__find_promoted_num)
+PROMOTION_CODES = array([W_QUEEN]*PIECENO + [B_QUEEN]*PIECENO)
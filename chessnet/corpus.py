@@ -0,0 +1,199 @@
+import os
+import json
+
+from numpy import memmap, load, save, asarray, zeros, int64, dtype as npdtype
+
+from . import util
+from .constants import MAXI, MAXJ, MAXPIECES, BOARDSZ
+from .cache import version_tag
+from .pgn import MoveBuffer
+
+# Shape of one row (ply) of every field of a corpus
+FIELD_SHAPES = {
+    'B': (MAXI, MAXJ),
+    'X': (MAXPIECES, BOARDSZ),
+    'S': (MAXPIECES, BOARDSZ),
+    'Kw': (BOARDSZ,),
+    'Kb': (BOARDSZ,),
+    'pieces': (MAXPIECES,),
+    'promoted': (MAXPIECES,),
+    }
+
+# Name of the file with the fields, dtype and matches of a corpus
+META_FILE = 'corpus.json'
+
+
+# On-disk layout of a corpus directory: the board states of all matches
+# are concatenated along the ply axis in one raw file per field
+# (<field>.dat), so field rows offsets[k]:offsets[k+1] belong to match k.
+# offsets.npy holds the len(matches)+1 row offsets, and corpus.json the
+# dtype, the number of rows and the movements and metadata of each match.
+
+class CorpusWriter:
+
+    def __init__(self, path, dtype=None):
+        """Writes a corpus in streaming fashion: the arrays of each match
+        are appended to the field files as soon as it is added, so the
+        corpus can be written while the pgn files are ingested.
+
+        INPUT:
+            path: (str)
+                corpus directory, created if needed.
+            dtype: (str, numpy dtype, None)
+                dtype of the stored arrays, see Match.
+        """
+        self.path = path
+        self.dtype = util.get_storage_dtype(dtype)
+        os.makedirs(path, exist_ok=True)
+        self._files = dict(
+            (name, open(os.path.join(path, name + '.dat'), 'wb'))
+            for name in FIELD_SHAPES)
+        self.offsets = [0]
+        self.matches = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.matches)
+
+    def append(self, match):
+        """Appends the board states of a valid match"""
+        for name, f in self._files.items():
+            asarray(getattr(match, name), dtype=self.dtype).tofile(f)
+        self.offsets.append(self.offsets[-1] + match.B.shape[0])
+        self.matches.append({
+            'idx': match.idx,
+            'ucimovements': ' '.join(m.decode() for m in match.ucimovements),
+            'metadata': dict(match.metadata or {}),
+            })
+
+    def close(self):
+        """Flushes the field files and writes the index"""
+        if self._files is None:
+            return
+        for f in self._files.values():
+            f.close()
+        self._files = None
+        save(os.path.join(self.path, 'offsets.npy'),
+             asarray(self.offsets, dtype=int64))
+        with open(os.path.join(self.path, META_FILE), 'w') as f:
+            json.dump({'version': version_tag(),
+                       'dtype': self.dtype.name,
+                       'rows': self.offsets[-1],
+                       'matches': self.matches}, f)
+
+
+def write_corpus(matches, path, dtype=None):
+    """Writes an iterable of matches (a MatchSet, the output of
+    ingest.iter_matches, ...) as a corpus. Invalid matches are skipped.
+    """
+    with CorpusWriter(path, dtype) as writer:
+        for match in matches:
+            if match.is_valid_match:
+                writer.append(match)
+    return path
+
+
+class Corpus:
+
+    def __init__(self, path):
+        """Read only view of a corpus written by CorpusWriter. Fields are
+        memory mapped, so opening a corpus reads no array data and every
+        access is a zero copy slice or a fancy index.
+
+        INPUT:
+            path: (str)
+                corpus directory.
+        """
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        self.version = meta['version']
+        self.dtype = npdtype(meta['dtype'])
+        self.rows = meta['rows']
+        self.matches = meta['matches']
+        self.offsets = load(os.path.join(path, 'offsets.npy'))
+        self._fields = dict()
+
+    def __len__(self):
+        return len(self.matches)
+
+    def __getitem__(self, val):
+        """Returns match val as a Match instance whose arrays are views of
+        the corpus fields.
+        """
+        from .classes import Match
+        # Negative indices wrap around, IndexError out of range
+        val = range(len(self))[val]
+        rows = slice(self.offsets[val], self.offsets[val+1])
+        arrays = dict((name, self.field(name)[rows]) for name in FIELD_SHAPES)
+        info = self.matches[val]
+        ucimovements = MoveBuffer.from_uci(info['ucimovements'].split())
+        return Match.from_arrays(ucimovements, arrays, info['idx'],
+                                 info['metadata'])
+
+    def field(self, name):
+        """Memory mapped (rows, ...) array with all the board states of
+        the corpus for a field (B, X, S, Kw, Kb, pieces or promoted).
+        """
+        if name not in self._fields:
+            shape = (self.rows,) + FIELD_SHAPES[name]
+            if self.rows == 0:
+                # Empty files can not be memory mapped
+                self._fields[name] = zeros(shape, self.dtype)
+            else:
+                self._fields[name] = memmap(
+                    os.path.join(self.path, name + '.dat'),
+                    dtype=self.dtype, mode='r', shape=shape)
+        return self._fields[name]
+
+    @property
+    def lengths(self):
+        """Number of board states of each match"""
+        return self.offsets[1:] - self.offsets[:-1]
+
+    def row(self, match, ply):
+        """Row of the fields holding ply of match. Both arguments may be
+        arrays (broadcast against each other).
+        """
+        return self.offsets[asarray(match)] + asarray(ply)
+
+    def at_ply(self, ply, name):
+        """Board states ply of every match long enough to have it.
+        Returns (matches, values), where matches are the indexes in the
+        corpus of the matches selected.
+        """
+        matches = (self.lengths > ply).nonzero()[0]
+        return matches, self.field(name)[self.row(matches, ply)]
+
+    @property
+    def B(self):
+        return self.field('B')
+
+    @property
+    def X(self):
+        return self.field('X')
+
+    @property
+    def S(self):
+        return self.field('S')
+
+    @property
+    def Kw(self):
+        return self.field('Kw')
+
+    @property
+    def Kb(self):
+        return self.field('Kb')
+
+    @property
+    def pieces(self):
+        return self.field('pieces')
+
+    @property
+    def promoted(self):
+        return self.field('promoted')
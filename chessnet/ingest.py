@@ -0,0 +1,491 @@
+import io
+import os
+import time
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from numpy import concatenate
+
+from . import util
+from . import instrument
+
+# Arrays of a Match instance that are computed in the worker processes
+MATCH_ARRAYS = ('B', 'X', 'S', 'Kw', 'Kb', 'pieces', 'promoted')
+
+# Default number of games sent to a worker in each task
+CHUNKSIZE = 32
+
+# Worker processes are started fresh instead of forked, the threading
+# layer of the parallel kernels (see compute.parse_compute_corpus) does not
+# survive a fork. The compiled kernels are loaded from the numba cache.
+START_METHOD = ('forkserver' if 'forkserver' in
+                multiprocessing.get_all_start_methods() else 'spawn')
+
+
+def _skip_comments(line, in_comment):
+    # Scans a movetext line for {...} and ; comments. Returns True if the
+    # line ends inside a {...} comment.
+    pos = 0
+    while True:
+        if in_comment:
+            pos = line.find(b'}', pos)
+            if pos < 0:
+                return True
+            in_comment = False
+            pos += 1
+        brace = line.find(b'{', pos)
+        semicolon = line.find(b';', pos)
+        if brace < 0 or 0 <= semicolon < brace:
+            return False
+        in_comment = True
+        pos = brace + 1
+
+
+def find_game_offsets(fname):
+    """Scans a multi match pgn file and returns the byte offset where
+    each game starts. Games are split as chess.pgn.read_game does: the
+    movetext of a game ends at the first empty line outside a {...}
+    comment, and the next game starts at the following tag line. Lines
+    starting with '[' inside comments or movetext (e.g. a wrapped
+    [%clk ...] comment) do not start a game.
+
+    INPUT:
+        fname: (str)
+            path to a multi match pgn file.
+    """
+    offsets = list()
+    # One of 'between' (games), 'header' or 'movetext'
+    state = 'between'
+    in_comment = False
+    empty_lines = 0
+    pos = 0
+    with open(fname, 'rb') as pgnfile:
+        for line in pgnfile:
+            size = len(line)
+            if pos == 0:
+                line = line.lstrip(b'\xef\xbb\xbf')
+            if in_comment:
+                in_comment = _skip_comments(line, True)
+            elif line.startswith((b'%', b';')):
+                pass
+            elif not line.strip():
+                if state == 'movetext':
+                    state = 'between'
+                elif state == 'header':
+                    # Up to one empty line between the tags of a game
+                    empty_lines += 1
+                    if empty_lines > 1:
+                        state = 'between'
+            elif line.startswith(b'[') and state != 'movetext':
+                if state == 'between':
+                    offsets.append(pos)
+                    state = 'header'
+                empty_lines = 0
+            else:
+                state = 'movetext'
+                in_comment = _skip_comments(line, False)
+            pos += size
+    if not offsets or offsets[0] != 0:
+        # Anything before the first tag line belongs to the first chunk
+        offsets.insert(0, 0)
+    return offsets, pos
+
+
+def split_pgn_file(fname, chunksize=CHUNKSIZE):
+    """Splits a multi match pgn file in byte ranges holding chunksize
+    games each. Returns a list of (fname, start, end) tuples.
+    """
+    offsets, size = find_game_offsets(fname)
+    bounds = offsets[::chunksize] + [size]
+    return [(fname, start, end) for start, end in zip(bounds[:-1], bounds[1:])
+            if end > start]
+
+
+def read_pgn_range(fname, start, end):
+    """Reads the games contained in a byte range of a pgn file. The
+    range is decoded as open() would do with the whole file.
+    """
+    with open(fname, 'rb') as pgnfile:
+        pgnfile.seek(start)
+        data = pgnfile.read(end - start)
+    mov_lst = list()
+    meta_lst = list()
+    pgntext = io.TextIOWrapper(io.BytesIO(data))
+    for movements, metadata, _ in util.iter_pgn_stream(pgntext):
+        mov_lst.append(movements)
+        meta_lst.append(metadata)
+    return mov_lst, meta_lst
+
+
+def compute_pgn_range(task, engine='kernel', dtype=None, stats=False,
+                      transpositions=False):
+    """Worker task: loads, parses and computes all the games in a byte
+    range of a pgn file. The arrays of all valid matches are returned
+    concatenated along the movement axis, so each chunk is pickled as a
+    handful of large arrays instead of one set of arrays per game.
+
+    INPUT:
+        task: (tuple)
+            (fname, start, end) as returned by split_pgn_file.
+        engine: (str)
+            compute engine of the matches, see Match.
+        dtype: (str, numpy dtype, None)
+            storage dtype of the match arrays, see Match.
+        stats: (bool)
+            instrument the task, see instrument.Stats.
+        transpositions: (bool)
+            use the transposition table of the worker, see Match.
+
+    OUTPUT:
+        (mov_lst, meta_lst, valid, arrays, elapsed, stats), where valid is
+        a list of bools, arrays a dict with the concatenated arrays,
+        elapsed the seconds taken by the task and stats the as_dict of its
+        instrumentation (None if not instrumented).
+    """
+    from .classes import Match
+    start = time.perf_counter()
+    stats = instrument.Stats() if stats else None
+    with instrument.timer(stats, 'read'):
+        mov_lst, meta_lst = read_pgn_range(*task)
+    instrument.count(stats, 'read', games=len(mov_lst),
+                     bytes=task[2] - task[1])
+    valid = list()
+    parts = dict((name, list()) for name in MATCH_ARRAYS)
+    for m, h in zip(mov_lst, meta_lst):
+        match = Match(m, metadata=h, engine=engine, dtype=dtype, stats=stats,
+                      transpositions=transpositions)
+        valid.append(match.is_valid_match)
+        if match.is_valid_match:
+            for name in MATCH_ARRAYS:
+                parts[name].append(getattr(match, name))
+    arrays = dict()
+    with instrument.timer(stats, 'concat'):
+        for name, lst in parts.items():
+            arrays[name] = concatenate(lst) if lst else None
+    return (mov_lst, meta_lst, valid, arrays, time.perf_counter() - start,
+            stats.as_dict() if stats is not None else None)
+
+
+def tabulate_pgn_range(task, vec=None, engine='kernel', dtype=None):
+    """Worker task: loads, parses and computes all the games in a byte
+    range of a pgn file, and returns their per ply metrics table.
+
+    OUTPUT:
+        (games, chunk), with games the number of games in the range and
+        chunk the table of its valid matches (see table.match_chunk),
+        indexed from 1 within the range.
+    """
+    from .classes import Match
+    from .table import match_chunk
+    mov_lst, meta_lst = read_pgn_range(*task)
+    matches = list()
+    for i, (m, h) in enumerate(zip(mov_lst, meta_lst)):
+        match = Match(m, i+1, metadata=h, engine=engine, dtype=dtype)
+        if match.is_valid_match:
+            matches.append(match)
+    return len(mov_lst), match_chunk(matches, vec)
+
+
+def iter_tasks(func, tasks, workers=None):
+    """Yields func(task) for each task, in task order, computed in a pool
+    of worker processes unless workers is 1.
+    """
+    if workers == 1:
+        for task in tasks:
+            yield func(task)
+        return
+    context = multiprocessing.get_context(START_METHOD)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        for result in pool.map(func, tasks):
+            yield result
+
+
+def run_tasks(tasks, workers=None, engine='kernel', dtype=None, stats=False,
+              transpositions=False):
+    """Runs compute_pgn_range over a list of tasks, in a pool of worker
+    processes unless workers is 1. Results are returned in task order.
+    """
+    func = partial(compute_pgn_range, engine=engine, dtype=dtype,
+                   stats=stats, transpositions=transpositions)
+    return list(iter_tasks(func, tasks, workers))
+
+
+def merge_results(results):
+    """Builds the Match instances of the results of run_tasks, indexed
+    in task order. Valid matches wrap views of the concatenated arrays.
+
+    OUTPUT:
+        (matches, invalid) lists of Match instances.
+    """
+    from .classes import Match
+    L = sum(len(r[0]) for r in results)
+    matches = list()
+    invalid = list()
+    i = 0
+    for mov_lst, meta_lst, valid, arrays, _, _ in results:
+        row = 0
+        for m, h, is_valid in zip(mov_lst, meta_lst, valid):
+            i += 1
+            if is_valid:
+                n = len(m) + 1
+                views = dict((name, arrays[name][row:row+n])
+                             for name in MATCH_ARRAYS)
+                row += n
+                matches.append(Match.from_arrays(m, views, (i, L), h))
+            else:
+                invalid.append(Match.from_arrays(m, None, (i, L), h))
+    return matches, invalid
+
+
+def merge_stats(stats, results):
+    """Adds the instrumentation of the results of run_tasks to stats.
+    Stage times are summed over tasks, so with several workers they add
+    up to more than the wall time.
+    """
+    if stats is None:
+        return
+    for result in results:
+        if result[5] is not None:
+            stats.merge(result[5])
+
+
+def compute_pgn_file(fname, workers=None, chunksize=CHUNKSIZE,
+                     engine='kernel', dtype=None, stats=None,
+                     transpositions=False):
+    """Loads and computes all the matches in a multi match pgn file using
+    a pool of worker processes. Chunks are consumed in file order, so the
+    result is identical to the sequential construction.
+
+    INPUT:
+        fname: (str)
+            path to a multi match pgn file.
+        workers: (int, None)
+            number of worker processes, defaults to the number of cpus.
+        chunksize: (int)
+            number of games sent to each worker task.
+        engine: (str)
+            compute engine used in the workers, see Match. The matrices
+            are always returned expanded.
+        dtype: (str, numpy dtype, None)
+            storage dtype of the match arrays, see Match.
+        stats: (instrument.Stats, None)
+            collects the instrumentation of the workers.
+        transpositions: (bool)
+            use a transposition table in each worker, see Match.
+
+    OUTPUT:
+        (matches, invalid) lists of Match instances.
+    """
+    logger = util.get_logger('ingest')
+    with instrument.timer(stats, 'split'):
+        tasks = split_pgn_file(fname, chunksize)
+    logger.info('Computing %s in %d chunks' % (fname, len(tasks)))
+    results = run_tasks(tasks, workers, engine, dtype, stats is not None,
+                        transpositions)
+    merge_stats(stats, results)
+    with instrument.timer(stats, 'merge'):
+        return merge_results(results)
+
+
+def file_stats(tasks, results):
+    """Per file throughput of the results of run_tasks. Returns a list
+    of dicts with the file name, its number of games, plies and bytes,
+    the seconds spent on it by the workers and the resulting rates.
+    """
+    stats = dict()
+    for (fname, start, end), result in zip(tasks, results):
+        mov_lst, elapsed = result[0], result[4]
+        st = stats.setdefault(fname, {'fname': fname, 'games': 0,
+                                      'plies': 0, 'bytes': 0, 'seconds': 0.})
+        st['games'] += len(mov_lst)
+        st['plies'] += sum(len(m) for m in mov_lst)
+        st['bytes'] += end - start
+        st['seconds'] += elapsed
+    for st in stats.values():
+        seconds = max(st['seconds'], 1e-9)
+        st['games_per_s'] = st['games'] / seconds
+        st['plies_per_s'] = st['plies'] / seconds
+        st['mb_per_s'] = st['bytes'] / seconds / 2**20
+    return list(stats.values())
+
+
+def compute_pgn_directory(inpath, recursive=False, workers=None,
+                          chunksize=CHUNKSIZE, engine='kernel', dtype=None,
+                          stats=None, transpositions=False):
+    """Loads and computes all the matches in the pgn files of a directory.
+    Files are listed once and split in chunks of games, and the chunks of
+    all files are spread over a pool of worker processes, so large files
+    are shared among workers and small ones do not wait for each other.
+    Matches are returned in file (sorted names) and game order.
+
+    INPUT:
+        inpath: (str)
+            directory with pgn files, each with one or more games.
+        recursive: (bool)
+            include the pgn files of the subdirectories.
+        workers: (int, None)
+            number of worker processes, defaults to the number of cpus.
+            With 1 everything runs in this process.
+        chunksize: (int)
+            number of games sent to each worker task.
+        engine: (str)
+            compute engine used in the workers, see Match.
+        dtype: (str, numpy dtype, None)
+            storage dtype of the match arrays, see Match.
+        stats: (instrument.Stats, None)
+            collects the instrumentation of the workers.
+        transpositions: (bool)
+            use a transposition table in each worker, see Match.
+
+    OUTPUT:
+        (matches, invalid, fstats), with fstats the per file throughput
+        (see file_stats).
+    """
+    logger = util.get_logger('ingest')
+    with instrument.timer(stats, 'split'):
+        fnames = util.get_pgn_files(inpath, recursive)
+        tasks = [task for fname in fnames
+                 for task in split_pgn_file(fname, chunksize)]
+    logger.info('Computing %d pgn files of %s in %d chunks' %
+                (len(fnames), inpath, len(tasks)))
+    start = time.perf_counter()
+    results = run_tasks(tasks, workers, engine, dtype, stats is not None,
+                        transpositions)
+    elapsed = time.perf_counter() - start
+    merge_stats(stats, results)
+    fstats = file_stats(tasks, results)
+    for st in fstats:
+        logger.info('%s: %d games, %d plies in %.2fs (%.1f games/s, '
+                    '%.0f plies/s, %.2f MB/s)' % (
+                        os.path.relpath(st['fname'], inpath), st['games'],
+                        st['plies'], st['seconds'], st['games_per_s'],
+                        st['plies_per_s'], st['mb_per_s']))
+    games = sum(st['games'] for st in fstats)
+    logger.info('Computed %d games of %d files in %.2fs (%.1f games/s)' % (
+        games, len(fnames), elapsed, games / max(elapsed, 1e-9)))
+    with instrument.timer(stats, 'merge'):
+        matches, invalid = merge_results(results)
+    return matches, invalid, fstats
+
+
+def iter_matches(fname, batch=None, tables=False, vec=None,
+                 skip_invalid=True, engine='kernel', dtype=None, packed=False,
+                 stats=None, transpositions=None):
+    """Streaming alternative to MatchSet. Games are read, parsed and
+    computed one at a time and nothing is kept once yielded, so memory
+    does not grow with the size of the pgn file.
+
+    INPUT:
+        fname: (str)
+            path to a multi match pgn file.
+        batch: (int, None)
+            if given, yield lists of up to batch items instead of
+            single items.
+        tables: (bool)
+            yield the per-ply metrics table of each match (see
+            Match.ToPandas) instead of the Match instance.
+        vec: (list(str), None)
+            metric names for the tables, defaults to all vector_names.
+        skip_invalid: (bool)
+            drop the matches that could not be parsed or computed.
+        engine: (str)
+            compute engine of the matches, see Match.
+        dtype: (str, numpy dtype, None)
+            storage dtype of the match arrays, see Match.
+        packed: (bool)
+            store pieces and promoted as bitmasks, see Match.
+        stats: (instrument.Stats, None)
+            instruments the matches, see Match.
+        transpositions: (bool, TranspositionTable, None)
+            transposition table of the matches, see Match.
+    """
+    from .classes import Match
+    logger = util.get_logger('ingest')
+    items = list()
+    for i, (m, h, _) in enumerate(util.iter_multipgn_file(fname)):
+        match = Match(m, i+1, metadata=h, engine=engine, dtype=dtype,
+                      packed=packed, stats=stats,
+                      transpositions=transpositions)
+        if not match.is_valid_match:
+            logger.warning('Invalid match %d in %s' % (i+1, fname))
+            if skip_invalid:
+                continue
+        item = match.ToPandas(vec) if tables else match
+        if batch is None:
+            yield item
+            continue
+        items.append(item)
+        if len(items) == batch:
+            yield items
+            items = list()
+    if items:
+        yield items
+
+
+def write_pgn_corpus(fnames, path, engine='kernel', dtype=None):
+    """Ingests one or more pgn files into a corpus (see corpus.Corpus).
+    Matches are streamed from iter_matches to the corpus files, so memory
+    does not grow with the size of the input.
+
+    INPUT:
+        fnames: (str, list(str))
+            path of a multi match pgn file, or a list of them.
+        path: (str)
+            corpus directory.
+        engine: (str)
+            compute engine of the matches, see Match.
+        dtype: (str, numpy dtype, None)
+            storage dtype of the corpus, see Match.
+    """
+    from .corpus import CorpusWriter
+    if isinstance(fnames, str):
+        fnames = [fnames]
+    with CorpusWriter(path, dtype) as writer:
+        for fname in fnames:
+            for match in iter_matches(fname, engine=engine, dtype=dtype):
+                writer.append(match)
+    return path
+
+
+def write_pgn_table(fnames, path, vec=None, workers=None, chunksize=CHUNKSIZE,
+                    engine='kernel', dtype=None, format=None):
+    """Writes the per ply metrics and headers of all the games of one or
+    more pgn files as a single table file (see table.Table). Games are
+    computed by a pool of worker processes and each chunk is appended to
+    the table as soon as it is ready, in file and game order. Matches are
+    indexed as in MatchSet, counting the invalid games, which are skipped.
+
+    INPUT:
+        fnames: (str, list(str))
+            path of a multi match pgn file or of a directory with pgn
+            files, or a list of pgn files.
+        path: (str)
+            table file.
+        vec: (list(str), None)
+            metric names, defaults to all vector_names.
+        workers: (int, None)
+            number of worker processes, defaults to the number of cpus.
+            With 1 everything runs in this process.
+        chunksize: (int)
+            number of games sent to each worker task.
+        engine: (str)
+            compute engine used in the workers, see Match.
+        dtype: (str, numpy dtype, None)
+            storage dtype of the match arrays, see Match.
+        format: (str, None)
+            'parquet' or 'npz', see table.get_format.
+    """
+    from .table import TableWriter
+    if isinstance(fnames, str):
+        fnames = util.get_pgn_files(fnames) if os.path.isdir(fnames) \
+            else [fnames]
+    tasks = [task for fname in fnames
+             for task in split_pgn_file(fname, chunksize)]
+    func = partial(tabulate_pgn_range, vec=vec, engine=engine, dtype=dtype)
+    offset = 0
+    with TableWriter(path, format) as writer:
+        for games, chunk in iter_tasks(func, tasks, workers):
+            writer.append(chunk, offset)
+            offset += games
+    return path
@@ -0,0 +1,108 @@
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Opt-in instrumentation of the MatchSet/Match pipeline. The code of each
+# stage runs inside timer(stats, name), which is a shared no-op context when
+# stats is None, so disabled instrumentation costs one call per stage.
+
+
+class _NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Stats:
+
+    def __init__(self):
+        """Wall time, number of calls and counters (games, plies, invalid
+        games, bytes read...) of each stage of the pipeline, in the order
+        stages are first seen.
+        """
+        self.stages = OrderedDict()
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = OrderedDict([('seconds', 0.), ('calls', 0)])
+        return self.stages[name]
+
+    @contextmanager
+    def timer(self, name):
+        """Adds the wall time of the block and one call to stage name"""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            st = self.stage(name)
+            st['seconds'] += time.perf_counter() - start
+            st['calls'] += 1
+
+    def count(self, name, **counters):
+        """Adds the given counters to stage name"""
+        st = self.stage(name)
+        for key, value in counters.items():
+            st[key] = st.get(key, 0) + value
+
+    def merge(self, other):
+        """Adds the stages of another Stats instance (or of its as_dict,
+        e.g. as returned by a worker process).
+        """
+        stages = other.stages if isinstance(other, Stats) else other
+        for name, counters in stages.items():
+            self.count(name, **counters)
+        return self
+
+    def reset(self):
+        self.stages.clear()
+
+    def as_dict(self):
+        return OrderedDict((name, OrderedDict(st))
+                           for name, st in self.stages.items())
+
+    def ToPandas(self):
+        """One row per stage, one column per counter"""
+        import pandas as pd
+        df = pd.DataFrame.from_dict(self.as_dict(), orient='index')
+        df.index.name = 'stage'
+        return df.fillna(0).astype(dict(
+            (column, int) for column in df.columns if column != 'seconds'))
+
+    def to_json(self, fname=None):
+        """Returns the stages as a json string, also written to fname if
+        given.
+        """
+        text = json.dumps(self.as_dict(), indent=1)
+        if fname is not None:
+            with open(fname, 'w') as f:
+                f.write(text)
+        return text
+
+    def __repr__(self):
+        lines = list()
+        for name, st in self.stages.items():
+            counters = ', '.join('%s=%d' % (key, value)
+                                 for key, value in st.items()
+                                 if key not in ('seconds', 'calls'))
+            lines.append('%-16s %9.3fs %8d calls  %s' % (
+                name, st['seconds'], st['calls'], counters))
+        return '\n'.join(lines)
+
+
+def timer(stats, name):
+    """Context timing stage name in stats, a no-op if stats is None"""
+    if stats is None:
+        return NULL_TIMER
+    return stats.timer(name)
+
+
+def count(stats, name, **counters):
+    if stats is not None:
+        stats.count(name, **counters)
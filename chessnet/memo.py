@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from itertools import count
+
+# Default memory cap of the cache of derived networks and metrics
+DEFAULT_MAXBYTES = 256 * 2**20
+
+# Tokens identifying the current contents of the arrays of a Match
+_tokens = count()
+
+
+def new_token():
+    """Returns a token never used before. Matches take a new one whenever
+    their base arrays are rewritten, so entries cached under the old one
+    are never returned again.
+    """
+    return next(_tokens)
+
+
+def nbytes(value):
+    # Memory held by a cached value (an array or a dict of arrays)
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    return getattr(value, 'nbytes', 0)
+
+
+def freeze(value):
+    # Cached arrays are shared by every caller, make them read only
+    if isinstance(value, dict):
+        for v in value.values():
+            freeze(v)
+    elif hasattr(value, 'flags'):
+        value.flags.writeable = False
+    return value
+
+
+class LRUCache:
+
+    def __init__(self, maxbytes=DEFAULT_MAXBYTES):
+        """Least recently used cache with a memory cap, used to keep the
+        networks and metrics derived from the arrays of each Match.
+
+        INPUT:
+            maxbytes: (int)
+                memory cap, the least recently used entries are evicted
+                once it is exceeded. Values larger than the cap are
+                returned but not kept.
+        """
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        # Keys cached under each match token, for discard
+        self._tokens = dict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, func):
+        """Returns the value cached under key, a (token, name) tuple,
+        calling func to compute and store it on a miss.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+        value = freeze(func())
+        size = nbytes(value)
+        if size <= self.maxbytes:
+            self._entries[key] = (value, size)
+            self._tokens.setdefault(key[0], set()).add(key)
+            self.nbytes += size
+            self.evict()
+        return value
+
+    def evict(self, maxbytes=None):
+        """Drops the least recently used entries until the cache holds at
+        most maxbytes (defaults to the cache cap).
+        """
+        maxbytes = self.maxbytes if maxbytes is None else maxbytes
+        while self.nbytes > maxbytes and self._entries:
+            key, (_, size) = self._entries.popitem(last=False)
+            self.nbytes -= size
+            keys = self._tokens[key[0]]
+            keys.discard(key)
+            if not keys:
+                del self._tokens[key[0]]
+
+    def discard(self, token):
+        """Drops all the entries cached under a match token"""
+        for key in self._tokens.pop(token, ()):
+            _, size = self._entries.pop(key)
+            self.nbytes -= size
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens.clear()
+        self.nbytes = 0
+
+    def resize(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.evict()
+
+
+# Cache shared by all Match instances
+derived_cache = LRUCache()
@@ -0,0 +1,88 @@
+from numpy import errstate, float64, int64
+
+from .constants import PIECENO, W_KING_IDX
+
+vector_names = [
+    'pieceno',
+    'accesible',
+    'Dconnectance',
+    'Aconnectance',
+    'Iconnectance',
+    'Cconnectance',
+    'king_accesibility',
+    'defense_on_king',
+    'attack_on_king',
+    ]
+
+
+# Every scalar metric of BoardState is a sum over a network or an
+# extended board state. As U and V are vectors of ones, U*Xw*Sw'*U' is the
+# dot product of the column sums of Xw and Sw, so all the metrics of a
+# stack of board states reduce to a few products of the (L, BOARDSZ) column
+# sums of each color. The results keep the dtypes of the BoardState ones.
+
+def column_sums(A):
+    # Sum over the piece axis of a (L, PIECENO, BOARDSZ) stack
+    return A.sum(axis=-2, dtype=int64)
+
+
+def dot(a, b):
+    # Row-wise dot product of two (L, BOARDSZ) arrays, as float
+    return (a * b).sum(axis=-1).astype(float64)
+
+
+def compute_metrics(X, S, Kw, Kb, vec=None):
+    """Computes the per ply metrics of a stack of board states.
+
+    INPUT:
+        X, S: (array)
+            (L, MAXPIECES, BOARDSZ) extended board states and accesible
+            networks.
+        Kw, Kb: (array)
+            (L, BOARDSZ) king as queen accesibility of both kings.
+        vec: (list(str), None)
+            metric names, defaults to all vector_names.
+
+    OUTPUT:
+        dict with one (L,) array for 'b_'+name and 'w_'+name of each
+        metric, in the order of vec.
+    """
+    names = vector_names if vec is None else vec
+    xw = column_sums(X[:, :PIECENO])
+    xb = column_sums(X[:, PIECENO:])
+    sw = column_sums(S[:, :PIECENO])
+    sb = column_sums(S[:, PIECENO:])
+
+    out = dict()
+    for name in names:
+        if name == 'pieceno':
+            b, w = xb.sum(axis=-1), xw.sum(axis=-1)
+        elif name == 'accesible':
+            b, w = sb.sum(axis=-1), sw.sum(axis=-1)
+        elif name == 'Dconnectance':
+            b, w = dot(xb, sb), dot(xw, sw)
+        elif name == 'Aconnectance':
+            b, w = dot(sb, xw), dot(sw, xb)
+        elif name == 'Iconnectance':
+            b, w = dot(sb, sb), dot(sw, sw)
+        elif name == 'Cconnectance':
+            b, w = dot(sb, sw), dot(sw, sb)
+        elif name == 'king_accesibility':
+            # Match.b_king_accesibility has always returned the white
+            # defense on king, kept as is for the exported tables
+            with errstate(divide='ignore', invalid='ignore'):
+                b = dot(sw, Kw) / Kw.sum(axis=-1)
+            w = S[:, W_KING_IDX].sum(axis=-1, dtype=int64)
+        elif name == 'defense_on_king':
+            with errstate(divide='ignore', invalid='ignore'):
+                b = dot(sb, Kb) / Kb.sum(axis=-1)
+                w = dot(sw, Kw) / Kw.sum(axis=-1)
+        elif name == 'attack_on_king':
+            b, w = dot(sb, Kw), dot(sw, Kb)
+        else:
+            raise ValueError('Unknown metric: %s' % name)
+        if name in ('pieceno', 'accesible'):
+            b, w = b.astype(float64), w.astype(float64)
+        out['b_'+name] = b
+        out['w_'+name] = w
+    return out
@@ -0,0 +1,64 @@
+from numpy import matmul, empty, result_type, float64
+
+from .constants import PIECENO, MAXPIECES
+
+
+# Batched versions of the BoardState networks. X and S may be a single
+# board state (MAXPIECES, BOARDSZ) or a stack of them (L, MAXPIECES,
+# BOARDSZ), in which case every product is a single batched matmul.
+
+def transpose(A):
+    # Transpose the last two axes, leaving the stack axis alone
+    return A.swapaxes(-1, -2)
+
+
+def product(A, B):
+    """A*B' with the dtype of the inputs. Integer matmul does not use
+    BLAS, so the product is done in float64, where the counts of the
+    networks are exact, and cast back.
+    """
+    P = matmul(A.astype(float64), transpose(B).astype(float64))
+    return P.astype(result_type(A, B))
+
+
+def defensive_network(X, S):
+    """Pieces of one color defending each other, Xw*Sw' (Dw and Db)"""
+    return product(X, S)
+
+
+def influence_network(S):
+    """Shared accesible cells of each pair of pieces, Sw*Sw' (Iw and Ib)"""
+    return product(S, S)
+
+
+def attack_network(S, X):
+    """Pieces of one color attacking the other, Sw*Xb' (Aw and Ab)"""
+    return product(S, X)
+
+
+def clash_network(S1, S2):
+    """Cells accesible to pieces of both colors, Sw*Sb' (Cw and Cb)"""
+    return product(S1, S2)
+
+
+def contact_matrix(X, S):
+    """Contact matrix [[Dw, Aw], [Ab, Db]] of one or many board states.
+    The four blocks are written in place on one preallocated array.
+
+    INPUT:
+        X: (array)
+            extended board state, (MAXPIECES, BOARDSZ) or a stack of them.
+        S: (array)
+            accesible network with the same shape as X.
+    """
+    dtype = result_type(X, S)
+    X = X.astype(float64)
+    S = S.astype(float64)
+    Xw, Xb = X[..., :PIECENO, :], X[..., PIECENO:, :]
+    Sw, Sb = S[..., :PIECENO, :], S[..., PIECENO:, :]
+    cm = empty(X.shape[:-2] + (MAXPIECES, MAXPIECES), dtype=float64)
+    matmul(Xw, transpose(Sw), out=cm[..., :PIECENO, :PIECENO])
+    matmul(Sw, transpose(Xb), out=cm[..., :PIECENO, PIECENO:])
+    matmul(Sb, transpose(Xw), out=cm[..., PIECENO:, :PIECENO])
+    matmul(Xb, transpose(Sb), out=cm[..., PIECENO:, PIECENO:])
+    return cm.astype(dtype)
@@ -1,41 +1,28 @@
-from numpy import zeros
+from numpy import zeros, empty, full, int64, bool_
 from numba import jit
 
 from .constants import (
     VERBOSITY, MAXI, MAXJ, MAXPIECE, PIECENO, NPDTYPE, MAPNUM, IMAPNUM,
     IS_W_PAWN, IS_B_PAWN, IS_ENPASSANT, EMPTY, W_QUEEN, B_QUEEN,
+    W_CASTLE_QUEEN, W_KNIGHT_QUEEN, W_BISHOP_QUEEN, W_KING, W_BISHOP_KING,
+    W_KNIGHT_KING, W_CASTLE_KING, W_PAWN_CASTLE_QUEEN, W_PAWN_CASTLE_KING,
+    B_CASTLE_QUEEN, B_KNIGHT_QUEEN, B_BISHOP_QUEEN, B_KING, B_BISHOP_KING,
+    B_KNIGHT_KING, B_CASTLE_KING, B_PAWN_CASTLE_QUEEN, B_PAWN_CASTLE_KING,
     IS_KING_CASTLING, CASTLE_KING_X, CASTLING_KING_CASTLE_DEST_X,
     IS_QUEEN_CASTLING, CASTLE_QUEEN_X, CASTLING_QUEEN_CASTLE_DEST_X,
-    NBDTYPE
+    MAPCELL, NBDTYPE, JIT_CACHE
     )
 
 
 def parse_match_from_movlst(match, game_array):
     match.ucimovements = game_array
-    match.B[0, ...] = __init_board_num(MAXI, MAXJ)
-    match.pieces[0, ...] = __find_pieces_num(match.B[0, ...])
-    for m in range(len(match)):
-        # Update the board with next movement
-        match.B[m+1, ...] = __move_board_num(
-            match.B[m, ...].copy(),
-            match.movements[m],
-            )
-
-        # Find all active pieces
-        match.pieces[m+1, ...] = __find_pieces_num(match.B[m+1, ...])
-
-        # Find any newly promoted pawn
-        match.promoted[m+1, ...] = __find_promoted_num(
-            match.B[m+1, ...],
-            match.pieces[m+1, ...],
-            match.promoted[m, ...].copy(),
-            )
-
-
-@jit(NBDTYPE[:](NBDTYPE[:, :]), nopython=True)
+    replay_match_num(match.movements, match.B, match.pieces, match.promoted)
+
+
+@jit(nopython=True, cache=JIT_CACHE)
 def __find_pieces_num(board):
     # Old version, exact copy of C code
-    pieces = zeros(MAXPIECE, NPDTYPE)
+    pieces = zeros(MAXPIECE, board.dtype)
     for i in range(MAXI):
         for j in range(MAXJ):
             for pz in range(MAXPIECE):
@@ -44,7 +31,7 @@ def __find_pieces_num(board):
     return pieces
 
 
-@jit(NBDTYPE[:](NBDTYPE[:, :], NBDTYPE[:], NBDTYPE[:]), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def __find_promoted_num(board, active_pieces, promoted):
     # We could track movements results and avoid all these iterations...
     for i in range(MAXI):
@@ -58,7 +45,7 @@ def __find_promoted_num(board, active_pieces, promoted):
     return promoted
 
 
-@jit(NBDTYPE[:, :](NBDTYPE[:, :], NBDTYPE[:]), nopython=True)
+@jit(nopython=True, cache=JIT_CACHE)
 def __move_board_num(board, movement):
     (x0, y0, xf, yf) = movement[:]
     pz = board[x0, y0]
@@ -87,7 +74,7 @@ def __move_board_num(board, movement):
     return board
 
 
-@jit(NBDTYPE[:, :](NBDTYPE, NBDTYPE), nopython=True)
+@jit(NBDTYPE[:, :](NBDTYPE, NBDTYPE), nopython=True, cache=JIT_CACHE)
 def __init_board_num(xsz, ysz):
     b = zeros((xsz, ysz), NPDTYPE)
     for j in range(MAXJ):
@@ -103,3 +90,237 @@ def __init_board_num(xsz, ysz):
             else:
                 b[i, j] = EMPTY
     return b
+
+
+# Piece list: squares[pn] is the cell (MAPCELL) of piece pn, or -1 once it
+# is captured, the inverse of the board. Movements only update the cells
+# they touch and the pieces on them, so the pieces and promoted vectors of
+# each ply come from the piece list instead of scanning the whole board.
+
+@jit(nopython=True, cache=JIT_CACHE)
+def __find_squares_num(board, squares):
+    squares[:] = -1
+    for i in range(MAXI):
+        for j in range(MAXJ):
+            if board[i, j] != EMPTY:
+                squares[IMAPNUM(board[i, j])] = MAPCELL(i, j)
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def __set_cell_num(board, squares, i, j, pz):
+    # board[i, j] = pz, the piece it replaces (if still there) is captured
+    old = board[i, j]
+    if old != EMPTY and squares[IMAPNUM(old)] == MAPCELL(i, j):
+        squares[IMAPNUM(old)] = -1
+    board[i, j] = pz
+    if pz != EMPTY:
+        squares[IMAPNUM(pz)] = MAPCELL(i, j)
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def __promote_num(board, promoted, i, j):
+    # Same rule as __find_promoted_num, for the piece moved to cell i, j
+    pz = board[i, j]
+    pzn = IMAPNUM(pz)
+    if (IS_W_PAWN(pz) and j == MAXJ and promoted[pzn] == 0):
+        promoted[pzn] = W_QUEEN
+    elif (IS_B_PAWN(pz) and j == 0 and promoted[pzn] == 0):
+        promoted[pzn] = B_QUEEN
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def __move_pieces_num(board, squares, promoted, movement):
+    """__move_board_num updating the piece list squares and the promoted
+    vector of the new board, in O(1).
+    """
+    (x0, y0, xf, yf) = movement[:]
+    pz = board[x0, y0]
+    if (IS_KING_CASTLING(pz, x0, xf)):
+        __set_cell_num(board, squares, CASTLING_KING_CASTLE_DEST_X, y0,
+                       board[CASTLE_KING_X, y0])
+        __set_cell_num(board, squares, CASTLE_KING_X, y0, EMPTY)
+        __promote_num(board, promoted, CASTLING_KING_CASTLE_DEST_X, y0)
+    elif (IS_QUEEN_CASTLING(pz, x0, xf)):
+        __set_cell_num(board, squares, CASTLING_QUEEN_CASTLE_DEST_X, y0,
+                       board[CASTLE_QUEEN_X, y0])
+        __set_cell_num(board, squares, CASTLE_QUEEN_X, y0, EMPTY)
+        __promote_num(board, promoted, CASTLING_QUEEN_CASTLE_DEST_X, y0)
+    elif (IS_ENPASSANT(pz, board[xf, yf], y0, yf)):
+        __set_cell_num(board, squares, xf, y0, EMPTY)
+
+    __set_cell_num(board, squares, xf, yf, board[x0, y0])
+    __set_cell_num(board, squares, x0, y0, EMPTY)
+    __promote_num(board, promoted, xf, yf)
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def __pieces_from_squares(squares, pieces):
+    for pn in range(MAXPIECE):
+        pieces[pn] = 1 if squares[pn] >= 0 else 0
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def __next_ply_num(B0, squares0, promoted0, movement, B, squares, pieces,
+                   promoted):
+    # Board state played from B0, with explicit loops to copy the rows
+    for i in range(MAXI):
+        for j in range(MAXJ):
+            B[i, j] = B0[i, j]
+    for pn in range(MAXPIECE):
+        squares[pn] = squares0[pn]
+        promoted[pn] = promoted0[pn]
+    __move_pieces_num(B, squares, promoted, movement)
+    __pieces_from_squares(squares, pieces)
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def replay_match_squares(movements, B, pieces, promoted, squares):
+    """replay_match_num also filling squares, the piece list of each
+    board state (one more row than movements, MAXPIECE columns).
+    """
+    B[0, ...] = __init_board_num(MAXI, MAXJ)
+    __find_squares_num(B[0], squares[0])
+    __pieces_from_squares(squares[0], pieces[0])
+    promoted[0, ...] = 0
+    for m in range(movements.shape[0]):
+        __next_ply_num(B[m], squares[m], promoted[m], movements[m],
+                       B[m+1], squares[m+1], pieces[m+1], promoted[m+1])
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def replay_match_num(movements, B, pieces, promoted):
+    """Replays the full sequence of movements over the board arrays of a
+    match in a single native call. B, pieces and promoted must have one
+    more row than movements, the first row is the initial state.
+    """
+    squares = empty((B.shape[0], MAXPIECE), NPDTYPE)
+    replay_match_squares(movements, B, pieces, promoted, squares)
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def replay_tree_squares(parents, movements, B, pieces, promoted, squares):
+    """replay_tree_num also filling squares, the piece list of each node"""
+    B[0, ...] = __init_board_num(MAXI, MAXJ)
+    __find_squares_num(B[0], squares[0])
+    __pieces_from_squares(squares[0], pieces[0])
+    promoted[0, ...] = 0
+    for n in range(1, B.shape[0]):
+        p = parents[n]
+        __next_ply_num(B[p], squares[p], promoted[p], movements[n],
+                       B[n], squares[n], pieces[n], promoted[n])
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def replay_tree_num(parents, movements, B, pieces, promoted):
+    """Replays a tree of movements (see trie.MoveTrie): row n is the board
+    state reached playing movements[n] from row parents[n]. Parents come
+    before their children, and row 0 is the initial state.
+    """
+    squares = empty((B.shape[0], MAXPIECE), NPDTYPE)
+    replay_tree_squares(parents, movements, B, pieces, promoted, squares)
+
+
+# EPD/FEN piece placement, from rank 8 to rank 1 and file a to h. EPD_KIND
+# maps each symbol to its kind (RNBQKP for white, rnbqkp for black) and
+# EPD_CODES holds the piece codes of each kind, the first one being the
+# piece code of extra pieces (promoted pawns). Pieces take the codes of
+# their kind from file a to h, and pawns the code of their file if free.
+EPD_SYMBOLS = b'RNBQKPrnbqkp'
+EPD_KIND = full(256, -1, int64)
+for _k, _c in enumerate(EPD_SYMBOLS):
+    EPD_KIND[_c] = _k
+EPD_W_PAWN, EPD_B_PAWN = 5, 11
+EPD_SLASH, EPD_ZERO, EPD_EIGHT = ord('/'), ord('0'), ord('8')
+EPD_CODES = zeros((len(EPD_SYMBOLS), MAXI), int64)
+EPD_NCODES = zeros(len(EPD_SYMBOLS), int64)
+for _k, _codes in enumerate((
+        (W_CASTLE_QUEEN, W_CASTLE_KING), (W_KNIGHT_QUEEN, W_KNIGHT_KING),
+        (W_BISHOP_QUEEN, W_BISHOP_KING), (W_QUEEN,), (W_KING,),
+        tuple(range(W_PAWN_CASTLE_QUEEN, W_PAWN_CASTLE_KING + 1)),
+        (B_CASTLE_QUEEN, B_CASTLE_KING), (B_KNIGHT_QUEEN, B_KNIGHT_KING),
+        (B_BISHOP_QUEEN, B_BISHOP_KING), (B_QUEEN,), (B_KING,),
+        tuple(range(B_PAWN_CASTLE_QUEEN, B_PAWN_CASTLE_KING + 1)))):
+    EPD_CODES[_k, :len(_codes)] = _codes
+    EPD_NCODES[_k] = len(_codes)
+
+# Status of each position parsed by parse_epd_boards_num
+EPD_OK, EPD_SYNTAX_ERROR, EPD_TOO_MANY_PIECES = range(3)
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def __parse_epd_board_num(field, board, promoted, kinds):
+    # Symbols of the piece placement
+    kinds[...] = -1
+    i = 0
+    j = MAXJ - 1
+    for c in field:
+        if c == EPD_SLASH:
+            if i != MAXI or j == 0:
+                return EPD_SYNTAX_ERROR
+            i = 0
+            j -= 1
+        elif c > EPD_ZERO and c <= EPD_EIGHT:
+            i += c - EPD_ZERO
+            if i > MAXI:
+                return EPD_SYNTAX_ERROR
+        else:
+            if i >= MAXI or EPD_KIND[c] < 0:
+                return EPD_SYNTAX_ERROR
+            kinds[i, j] = EPD_KIND[c]
+            i += 1
+    if i != MAXI or j != 0:
+        return EPD_SYNTAX_ERROR
+
+    board[...] = EMPTY
+    promoted[...] = 0
+    used = zeros(MAXPIECE + 1, bool_)
+    # Pawns on the code of their file, pieces on the codes of their kind
+    for i in range(MAXI):
+        for j in range(MAXJ):
+            k = kinds[i, j]
+            if k < 0:
+                continue
+            if k == EPD_W_PAWN or k == EPD_B_PAWN:
+                if not used[EPD_CODES[k, i]]:
+                    board[i, j] = EPD_CODES[k, i]
+                    used[board[i, j]] = True
+                continue
+            for n in range(EPD_NCODES[k]):
+                if not used[EPD_CODES[k, n]]:
+                    board[i, j] = EPD_CODES[k, n]
+                    used[board[i, j]] = True
+                    break
+    # Then the remaining pawns, and the extra pieces on the codes of the
+    # pawns left, as promoted pawns
+    for extra in range(2):
+        for i in range(MAXI):
+            for j in range(MAXJ):
+                k = kinds[i, j]
+                if k < 0 or board[i, j] != EMPTY:
+                    continue
+                is_pawn = k == EPD_W_PAWN or k == EPD_B_PAWN
+                if is_pawn == (extra == 1):
+                    continue
+                pk = EPD_W_PAWN if k <= EPD_W_PAWN else EPD_B_PAWN
+                for n in range(MAXI):
+                    if not used[EPD_CODES[pk, n]]:
+                        board[i, j] = EPD_CODES[pk, n]
+                        used[board[i, j]] = True
+                        if extra == 1:
+                            promoted[IMAPNUM(board[i, j])] = EPD_CODES[k, 0]
+                        break
+                if board[i, j] == EMPTY:
+                    return EPD_TOO_MANY_PIECES
+    return EPD_OK
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def parse_epd_boards_num(buffer, offsets, B, promoted, status):
+    """Boards and promoted vectors of a batch of EPD piece placements,
+    the one of position n being buffer[offsets[n]:offsets[n+1]]. status
+    flags the positions that could not be parsed.
+    """
+    kinds = empty((MAXI, MAXJ), int64)
+    for n in range(B.shape[0]):
+        status[n] = __parse_epd_board_num(
+            buffer[offsets[n]:offsets[n+1]], B[n], promoted[n], kinds)
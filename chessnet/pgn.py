@@ -0,0 +1,534 @@
+import io
+import re
+from collections.abc import Sequence
+
+from numpy import frombuffer, uint8, int8
+
+from . import util
+from .constants import (
+    MAXI, MAXJ, MAXPIECE, PIECE_NAMES, IMAPNUM, EMPTY, UCISZ, UCIWIDTH,
+    UCI_OFFSET)
+from .parse import __init_board_num as init_board_num
+
+# Native pgn reader. Games are split and tokenized following the same rules
+# as chess.pgn.read_game, but only the mainline san movements are kept and
+# they are resolved to uci on a plain list board, with no Game tree, legal
+# move generation or Board copies. Games the reader can not resolve (custom
+# starting positions, null moves, illegal or ambiguous san) are handed to
+# python-chess, which gives the very same movements and errors as before.
+
+TAG_REGEX = re.compile(
+    r'^\[([A-Za-z0-9][A-Za-z0-9_+#=:-]*)\s+\"([^\r]*)\"\]\s*$')
+
+MOVETEXT_REGEX = re.compile(r"""
+    (
+        [NBKRQ]?[a-h]?[1-8]?[\-x]?[a-h][1-8](?:=?[nbrqkNBRQK])?
+        |[PNBRQK]?@[a-h][1-8]
+        |--
+        |Z0
+        |0000
+        |@@@@
+        |O-O(?:-O)?
+        |0-0(?:-0)?
+    )
+    |(\{.*)
+    |(;.*)
+    |(\$[0-9]+)
+    |(\()
+    |(\))
+    |(\*|1-0|0-1|1/2-1/2)
+    |([\?!]{1,2})
+    """, re.DOTALL | re.VERBOSE)
+
+SAN_REGEX = re.compile(
+    r'^([NBKRQ])?([a-h])?([1-8])?[\-x]?([a-h])([1-8])(=?[nbrqNBRQ])?\Z')
+
+# Seven tag roster, with the defaults python-chess gives to missing tags
+TAG_ROSTER = (
+    ('Event', '?'), ('Site', '?'), ('Date', '????.??.??'), ('Round', '?'),
+    ('White', '?'), ('Black', '?'), ('Result', '*'),
+    )
+
+# Headers of games the native reader does not handle
+UNSUPPORTED_TAGS = ('FEN', 'SetUp', 'Variant')
+
+# Piece kinds on the san board: positive for white, negative for black
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+KINDS = {'p': PAWN, 'N': KNIGHT, 'B': BISHOP, 'R': ROOK, 'Q': QUEEN,
+         'K': KING}
+PROMOTIONS = {'n': KNIGHT, 'b': BISHOP, 'r': ROOK, 'q': QUEEN}
+
+# Cell offsets (cell = i*MAXJ + j, i the file and j the rank, as in the
+# numeric board of parse.py) of the moves of each piece
+KNIGHT_STEPS = ((-1, 2), (1, 2), (2, 1), (2, -1),
+                (1, -2), (-1, -2), (-2, -1), (-2, 1))
+KING_STEPS = ((-1, -1), (-1, 0), (-1, 1), (0, -1),
+              (0, 1), (1, -1), (1, 0), (1, 1))
+ROOK_STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+BISHOP_STEPS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+CELL_NAMES = [(chr(ord('a') + i) + str(j + 1))
+              for i in range(MAXI) for j in range(MAXJ)]
+
+
+class SANError(ValueError):
+    pass
+
+
+def __neighbours(steps):
+    # Cells reachable from each cell with one of the steps
+    table = list()
+    for i in range(MAXI):
+        for j in range(MAXJ):
+            table.append(tuple((i+di)*MAXJ + j+dj for di, dj in steps
+                               if 0 <= i+di < MAXI and 0 <= j+dj < MAXJ))
+    return table
+
+
+def __rays(steps):
+    # Cells along each direction from each cell, nearest first
+    table = list()
+    for i in range(MAXI):
+        for j in range(MAXJ):
+            rays = list()
+            for di, dj in steps:
+                ray = list()
+                x, y = i + di, j + dj
+                while 0 <= x < MAXI and 0 <= y < MAXJ:
+                    ray.append(x*MAXJ + y)
+                    x, y = x + di, y + dj
+                if ray:
+                    rays.append(tuple(ray))
+            table.append(tuple(rays))
+    return table
+
+
+KNIGHT_CELLS = __neighbours(KNIGHT_STEPS)
+KING_CELLS = __neighbours(KING_STEPS)
+ROOK_RAYS = __rays(ROOK_STEPS)
+BISHOP_RAYS = __rays(BISHOP_STEPS)
+
+
+def __initial_board():
+    # Piece kinds of the initial numeric board of parse.py
+    B = init_board_num(MAXI, MAXJ)
+    board = [0] * (MAXI * MAXJ)
+    for i in range(MAXI):
+        for j in range(MAXJ):
+            if B[i, j] != EMPTY:
+                name = PIECE_NAMES[IMAPNUM(B[i, j])]
+                sign = 1 if name.strip()[-1] == 'w' else -1
+                board[i*MAXJ + j] = sign * KINDS[name[0]]
+    return board
+
+
+INITIAL_BOARD = __initial_board()
+assert sum(1 for kind in INITIAL_BOARD if kind) == MAXPIECE
+
+
+def is_attacked(board, cell, sign):
+    """True if cell is attacked by any piece of color sign (1 for white,
+    -1 for black).
+    """
+    for c in KNIGHT_CELLS[cell]:
+        if board[c] == sign * KNIGHT:
+            return True
+    for c in KING_CELLS[cell]:
+        if board[c] == sign * KING:
+            return True
+    for rays, kind in ((ROOK_RAYS, ROOK), (BISHOP_RAYS, BISHOP)):
+        for ray in rays[cell]:
+            for c in ray:
+                if board[c]:
+                    if board[c] == sign * kind or board[c] == sign * QUEEN:
+                        return True
+                    break
+    # Pawns attack diagonally forward, so look backwards from cell
+    i, j = divmod(cell, MAXJ)
+    j -= sign
+    if 0 <= j < MAXJ:
+        for x in (i - 1, i + 1):
+            if 0 <= x < MAXI and board[x*MAXJ + j] == sign * PAWN:
+                return True
+    return False
+
+
+def __leaves_king_safe(board, sign, origin, target, captured):
+    # Plays origin->target on a copy and checks the own king
+    board = list(board)
+    board[target] = board[origin]
+    board[origin] = 0
+    if captured is not None:
+        board[captured] = 0
+    king = board.index(sign * KING)
+    return not is_attacked(board, king, -sign)
+
+
+def __piece_origins(board, kind, sign, target):
+    # Cells from where a non pawn piece of kind and color sign can reach
+    # target
+    piece = sign * kind
+    if kind == KNIGHT:
+        return [c for c in KNIGHT_CELLS[target] if board[c] == piece]
+    if kind == KING:
+        return [c for c in KING_CELLS[target] if board[c] == piece]
+    origins = list()
+    rays = list()
+    if kind in (ROOK, QUEEN):
+        rays.extend(ROOK_RAYS[target])
+    if kind in (BISHOP, QUEEN):
+        rays.extend(BISHOP_RAYS[target])
+    for ray in rays:
+        for c in ray:
+            if board[c]:
+                if board[c] == piece:
+                    origins.append(c)
+                break
+    return origins
+
+
+def play_san(board, state, san, sign):
+    """Resolves a san movement of color sign and plays it on board.
+
+    INPUT:
+        board: (list)
+            san board, list of MAXI*MAXJ piece kinds.
+        state: (list)
+            [en passant cell or None], updated in place.
+        san: (str)
+            movement token as split by MOVETEXT_REGEX.
+        sign: (int)
+            1 if white moves, -1 if black.
+
+    OUTPUT:
+        uci movement as str. Raises SANError if the movement can not
+        be resolved.
+    """
+    if san in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        j = 0 if sign == 1 else MAXJ - 1
+        king = 4*MAXJ + j
+        if len(san) == 3:
+            target, rook, rook_to = 6*MAXJ + j, 7*MAXJ + j, 5*MAXJ + j
+        else:
+            target, rook, rook_to = 2*MAXJ + j, 0*MAXJ + j, 3*MAXJ + j
+        step = 1 if target > king else -1
+        if board[king] != sign * KING or board[rook] != sign * ROOK or\
+                any(board[c] for c in range(king + step*MAXJ, rook, step*MAXJ))\
+                or any(is_attacked(board, c, -sign)
+                       for c in (king, king + step*MAXJ, target)):
+            raise SANError('Can not castle: %s' % san)
+        board[target], board[king] = board[king], 0
+        board[rook_to], board[rook] = board[rook], 0
+        state[0] = None
+        return CELL_NAMES[king] + CELL_NAMES[target]
+
+    match = SAN_REGEX.match(san)
+    if match is None:
+        raise SANError('Unsupported san: %s' % san)
+    piece, from_file, from_rank, to_file, to_rank, promotion = match.groups()
+    ti, tj = ord(to_file) - ord('a'), int(to_rank) - 1
+    target = ti*MAXJ + tj
+    if board[target] * sign > 0:
+        raise SANError('Target occupied: %s' % san)
+
+    captured = None
+    if piece is None:
+        kind = PAWN
+        last = MAXJ - 1 if sign == 1 else 0
+        if (tj == last) != (promotion is not None):
+            raise SANError('Bad promotion: %s' % san)
+        if from_file is None or from_file == to_file:
+            # Pushes, only allowed on the same file
+            if board[target]:
+                raise SANError('Pawn push blocked: %s' % san)
+            origins = list()
+            one = target - sign
+            if 0 <= tj - sign < MAXJ:
+                if board[one] == sign * PAWN:
+                    origins.append(one)
+                elif not board[one] and tj == (3 if sign == 1 else 4) and\
+                        board[one - sign] == sign * PAWN:
+                    origins.append(one - sign)
+        else:
+            fi = ord(from_file) - ord('a')
+            if abs(fi - ti) != 1 or not 0 <= tj - sign < MAXJ:
+                raise SANError('Bad pawn capture: %s' % san)
+            origin = fi*MAXJ + tj - sign
+            if board[origin] != sign * PAWN:
+                raise SANError('No pawn to capture: %s' % san)
+            if not board[target]:
+                if state[0] != target:
+                    raise SANError('Bad pawn capture: %s' % san)
+                captured = ti*MAXJ + tj - sign
+            origins = [origin]
+    else:
+        kind = KINDS[piece]
+        origins = __piece_origins(board, kind, sign, target)
+        if from_file is not None:
+            fi = ord(from_file) - ord('a')
+            origins = [c for c in origins if c // MAXJ == fi]
+
+    if from_rank is not None:
+        fj = int(from_rank) - 1
+        origins = [c for c in origins if c % MAXJ == fj]
+    if len(origins) > 1:
+        # San is disambiguated among legal movements only, drop pinned
+        origins = [c for c in origins
+                   if __leaves_king_safe(board, sign, c, target, captured)]
+    if len(origins) != 1:
+        raise SANError('%s san: %s' % (
+            'Ambiguous' if origins else 'Illegal', san))
+
+    origin = origins[0]
+    board[target], board[origin] = board[origin], 0
+    if captured is not None:
+        board[captured] = 0
+    if is_attacked(board, board.index(sign * KING), -sign):
+        # The board is left as is, the game is not resolved natively
+        raise SANError('King left in check: %s' % san)
+    state[0] = None
+    uci = CELL_NAMES[origin] + CELL_NAMES[target]
+    if kind == PAWN:
+        if abs(tj - origin % MAXJ) == 2:
+            state[0] = target - sign
+        if promotion is not None:
+            promoted = promotion[-1].lower()
+            board[target] = sign * PROMOTIONS[promoted]
+            uci += promoted
+    return uci
+
+
+class MoveBuffer(Sequence):
+
+    def __init__(self, movements=()):
+        """uci movements of a game held in one contiguous byte buffer,
+        UCIWIDTH bytes per movement (promotion suffix included, padded
+        with spaces). It behaves as the list of the movements as bytes,
+        and decode gives the array of board coordinates of all of them
+        at once.
+
+        INPUT:
+            movements: (bytes, iterable(bytes))
+                the buffer itself, or the movements as bytes.
+        """
+        if isinstance(movements, (bytes, bytearray)):
+            buffer = bytes(movements)
+            n = len(buffer) // UCIWIDTH
+        else:
+            movements = list(movements)
+            buffer = b''.join(m.ljust(UCIWIDTH) for m in movements)
+            n = len(movements)
+        if len(buffer) != n * UCIWIDTH:
+            raise ValueError('Not a buffer of uci movements')
+        self.buffer = buffer
+
+    @classmethod
+    def from_uci(cls, movements):
+        """MoveBuffer of an iterable of uci movements as str"""
+        return cls(''.join(m.ljust(UCIWIDTH) for m in movements).encode())
+
+    def __len__(self):
+        return len(self.buffer) // UCIWIDTH
+
+    def __getitem__(self, val):
+        if isinstance(val, slice):
+            return MoveBuffer(b''.join(
+                self.buffer[k*UCIWIDTH:(k+1)*UCIWIDTH]
+                for k in range(len(self))[val]))
+        if val < 0:
+            val += len(self)
+        if not 0 <= val < len(self):
+            raise IndexError('MoveBuffer index out of range')
+        return self.buffer[val*UCIWIDTH:(val+1)*UCIWIDTH].rstrip()
+
+    def __iter__(self):
+        buffer = self.buffer
+        for k in range(0, len(buffer), UCIWIDTH):
+            yield buffer[k:k+UCIWIDTH].rstrip()
+
+    def __eq__(self, other):
+        if isinstance(other, MoveBuffer):
+            return self.buffer == other.buffer
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.buffer)
+
+    def __repr__(self):
+        return 'MoveBuffer(%r)' % list(self)
+
+    def decode(self):
+        """Board coordinates (x0, y0, xf, yf) of the movements as an int8
+        (n, UCISZ) array, decoded with a single pass over the buffer.
+        Raises ValueError if there are no movements or any of them is
+        shorter than UCISZ.
+        """
+        cells = frombuffer(self.buffer, uint8).reshape(-1, UCIWIDTH)
+        cells = cells[:, :UCISZ]
+        if not len(cells) or (cells == ord(' ')).any():
+            raise ValueError('Invalid uci movements')
+        return (cells - UCI_OFFSET).astype(int8)
+
+    @property
+    def promotions(self):
+        """Promotion suffixes as a bytes string, one byte per movement
+        (a space if none)
+        """
+        return frombuffer(self.buffer, uint8).reshape(-1, UCIWIDTH)[
+            :, UCISZ].tobytes()
+
+
+def san_to_uci(sanmovements):
+    """Resolves a mainline of san movements from the initial position.
+    Returns the uci movements as a MoveBuffer.
+    """
+    board = list(INITIAL_BOARD)
+    state = [None]
+    sign = 1
+    movements = list()
+    for san in sanmovements:
+        movements.append(play_san(board, state, san, sign))
+        sign = -sign
+    return MoveBuffer.from_uci(movements)
+
+
+def read_game_text(handle):
+    """Reads the next game of an open pgn stream, splitting it as
+    chess.pgn.read_game does.
+
+    OUTPUT:
+        (headers, sanmovements, result, lines), where headers is a list of
+        (tag, value) pairs, sanmovements the mainline tokens, result the
+        result token of the mainline (or None) and lines the raw lines of
+        the game. None at the end of the stream.
+    """
+    lines = list()
+
+    def readline():
+        line = handle.readline()
+        lines.append(line)
+        return line
+
+    # Ignore leading empty lines and comments
+    line = readline().lstrip('\ufeff')
+    while line.isspace() or line.startswith('%') or line.startswith(';'):
+        line = readline()
+
+    # Headers, with up to one consecutive empty line between them
+    headers = list()
+    found_game = False
+    consecutive_empty_lines = 0
+    while line:
+        if line.startswith('%') or line.startswith(';'):
+            line = readline()
+            continue
+        if consecutive_empty_lines < 1 and line.isspace():
+            consecutive_empty_lines += 1
+            line = readline()
+            continue
+        found_game = True
+        if not line.startswith('['):
+            break
+        consecutive_empty_lines = 0
+        tag_match = TAG_REGEX.match(line)
+        if tag_match:
+            headers.append((tag_match.group(1), tag_match.group(2)))
+        line = readline()
+    if not found_game:
+        return None
+
+    # Movetext, up to the first empty line. Variations are skipped, the
+    # tokens of the mainline are kept
+    sanmovements = list()
+    result = None
+    depth = 0
+    fresh_line = True
+    while line:
+        if fresh_line:
+            if line.startswith('%') or line.startswith(';'):
+                line = readline()
+                continue
+            if line.isspace():
+                break
+        fresh_line = True
+        for match in MOVETEXT_REGEX.finditer(line):
+            token = match.group(0)
+            if token.startswith('{'):
+                # Consume until the end of the comment
+                line = token
+                while line and '}' not in line:
+                    line = readline()
+                line = line[line.find('}') + 1:] if line else line
+                fresh_line = False
+                break
+            elif token == '(':
+                if depth or sanmovements:
+                    depth += 1
+            elif token == ')':
+                if depth:
+                    depth -= 1
+            elif depth:
+                continue
+            elif token.startswith(';'):
+                break
+            elif match.group(7) is not None:
+                # Only taken while no result other than * is found
+                if result in (None, '*'):
+                    result = token
+            elif match.group(1) is not None:
+                sanmovements.append(token)
+        if fresh_line:
+            line = readline()
+    return headers, sanmovements, result, lines
+
+
+def parse_pgn_game(headers, sanmovements, result, lines, validate=False):
+    """Resolves a game read by read_game_text. Falls back to python-chess
+    if the game can not be resolved natively, or always if validate.
+
+    OUTPUT:
+        (movements, metadata), with movements the MoveBuffer of the uci
+        movements and metadata a dict with the pgn headers.
+    """
+    metadata = dict(TAG_ROSTER)
+    metadata.update(headers)
+    if metadata['Result'] == '*' and result is not None:
+        # As python-chess, take the result of the movetext if missing
+        metadata['Result'] = result
+    if not validate and not any(tag in metadata for tag in UNSUPPORTED_TAGS):
+        try:
+            return san_to_uci(sanmovements), metadata
+        except SANError:
+            pass
+    try:
+        import chess.pgn
+    except ImportError:
+        util.get_logger('pgn').warning(
+            'Could not resolve game natively and python-chess is missing')
+        raise
+    game = chess.pgn.read_game(io.StringIO(''.join(lines)))
+    movements = MoveBuffer.from_uci(
+        move.uci() for move in game.mainline_moves())
+    if validate:
+        try:
+            native = san_to_uci(sanmovements)
+        except SANError:
+            native = None
+        if native is not None and native != movements:
+            util.get_logger('pgn').warning(
+                'Native and python-chess movements differ: %s' %
+                ' '.join(dict(game.headers).values()))
+    return movements, metadata
+
+
+def iter_pgn_games(pgnfile, validate=False):
+    """Generator over the games of an open pgn stream, yielding
+    (movements, metadata) for each game. See parse_pgn_game.
+    """
+    while True:
+        game = read_game_text(pgnfile)
+        if game is None:
+            break
+        yield parse_pgn_game(*game, validate=validate)
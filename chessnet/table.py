@@ -0,0 +1,347 @@
+import os
+import shutil
+import struct
+import zipfile
+from collections import OrderedDict
+
+from numpy import (
+    memmap, load, zeros, asarray, array, arange, repeat, concatenate, unique,
+    int64)
+from numpy.lib import format as npformat
+
+from .pgn import TAG_ROSTER
+
+# pgn headers stored with the per ply metrics of each match, followed by
+# the winner column of Match.ToPandas
+HEADER_COLUMNS = tuple(tag for tag, _ in TAG_ROSTER) + ('winner',)
+
+FORMATS = ('parquet', 'npz')
+
+# Number of matches in each chunk (parquet row group) written by write_table
+CHUNKSIZE = 256
+
+
+# A table holds one row per ply of every match: the match index, the ply,
+# the metrics of Match.ToPandas and the pgn headers of the match. Parquet
+# tables (written with pyarrow) hold all the columns, the headers as
+# dictionary encoded strings, and each appended chunk is a row group.
+# npz tables are uncompressed, so every column can be memory mapped from
+# the file: the per ply columns are stored as <column>.npy and the headers
+# once per match as matches/<column>.npy, together with matches/match and
+# matches/plies (the index and number of rows of each match).
+
+def has_pyarrow():
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
+
+
+def get_format(path, format=None):
+    """Format of a table: the one given, the one of the path extension
+    (.parquet or .npz), or parquet if pyarrow is installed and npz
+    otherwise.
+    """
+    if format is None:
+        ext = os.path.splitext(path)[1].lower()
+        if ext in ('.parquet', '.npz'):
+            format = ext[1:]
+        else:
+            format = 'parquet' if has_pyarrow() else 'npz'
+    if format not in FORMATS:
+        raise ValueError('Unknown table format: %s' % format)
+    return format
+
+
+def match_chunk(matches, vec=None):
+    """Per ply columns of a list of valid matches.
+
+    INPUT:
+        matches: (list(Match))
+            valid matches, whose idx is used as match index.
+        vec: (list(str), None)
+            metric names, defaults to all vector_names.
+
+    OUTPUT:
+        (idx, lengths, headers, columns), where idx and lengths are the
+        index and number of rows of each match, headers a tuple with the
+        HEADER_COLUMNS of each match and columns an OrderedDict with the
+        match, ply and metrics columns.
+    """
+    idx = list()
+    headers = list()
+    lengths = list()
+    parts = OrderedDict()
+    for match in matches:
+        values = match.metrics(vec)
+        lengths.append(len(next(iter(values.values()))))
+        idx.append(match.idx)
+        metadata = match.metadata or {}
+        winner = match.winner[0] if 'Result' in metadata else 'tables'
+        headers.append(tuple(str(metadata.get(tag, default))
+                             for tag, default in TAG_ROSTER) + (winner,))
+        for name, value in values.items():
+            parts.setdefault(name, list()).append(value)
+    idx = asarray(idx, dtype=int64)
+    lengths = asarray(lengths, dtype=int64)
+    columns = OrderedDict()
+    columns['match'] = repeat(idx, lengths)
+    columns['ply'] = concatenate([arange(n) for n in lengths]) \
+        if len(lengths) else zeros(0, int64)
+    for name, lst in parts.items():
+        columns[name] = concatenate(lst)
+    return idx, lengths, headers, columns
+
+
+class TableWriter:
+
+    def __init__(self, path, format=None):
+        """Writes a table in streaming fashion, one chunk of matches at a
+        time, see match_chunk.
+
+        INPUT:
+            path: (str)
+                table file.
+            format: (str, None)
+                'parquet' or 'npz', see get_format.
+        """
+        self.path = path
+        self.format = get_format(path, format)
+        self.rows = 0
+        self.dtypes = None
+        self.idx = list()
+        self.plies = list()
+        self.headers = list()
+        self._writer = None
+        self._files = None
+        self._parts = path + '.parts'
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.idx)
+
+    def append(self, chunk, offset=0):
+        """Appends a chunk of matches, whose indexes are shifted by offset"""
+        idx, lengths, headers, columns = chunk
+        if not len(idx):
+            return
+        columns = OrderedDict(columns)
+        columns['match'] = columns['match'] + offset
+        if self.dtypes is None:
+            self.dtypes = OrderedDict((name, value.dtype)
+                                      for name, value in columns.items())
+        if self.format == 'parquet':
+            self.append_parquet(lengths, headers, columns)
+        else:
+            self.append_npz(columns)
+            self.plies.extend(int(n) for n in lengths)
+            self.headers.extend(headers)
+        self.idx.extend(int(i) + offset for i in idx)
+        self.rows += len(columns['match'])
+
+    def append_parquet(self, lengths, headers, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        names = list(columns)
+        arrays = [pa.array(asarray(value, dtype=self.dtypes[name]))
+                  for name, value in columns.items()]
+        # Headers are dictionary encoded: one entry per match
+        indices = pa.array(repeat(arange(len(lengths), dtype='int32'),
+                                  lengths))
+        for k, name in enumerate(HEADER_COLUMNS):
+            names.append(name)
+            arrays.append(pa.DictionaryArray.from_arrays(
+                indices, pa.array([h[k] for h in headers], pa.string())))
+        table = pa.Table.from_arrays(arrays, names=names)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def append_npz(self, columns):
+        if self._files is None:
+            os.makedirs(self._parts, exist_ok=True)
+            self._files = OrderedDict(
+                (name, open(os.path.join(self._parts, name + '.dat'), 'wb'))
+                for name in self.dtypes)
+        for name, f in self._files.items():
+            asarray(columns[name], dtype=self.dtypes[name]).tofile(f)
+
+    def close(self):
+        """Writes the file (npz) or its footer (parquet)"""
+        if self._closed:
+            return
+        self._closed = True
+        if self.format == 'parquet':
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            else:
+                self.write_empty_parquet()
+            return
+        for f in (self._files or {}).values():
+            f.close()
+        with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_STORED,
+                             allowZip64=True) as zf:
+            for name, dtype in (self.dtypes or {}).items():
+                header = {'descr': npformat.dtype_to_descr(dtype),
+                          'fortran_order': False, 'shape': (self.rows,)}
+                with zf.open(name + '.npy', 'w', force_zip64=True) as out:
+                    npformat.write_array_header_2_0(out, header)
+                    with open(os.path.join(self._parts, name + '.dat'),
+                              'rb') as f:
+                        shutil.copyfileobj(f, out)
+            match_columns = [('match', asarray(self.idx, dtype=int64)),
+                             ('plies', asarray(self.plies, dtype=int64))]
+            for k, name in enumerate(HEADER_COLUMNS):
+                match_columns.append(
+                    (name, array([h[k] for h in self.headers], dtype=str)))
+            for name, value in match_columns:
+                with zf.open('matches/%s.npy' % name, 'w',
+                             force_zip64=True) as out:
+                    npformat.write_array(out, value)
+        self._files = None
+        shutil.rmtree(self._parts, ignore_errors=True)
+
+    def write_empty_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        names = ['match', 'ply'] + list(HEADER_COLUMNS)
+        arrays = [pa.array([], pa.int64())] * 2 + \
+            [pa.array([], pa.string())] * len(HEADER_COLUMNS)
+        pq.write_table(pa.Table.from_arrays(arrays, names=names), self.path)
+
+
+def write_table(matches, path, vec=None, format=None, chunksize=CHUNKSIZE):
+    """Writes the per ply metrics and headers of an iterable of matches
+    (a MatchSet, the output of ingest.iter_matches, ...) as a table.
+    Invalid matches are skipped.
+    """
+    with TableWriter(path, format) as writer:
+        chunk = list()
+        for match in matches:
+            if not match.is_valid_match:
+                continue
+            chunk.append(match)
+            if len(chunk) == chunksize:
+                writer.append(match_chunk(chunk, vec))
+                chunk = list()
+        if chunk:
+            writer.append(match_chunk(chunk, vec))
+    return path
+
+
+def npz_members(path):
+    """Data offset, dtype and shape of each array of an uncompressed npz
+    file, so they can be memory mapped.
+    """
+    members = OrderedDict()
+    with zipfile.ZipFile(path) as zf, open(path, 'rb') as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                members[info.filename[:-4]] = None
+                continue
+            # The data follows the local header, whose extra field may
+            # differ from the one of the central directory
+            f.seek(info.header_offset + 26)
+            n, m = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + n + m)
+            version = npformat.read_magic(f)
+            if version == (1, 0):
+                shape, _, dtype = npformat.read_array_header_1_0(f)
+            else:
+                shape, _, dtype = npformat.read_array_header_2_0(f)
+            members[info.filename[:-4]] = (f.tell(), dtype, shape)
+    return members
+
+
+class Table:
+
+    def __init__(self, path):
+        """Read only view of a table written by TableWriter. The columns
+        of npz tables are memory mapped, those of parquet tables are read
+        on access.
+
+        INPUT:
+            path: (str)
+                table file.
+        """
+        self.path = path
+        self.format = 'npz' if zipfile.is_zipfile(path) else 'parquet'
+        self._members = npz_members(path) if self.format == 'npz' else None
+        self._columns = dict()
+
+    @property
+    def columns(self):
+        """Names of the columns, as ordered in ToPandas"""
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.read_schema(self.path).names
+        return [name for name in self._members
+                if not name.startswith('matches/')] + list(HEADER_COLUMNS)
+
+    def __len__(self):
+        """Number of rows (plies)"""
+        return len(self.column('match'))
+
+    def member(self, name):
+        # Memory mapped array of an npz table
+        if name not in self._columns:
+            member = self._members[name]
+            if member is None:
+                value = load(self.path)[name]
+            elif 0 in member[2]:
+                # Empty arrays can not be memory mapped
+                value = zeros(member[2], member[1])
+            else:
+                offset, dtype, shape = member
+                value = memmap(self.path, dtype=dtype, mode='r',
+                               offset=offset, shape=shape)
+            self._columns[name] = value
+        return self._columns[name]
+
+    def column(self, name):
+        """Values of column name, one per row"""
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.read_table(self.path, columns=[name]).column(name)\
+                .to_numpy()
+        if name in HEADER_COLUMNS:
+            rows = repeat(arange(len(self.member('matches/match'))),
+                          self.member('matches/plies'))
+            return asarray(self.member('matches/' + name))[rows]
+        return self.member(name)
+
+    def ToPandas(self, columns=None):
+        """Table as a DataFrame, with the header columns as categoricals.
+
+        INPUT:
+            columns: (list(str), None)
+                columns to read, defaults to all.
+        """
+        import pandas as pd
+        if self.format == 'parquet':
+            return pd.read_parquet(self.path, columns=columns)
+        names = self.columns if columns is None else columns
+        data = OrderedDict()
+        for name in names:
+            if name in HEADER_COLUMNS:
+                rows = repeat(arange(len(self.member('matches/match'))),
+                              self.member('matches/plies'))
+                values, codes = unique(self.member('matches/' + name),
+                                       return_inverse=True)
+                data[name] = pd.Categorical.from_codes(codes[rows], values)
+            else:
+                data[name] = asarray(self.member(name))
+        return pd.DataFrame(data)
+
+
+def read_table(path, columns=None):
+    """Reads a table written by TableWriter as a DataFrame"""
+    return Table(path).ToPandas(columns)
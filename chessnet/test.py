@@ -1,11 +1,31 @@
-from numpy import array, zeros
+import io
+import json
+import os
+import shutil
+import sys
+import subprocess
+import tempfile
+
+from numpy import array, zeros, mean, std, allclose
 from numpy.testing import assert_array_equal
 
 from . import util
 from . import parse
-from .constants import NPDTYPE
-from .compute import compute_match, compute_state, compute_board_matrices
+from . import memo
+from .constants import NPDTYPE, MAXPIECES, BOARDSZ, testmultifilename
+from .compute import (
+    compute_match, compute_state, compute_board_matrices, compute_epd,
+    parse_compute_corpus)
 from .classes import MatchSet, Match, BoardState
+from .ingest import iter_matches, write_pgn_table, split_pgn_file, \
+    read_pgn_range
+from .pgn import SANError, san_to_uci, MoveBuffer
+from .bitboard import BitBoards
+from .cache import MatchCache
+from .transposition import TranspositionTable
+from .corpus import Corpus
+from .table import Table, read_table
+from .aggregate import PlyStats
 from .testdata import test_board, test_wAccessible, test_bAccessible, test_cm, test_promoted, test_match
 from .printers import print_contact_matrix_num
 # def test_numbers_3_4():
@@ -18,6 +38,540 @@ def test_match():
     pass
 
 
+def test_compute_match_kernel():
+    # The whole-match kernel must reproduce the per-ply computation
+    match = Match()
+    X, S, Kw, Kb = match.X.copy(), match.S.copy(), match.Kw.copy(), match.Kb.copy()
+    for A in (match.X, match.S, match.Kw, match.Kb):
+        A[...] = 0
+    for moveno in range(len(match)+1):
+        compute_state(match, moveno)
+    assert_array_equal(X, match.X)
+    assert_array_equal(S, match.S)
+    assert_array_equal(Kw, match.Kw)
+    assert_array_equal(Kb, match.Kb)
+
+    # And recomputing a match must not accumulate on previous results
+    match.compute()
+    assert_array_equal(S, match.S)
+
+
+def test_matchset_workers():
+    # The process pool must give the same matches, in the same order
+    ms = MatchSet()
+    ms_pool = MatchSet(workers=2)
+    assert len(ms) == len(ms_pool)
+    assert len(ms.invalid) == len(ms_pool.invalid)
+    for m1, m2 in zip(ms, ms_pool):
+        assert m1.idx == m2.idx
+        assert m1.metadata == m2.metadata
+        assert_array_equal(m1.B, m2.B)
+        assert_array_equal(m1.S, m2.S)
+        assert_array_equal(m1.X, m2.X)
+        assert_array_equal(m1.promoted, m2.promoted)
+
+
+test_wrapped_pgn_text = """[Event "Wrapped comments"]
+[White "A"]
+
+1. e4 { [%clk 0:03:00]
+[%eval 0.2] } 1... e5 2. Nf3 {
+[%clk 0:02:58] } Nc6 ; [%clk
+3. Bb5 a6 1-0
+
+[Event "Second"]
+
+1. d4 d5 *
+"""
+
+
+def test_split_pgn_file():
+    # Tag like lines inside comments must not split a game
+    path = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(path, 'wrapped.pgn')
+        with open(fname, 'w') as pgnfile:
+            pgnfile.write(test_wrapped_pgn_text)
+        mov_lst, meta_lst, _ = util.load_multipgn_file(fname)
+        assert len(mov_lst) == 2 and len(mov_lst[0]) == 6
+        tasks = split_pgn_file(fname, chunksize=1)
+        assert len(tasks) == 2
+        for task, movements, metadata in zip(tasks, mov_lst, meta_lst):
+            mov_range, meta_range = read_pgn_range(*task)
+            assert mov_range == [movements]
+            assert list(meta_range[0].items()) == list(metadata.items())
+    finally:
+        shutil.rmtree(path)
+
+
+def test_matchset_directory():
+    path = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(path, 'sub'))
+        shutil.copy(testmultifilename, os.path.join(path, 'a.pgn'))
+        shutil.copy(testmultifilename, os.path.join(path, 'sub', 'b.PGN'))
+        with open(os.path.join(path, 'notes.txt'), 'w') as f:
+            f.write('not a pgn file')
+        ms = MatchSet()
+        ms_dir = MatchSet(png_dir=path)
+        assert len(ms_dir) == len(ms)
+        assert [s['games'] for s in ms_dir.file_stats] ==\
+            [len(ms) + len(ms.invalid)]
+        ms_rec = MatchSet(png_dir=path, recursive=True, workers=2)
+        assert len(ms_rec) == 2 * len(ms)
+        assert [m.idx for m in ms_rec] == sorted(m.idx for m in ms_rec)
+        for m1, m2 in zip(list(ms) * 2, ms_rec):
+            assert m1.ucimovements == m2.ucimovements
+            assert_array_equal(m1.X, m2.X)
+            assert_array_equal(m1.S, m2.S)
+    finally:
+        shutil.rmtree(path)
+
+
+def test_instrumentation():
+    ms = MatchSet()
+    assert ms.stats is None
+    ms = MatchSet(stats=True)
+    st = ms.stats.as_dict()
+    games = len(ms) + len(ms.invalid)
+    assert st['read']['games'] == games
+    assert st['read']['bytes'] == os.path.getsize(testmultifilename)
+    assert st['match']['games'] == games
+    assert st['match'].get('invalid', 0) == len(ms.invalid)
+    assert st['match']['plies'] == sum(len(m) + 1 for m in ms)
+    assert st['decode']['calls'] == games
+    assert st['total']['seconds'] >= st['replay_compute']['seconds']
+    assert json.loads(ms.stats.to_json()) == st
+    # Worker instrumentation is merged in the parent
+    ms_w = MatchSet(workers=2, stats=True)
+    assert ms_w.stats.as_dict()['match']['plies'] == st['match']['plies']
+
+
+def test_table():
+    ms = MatchSet()
+    path = tempfile.mkdtemp()
+    try:
+        table = Table(ms.to_table(os.path.join(path, 'ms.npz')))
+        df = table.ToPandas()
+        ref = ms.ToPandas()
+        assert len(table) == len(ref)
+        for name in ref.columns:
+            assert_array_equal(df[name].astype(ref[name].dtype), ref[name])
+        assert list(df['White'][:1]) == [ms[0].metadata['White']]
+        df_w = read_table(write_pgn_table(
+            testmultifilename, os.path.join(path, 'pool.npz'), workers=2,
+            chunksize=7))
+        assert df_w.equals(df)
+    finally:
+        shutil.rmtree(path)
+
+
+def test_transpositions():
+    ms = MatchSet()
+    table = TranspositionTable(maxbytes=2**20, maxply=1000)
+    for _ in range(2):
+        ms_t = MatchSet(transpositions=table)
+        assert len(ms_t) == len(ms)
+        for m1, m2 in zip(ms, ms_t):
+            assert_array_equal(m1.X, m2.X)
+            assert_array_equal(m1.S, m2.S)
+            assert_array_equal(m1.Kw, m2.Kw)
+            assert_array_equal(m1.Kb, m2.Kb)
+    # Every match starts on the same board
+    assert table.hits >= 2 * len(ms) - 1
+    assert table.stats()['lookups'] == 2 * sum(len(m) + 1 for m in ms)
+
+
+def test_share_prefixes():
+    ms = MatchSet()
+    ms_t = MatchSet(share_prefixes=True)
+    assert len(ms_t) == len(ms) and len(ms_t.invalid) == len(ms.invalid)
+    assert len(ms_t.trie) < ms_t.trie.plies == sum(len(m) + 1 for m in ms)
+    for m1, m2 in zip(ms, ms_t):
+        for name in ('B', 'X', 'S', 'Kw', 'Kb', 'pieces', 'promoted'):
+            assert_array_equal(getattr(m1, name), getattr(m2, name))
+    match = ms_t[0]
+    assert not match.X.flags.writeable
+    # Recomputing a match gives it its own arrays
+    match.compute()
+    assert match.trie is None and match.X.flags.writeable
+    assert_array_equal(match.S, ms[0].S)
+
+
+def test_piece_list():
+    ms = MatchSet()
+    for match in ms[:20]:
+        B = zeros(match.B.shape, NPDTYPE)
+        pieces = zeros(match.pieces.shape, NPDTYPE)
+        promoted = zeros(match.promoted.shape, NPDTYPE)
+        squares = zeros((len(B), MAXPIECES), NPDTYPE)
+        parse.replay_match_squares(match.movements, B, pieces, promoted,
+                                   squares)
+        assert_array_equal(B, match.B)
+        assert_array_equal(promoted, match.promoted)
+        for n in range(len(B)):
+            # The piece list is the inverse of the board
+            board = zeros(BOARDSZ, NPDTYPE)
+            for pn in range(MAXPIECES):
+                if squares[n, pn] >= 0:
+                    board[squares[n, pn]] = pn + 1
+            assert_array_equal(board, B[n].ravel())
+            assert_array_equal(pieces[n], parse.__find_pieces_num(B[n]))
+
+
+def test_threads():
+    ms = MatchSet()
+    ms_t = MatchSet(threads=2)
+    assert len(ms_t) == len(ms)
+    for m1, m2 in zip(ms, ms_t):
+        for name in ('B', 'X', 'S', 'Kw', 'Kb', 'pieces', 'promoted'):
+            assert_array_equal(getattr(m1, name), getattr(m2, name))
+    # Invalid games have no rows
+    movements_set = [ms[0].ucimovements, [b'e2e4', b'e7'],
+                     ms[1].ucimovements]
+    offsets, arrays = parse_compute_corpus(movements_set, threads=1)
+    assert offsets[1] == offsets[2] == len(ms[0]) + 1
+    assert_array_equal(arrays['S'][offsets[2]:], ms[1].S)
+
+
+def test_threads_then_workers():
+    # Worker processes started after the parallel kernel must not hang the
+    # interpreter at exit
+    code = ('import chessnet; '
+            'f = chessnet.K.testmultifilename; '
+            'a = chessnet.MatchSet(f, threads=2); '
+            'b = chessnet.MatchSet(f, workers=2); '
+            'print(len(a) == len(b))')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, '-c', code], cwd=root, check=True,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         universal_newlines=True, timeout=120)
+    assert out.stdout.strip() == 'True'
+
+
+def test_aggregate():
+    ms = MatchSet()
+    agg = ms.aggregate(['Dconnectance'], align='winner')
+    won = [m for m in ms if m.winner[0] in ('White', 'Black')]
+    assert agg.matches == len(won) and agg.skipped == len(ms) - len(won)
+    lW = [m.w_Dconnectance if m.winner[0] == 'White' else m.b_Dconnectance
+          for m in won]
+    for ply in (0, 10, len(agg) - 1):
+        values = [v[ply] for v in lW if ply < len(v)]
+        assert agg.n('winner_Dconnectance')[ply] == len(values)
+        assert abs(agg.mean('winner_Dconnectance')[ply] -
+                   mean(values)) < 1e-9
+        assert abs(agg.std('winner_Dconnectance')[ply] - std(values)) < 1e-9
+        assert agg.max('winner_Dconnectance')[ply] == max(values)
+    # Streaming and merged partial results give the same statistics
+    streamed = PlyStats(['Dconnectance'], 'winner').update(
+        iter_matches(testmultifilename, batch=7))
+    merged = PlyStats(['Dconnectance'], 'winner').update(ms[:20]).merge(
+        PlyStats(['Dconnectance'], 'winner').update(ms[20:]))
+    for other in (streamed, merged):
+        for key in agg.keys:
+            assert_array_equal(other.n(key), agg.n(key))
+            assert allclose(other.mean(key), agg.mean(key))
+            assert allclose(other.var(key), agg.var(key))
+
+
+def test_iter_matches():
+    ms = MatchSet()
+    batches = list(iter_matches(testmultifilename, batch=7))
+    assert [len(b) for b in batches[:-1]] == [7]*(len(batches)-1)
+    matches = [m for b in batches for m in b]
+    assert [m.idx for m in matches] == [m.idx for m in ms]
+    for m1, m2 in zip(ms, matches):
+        assert_array_equal(m1.S, m2.S)
+
+
+def test_bitboard_engine():
+    # The bitboard engine must be bit-exact with the cell-wise kernel
+    match = Match()
+    match_bb = Match(engine='bitboard')
+    assert match_bb.is_valid_match
+    assert_array_equal(match.X, match_bb.X)
+    assert_array_equal(match.S, match_bb.S)
+    assert_array_equal(match.Kw, match_bb.Kw)
+    assert_array_equal(match.Kb, match_bb.Kb)
+
+    for board in test_board:
+        promoted = zeros(MAXPIECES, dtype=NPDTYPE)
+        X = zeros((MAXPIECES, BOARDSZ), dtype=NPDTYPE)
+        S = zeros((MAXPIECES, BOARDSZ), dtype=NPDTYPE)
+        Kw = zeros((1, BOARDSZ), dtype=NPDTYPE)
+        Kb = zeros((1, BOARDSZ), dtype=NPDTYPE)
+        compute_board_matrices(board, X, S, promoted, Kw, Kb)
+        bb = BitBoards(board.reshape((1,) + board.shape),
+                       promoted.reshape((1,) + promoted.shape))
+        X_, S_, Kw_, Kb_ = bb.expand(board.reshape((1,) + board.shape))
+        assert_array_equal(X, X_[0])
+        assert_array_equal(S, S_[0])
+        assert_array_equal(Kw, Kw_)
+        assert_array_equal(Kb, Kb_)
+
+
+def test_storage_dtype():
+    # Compact storage dtypes hold the same values as the default one
+    match = Match()
+    for dtype in ('int8', 'uint8'):
+        match_c = Match(dtype=dtype, packed=True)
+        assert match_c.is_valid_match
+        assert match_c.B.dtype == dtype
+        for name in ('B', 'X', 'S', 'Kw', 'Kb', 'pieces', 'promoted'):
+            assert_array_equal(getattr(match, name), getattr(match_c, name))
+        # Board states unpack only their own row, as read only copies
+        for n in (0, len(match) // 2, -1):
+            board = match_c[n]
+            assert_array_equal(board.pieces, match.pieces[n])
+            assert_array_equal(board.promoted, match.promoted[n])
+            assert not board.pieces.flags.writeable
+    try:
+        Match(dtype='float32')
+        assert False
+    except ValueError:
+        pass
+
+    promoted = zeros((3, MAXPIECES), dtype=NPDTYPE)
+    promoted[1:, 9] = 4
+    promoted[2, 30] = 20
+    mask = util.pack_promoted(promoted)
+    assert mask.shape == (3,)
+    assert_array_equal(util.unpack_promoted(mask), promoted)
+    promoted[2, 30] = 4
+    try:
+        util.pack_promoted(promoted)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_match_networks():
+    # Batched networks must match the per board state ones
+    match = Match()
+    boards = list(match)
+    for name in ('Dw', 'Db', 'Iw', 'Ib', 'Aw', 'Ab', 'Cw', 'Cb', 'cm'):
+        assert_array_equal(getattr(match, name),
+                           array([getattr(b, name) for b in boards]))
+
+
+def test_match_metrics():
+    # Bulk metrics must match the per board state ones
+    match = Match()
+    boards = list(match)
+    table = match.metrics()
+    for name, values in table.items():
+        if name == 'b_king_accesibility':
+            name = 'w_defense_on_king'
+        assert_array_equal(values, array([getattr(b, name) for b in boards]))
+
+    matchset = MatchSet(testmultifilename)
+    df = matchset.ToPandas(['pieceno'])
+    assert list(df.columns) == ['match', 'ply', 'b_pieceno', 'w_pieceno',
+                                'winner']
+    assert len(df) == sum(len(m.ToPandas(['pieceno'])) for m in matchset)
+
+
+def test_derived_cache():
+    match = Match()
+    Dw = match.Dw
+    assert match.Dw is Dw
+    assert not Dw.flags.writeable
+    match.compute()
+    assert match.Dw is not Dw
+    assert_array_equal(match.Dw, Dw)
+
+    cache = memo.LRUCache(maxbytes=2 * Dw.nbytes)
+    for name in ('Dw', 'Db', 'Iw'):
+        cache.get((match.token, name), lambda: getattr(match, name).copy())
+    assert len(cache) == 2
+    assert (match.token, 'Dw') not in cache
+    assert cache.nbytes <= cache.maxbytes
+    cache.discard(match.token)
+    assert len(cache) == 0 and cache.nbytes == 0
+
+    # Entries go away with their match
+    entries = len(memo.derived_cache)
+    for _ in iter_matches(testmultifilename, tables=True):
+        pass
+    assert len(memo.derived_cache) == entries
+    token = match.token
+    assert (token, 'Dw') in memo.derived_cache
+    del match, Dw
+    assert (token, 'Dw') not in memo.derived_cache
+
+
+def test_match_cache():
+    path = tempfile.mkdtemp()
+    try:
+        matchset = MatchSet(testmultifilename, cache=path)
+        cached = MatchSet(testmultifilename, cache=path)
+        assert cached._game_set is None and cached.file_stats is None
+        assert len(cached) == len(matchset)
+        for match, match_c in zip(matchset, cached):
+            for name in ('B', 'X', 'S', 'Kw', 'Kb', 'pieces', 'promoted'):
+                assert_array_equal(getattr(match, name), getattr(match_c, name))
+
+        cache = MatchCache(path)
+        assert cache.verify() == 0
+        # Entries of another kernel version are removed by verify
+        key = next(cache.entries())[0]
+        with open(os.path.join(cache.entry_path(key), 'meta.json'), 'w') as f:
+            f.write('{"version": "old", "nbytes": 0}')
+        assert cache.verify() == 1
+        assert key not in cache
+
+        # The cached pgn files count in the size limit and are evicted too
+        files = dict(cache.file_entries())
+        assert len(files) == 1
+        assert cache.nbytes == sum(meta['nbytes'] for _, meta in
+                                   cache.entries()) + sum(files.values())
+        cache.evict(cache.nbytes // 2)
+        assert cache.nbytes == sum(meta['nbytes'] for _, meta in
+                                   cache.entries()) + \
+            sum(nbytes for _, nbytes in cache.file_entries())
+        assert cache.nbytes > 0
+        cache.evict(0)
+        assert cache.nbytes == 0 and not list(cache.file_entries())
+        small = MatchCache(path, maxbytes=1)
+        small.store_file(testmultifilename, matchset._movements_set,
+                         matchset._metadata_set)
+        assert small.nbytes == 0 and small.load_file(testmultifilename) is None
+        cache.clear()
+        assert cache.nbytes == 0 and not list(cache.entries())
+    finally:
+        shutil.rmtree(path)
+
+
+def test_corpus():
+    path = tempfile.mkdtemp()
+    try:
+        matchset = MatchSet(testmultifilename, dtype='uint8')
+        corpus = Corpus(matchset.to_corpus(path))
+        assert len(corpus) == len(matchset)
+        assert corpus.rows == sum(match.B.shape[0] for match in matchset)
+        for k, match in enumerate(matchset):
+            match_c = corpus[k]
+            assert match_c.ucimovements == match.ucimovements
+            for name in ('B', 'X', 'S', 'Kw', 'Kb', 'pieces', 'promoted'):
+                assert_array_equal(getattr(match, name), getattr(match_c, name))
+        match_c = corpus[-1]
+        assert match_c.ucimovements == matchset[-1].ucimovements
+        assert_array_equal(match_c.B, matchset[-1].B)
+        try:
+            corpus[len(corpus)]
+            assert False
+        except IndexError:
+            pass
+        matches, X = corpus.at_ply(40, 'X')
+        assert len(matches) == X.shape[0]
+        for k, x in zip(matches, X):
+            assert_array_equal(matchset[k].X[40], x)
+    finally:
+        shutil.rmtree(path)
+
+
+test_pgn_text = """[Event "Test"]
+[White "A"]
+
+1. e4 {multi
+line comment} e5 2. Nf3 (2. f4 exf4 (2... d5) 3. Nf3) Nc6 $1 3. Bc4!? Nf6
+4. d3 Be7 5. O-O O-O 6. Nc3 d5 7. exd5 Nxd5 8. Nxd5 Qxd5 ; comment
+9. Bxd5 Bg4 10. Bxf7+ Rxf7 1-0
+
+[Event "Promotion and en passant"]
+
+1. e4 d5 2. e5 f5 3. exf6 e5 4. fxg7 Bd6 5. gxh8=Q Nf6 6. Qxh7 *
+"""
+
+
+def test_native_pgn():
+    native = list(util.iter_pgn_stream(io.StringIO(test_pgn_text)))
+    reference = list(util.iter_pgn_stream(io.StringIO(test_pgn_text),
+                                          native=False))
+    assert len(native) == len(reference) == 2
+    for (m, h, _), (m_ref, h_ref, _) in zip(native, reference):
+        assert m == m_ref
+        assert list(h.items()) == list(h_ref.items())
+    assert native[0][1]['Result'] == '1-0'
+    assert b'e5f6' in native[1][0] and b'g7h8q' in native[1][0]
+    # 5... Nf6 is illegal (pinned knight), the mainline ends there
+    assert len(native[1][0]) == 9
+
+    mov_lst, meta_lst, _ = util.load_multipgn_file(testmultifilename)
+    mov_ref, meta_ref, _ = util.load_multipgn_file(testmultifilename,
+                                                   native=False)
+    assert mov_lst == mov_ref
+    assert [dict(h) for h in meta_lst] == [dict(h) for h in meta_ref]
+    try:
+        san_to_uci(['e4', 'e5', 'Ke3'])
+        assert False
+    except SANError:
+        pass
+
+    # The python-chess games are still built where they are used
+    match = Match()
+    assert MoveBuffer.from_uci(
+        m.uci() for m in match.game.mainline_moves()) == match.ucimovements
+    matchset = MatchSet(games=True)
+    assert len(matchset._game_set) == len(mov_ref)
+    for game, movements in zip(matchset._game_set, mov_ref):
+        assert MoveBuffer.from_uci(
+            m.uci() for m in game.mainline_moves()) == movements
+    assert MatchSet()._game_set[0] is None
+
+
+def test_move_buffer():
+    movements = [b'e2e4', b'e7e5', b'g7h8q']
+    buf = MoveBuffer(movements)
+    assert buf == movements and len(buf) == 3 and buf[-1] == b'g7h8q'
+    assert buf[1:] == movements[1:] and MoveBuffer(buf.buffer) == buf
+    assert buf.promotions == b'  q'
+    assert_array_equal(buf.decode(), [[4, 1, 4, 3], [4, 6, 4, 4],
+                                      [6, 6, 7, 7]])
+    assert buf.decode().dtype == 'int8'
+    for invalid in ([], [b'e2e4', b'e7']):
+        try:
+            MoveBuffer(invalid).decode()
+            assert False
+        except ValueError:
+            pass
+    assert not Match([b'e2e4', b'e7']).is_valid_match
+
+
+def test_epd_boards():
+    match = Match([b'e2e4', b'e7e5', b'g1f3', b'b8c6'], dtype='uint8')
+    epds = ['rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq -',
+            'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq -']
+    arrays = compute_epd(epds, 'uint8')
+    for name in ('B', 'X', 'S', 'Kw', 'Kb', 'promoted'):
+        assert_array_equal(arrays[name], getattr(match, name)[[0, 4]])
+    # A second white queen is a promoted pawn
+    B, promoted = util.parse_epd_boards(['4k3/8/8/8/8/8/P7/QQ2K3'])
+    assert B[0, 1, 0] == 10 and promoted[0, 9] == 4
+    bs = BoardState(epds[1])
+    bs.compute()
+    assert_array_equal(bs.S, arrays['S'][1])
+    for invalid in ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP', '8/8/8/8/8/8/8/9',
+                    '4k3/8/8/8/8/8/PPPPPPPP/QQ2K3'):
+        try:
+            util.parse_epd_boards([invalid])
+            assert False
+        except ValueError:
+            pass
+
+
+def test_lazy_imports():
+    # Computing a match must not load plotting, pandas or python-chess
+    code = ('import sys, chessnet; chessnet.Match(chessnet.K.testfilename); '
+            'print(" ".join(m for m in ("pandas", "matplotlib", "chess", '
+            '"chessnet.test") if m in sys.modules))')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, '-c', code], cwd=root, check=True,
+                         stdout=subprocess.PIPE, universal_newlines=True)
+    assert out.stdout.strip() == ''
+
+
 def test_compute_boards():
     for (board, wAccessible, bAccessible, cm, promoted) in zip(test_board, test_wAccessible, test_bAccessible, test_cm, test_promoted):
         # Arrays that will store the computed values
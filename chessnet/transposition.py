@@ -0,0 +1,301 @@
+from numpy import zeros, int64, uint8
+from numpy import uint64 as npuint64
+from numpy.random import default_rng
+from numba import jit, uint64
+
+from .constants import (
+    MAXI, MAXJ, MAXPIECES, BOARDSZ, IMAPNUM, IS_EMPTY, MAPCELL, JIT_CACHE,
+    )
+from .compute import compute_board_matrices
+from .parse import replay_match_num
+from .bitboard import BITSCAN_FORWARD, NONE, ONE
+
+"""
+/////////////////////////////////////////////////////////////
+//TRANSPOSITION TABLE
+/////////////////////////////////////////////////////////////
+
+The X, S, Kw and Kb matrices of a board state only depend on its board B
+and its promoted vector, and the first plies of most games go through the
+same few positions. A transposition table keeps the matrices of the board
+states already computed, keyed on a Zobrist hash of B and promoted: one
+random 64 bit key per (cell, piece) and per (piece, promoted piece),
+XORed over the occupied cells and the promoted pieces.
+
+As in chess engines, the table is a fixed size array of sets of WAYS
+entries, the set of a board being given by the low bits of its hash.
+Within a set the least recently used entry is replaced. Entries also keep
+the board and the promoted vector, which are compared on every hit, so
+hash collisions never return wrong matrices.
+
+Entries are compact so the table stays in cache: X is rebuilt from the
+board, each row of S is kept as a bitboard (bit n is cell n) and Kw and Kb
+as uint8, around 500 bytes per board state whatever the dtype of the
+matches. The few board states with an S value above 1 (a promoted pawn
+and a queen sharing their row) are computed but not stored.
+"""
+
+# Default memory cap of a transposition table
+DEFAULT_MAXBYTES = 32 * 2**20
+
+# Entries of each set of the table
+WAYS = 4
+
+# Only the first MAXPLY board states of each match are looked up and
+# stored, later ones rarely repeat and would just evict the openings
+MAXPLY = 16
+
+# Bytes of an entry: key, stamp, B, promoted, S bitboards, Kw and Kb
+ENTRY_BYTES = 8 + 8 + BOARDSZ + MAXPIECES + 8*MAXPIECES + 2*BOARDSZ
+
+# Zobrist keys, fixed so hashes are reproducible across runs
+ZOBRIST_SEED = 0x5EED
+_rng = default_rng(ZOBRIST_SEED)
+ZOBRIST_BOARD = _rng.integers(0, 2**63, (BOARDSZ, MAXPIECES + 1),
+                              dtype=int64).astype(npuint64)
+ZOBRIST_PROMOTED = _rng.integers(0, 2**63, (MAXPIECES, MAXPIECES + 1),
+                                 dtype=int64).astype(npuint64)
+
+# Indexes of the table counters
+CLOCK, HITS, MISSES, STORES, EVICTIONS, UNSTORED = range(6)
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def BOARD_HASH(B, promoted, ZB, ZP):
+    h = uint64(0)
+    for i in range(MAXI):
+        for j in range(MAXJ):
+            if B[i, j] != 0:
+                h ^= ZB[MAPCELL(i, j), B[i, j]]
+    for pn in range(MAXPIECES):
+        if promoted[pn] != 0:
+            h ^= ZP[pn, promoted[pn]]
+    return h
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def IS_SAME_BOARD(B, promoted, TB, TP):
+    for i in range(MAXI):
+        for j in range(MAXJ):
+            if B[i, j] != TB[i, j]:
+                return False
+    for pn in range(MAXPIECES):
+        if promoted[pn] != TP[pn]:
+            return False
+    return True
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def LOAD_ENTRY(B, promoted, TS, TK, X, S, Kw, Kb):
+    # Fills the cleared X, S, Kw and Kb of a board state from an entry
+    for i in range(MAXI):
+        for j in range(MAXJ):
+            if IS_EMPTY(B[i, j]):
+                continue
+            pn = IMAPNUM(B[i, j])
+            if promoted[pn] != 0:
+                pn = IMAPNUM(promoted[pn])
+            X[pn, MAPCELL(i, j)] = 1
+    for pn in range(MAXPIECES):
+        a = TS[pn]
+        while a != NONE:
+            S[pn, BITSCAN_FORWARD(a)] = 1
+            a &= a - ONE
+    for cn in range(BOARDSZ):
+        Kw[cn] = TK[0, cn]
+        Kb[cn] = TK[1, cn]
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def STORE_ENTRY(B, promoted, S, Kw, Kb, TB, TP, TS, TK):
+    # Returns False if S does not fit in bitboards
+    for pn in range(MAXPIECES):
+        a = NONE
+        for cn in range(BOARDSZ):
+            if S[pn, cn] == 1:
+                a |= ONE << uint64(cn)
+            elif S[pn, cn] != 0:
+                return False
+        TS[pn] = a
+    for i in range(MAXI):
+        for j in range(MAXJ):
+            TB[i, j] = B[i, j]
+    for pn in range(MAXPIECES):
+        TP[pn] = promoted[pn]
+    for cn in range(BOARDSZ):
+        TK[0, cn] = Kw[cn]
+        TK[1, cn] = Kb[cn]
+    return True
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def compute_match_matrices_cached(B, X, S, promoted, Kw, Kb, maxply, ZB,
+                                  ZP, keys, stamps, TB, TP, TS, TK, counters):
+    """compute_match_matrices looking up the first maxply board states in
+    a transposition table. Misses are computed and stored in the least
+    recently used entry of their set.
+    """
+    X[...] = 0
+    S[...] = 0
+    Kw[...] = 0
+    Kb[...] = 0
+    nsets, ways = keys.shape
+    mask = uint64(nsets - 1)
+    h = uint64(0)
+    s = 0
+    for n in range(B.shape[0]):
+        if n < maxply:
+            h = BOARD_HASH(B[n], promoted[n], ZB, ZP)
+            s = int64(h & mask)
+            counters[CLOCK] += 1
+            hit = -1
+            for w in range(ways):
+                e = s*ways + w
+                if stamps[s, w] != 0 and keys[s, w] == h and \
+                        IS_SAME_BOARD(B[n], promoted[n], TB[e], TP[e]):
+                    hit = e
+                    stamps[s, w] = counters[CLOCK]
+                    break
+            if hit >= 0:
+                counters[HITS] += 1
+                LOAD_ENTRY(B[n], promoted[n], TS[hit], TK[hit],
+                           X[n], S[n], Kw[n], Kb[n])
+                continue
+            counters[MISSES] += 1
+        compute_board_matrices(
+            B[n], X[n], S[n], promoted[n], Kw[n:n+1], Kb[n:n+1])
+        if n >= maxply:
+            continue
+        # Store in the least recently used (or an empty) entry of the set
+        lru = 0
+        for w in range(1, ways):
+            if stamps[s, w] < stamps[s, lru]:
+                lru = w
+        e = s*ways + lru
+        if not STORE_ENTRY(B[n], promoted[n], S[n], Kw[n], Kb[n],
+                           TB[e], TP[e], TS[e], TK[e]):
+            # The entry was only partially written
+            stamps[s, lru] = 0
+            counters[UNSTORED] += 1
+            continue
+        if stamps[s, lru] != 0:
+            counters[EVICTIONS] += 1
+        counters[STORES] += 1
+        keys[s, lru] = h
+        stamps[s, lru] = counters[CLOCK]
+
+
+@jit(nopython=True, cache=JIT_CACHE)
+def parse_compute_match_matrices_cached(movements, B, X, S, pieces, promoted,
+                                        Kw, Kb, maxply, ZB, ZP, keys, stamps,
+                                        TB, TP, TS, TK, counters):
+    replay_match_num(movements, B, pieces, promoted)
+    compute_match_matrices_cached(B, X, S, promoted, Kw, Kb, maxply, ZB, ZP,
+                                  keys, stamps, TB, TP, TS, TK, counters)
+
+
+class TranspositionTable:
+
+    def __init__(self, maxbytes=DEFAULT_MAXBYTES, ways=WAYS, maxply=MAXPLY):
+        """Bounded cache of the matrices of the board states computed,
+        shared by the matches that use it (see Match), whatever their
+        dtype.
+
+        INPUT:
+            maxbytes: (int)
+                memory cap of the table. The number of sets is the
+                largest power of two that fits.
+            ways: (int)
+                entries of each set, the least recently used of the set
+                is replaced by a new board state.
+            maxply: (int)
+                number of board states of each match looked up.
+        """
+        self.ways = ways
+        self.maxply = maxply
+        nsets = 1
+        while 2 * nsets * ways * ENTRY_BYTES <= maxbytes:
+            nsets *= 2
+        self.keys = zeros((nsets, ways), npuint64)
+        self.stamps = zeros((nsets, ways), int64)
+        n = nsets * ways
+        self.B = zeros((n, MAXI, MAXJ), uint8)
+        self.promoted = zeros((n, MAXPIECES), uint8)
+        self.S = zeros((n, MAXPIECES), npuint64)
+        self.K = zeros((n, 2, BOARDSZ), uint8)
+        self.counters = zeros(6, int64)
+
+    def tables(self):
+        return (ZOBRIST_BOARD, ZOBRIST_PROMOTED, self.keys, self.stamps,
+                self.B, self.promoted, self.S, self.K, self.counters)
+
+    def compute(self, match):
+        """Computes the matrices of a replayed match, see
+        compute.compute_match.
+        """
+        compute_match_matrices_cached(
+            match.B, match.X, match.S, match.promoted, match.Kw, match.Kb,
+            self.maxply, *self.tables())
+
+    def parse_compute(self, match):
+        """Replays the movements of a match and computes its matrices,
+        see compute.parse_compute_match.
+        """
+        parse_compute_match_matrices_cached(
+            match.movements, match.B, match.X, match.S, match.pieces,
+            match.promoted, match.Kw, match.Kb, self.maxply, *self.tables())
+
+    def __len__(self):
+        """Number of board states stored"""
+        return int((self.stamps != 0).sum())
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.tables()[2:])
+
+    @property
+    def hits(self):
+        return int(self.counters[HITS])
+
+    @property
+    def misses(self):
+        return int(self.counters[MISSES])
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def stats(self):
+        """Lookups, hits, misses, stores and evictions so far"""
+        return {'entries': len(self), 'capacity': self.stamps.size,
+                'lookups': self.hits + self.misses, 'hits': self.hits,
+                'misses': self.misses,
+                'stores': int(self.counters[STORES]),
+                'evictions': int(self.counters[EVICTIONS]),
+                'unstored': int(self.counters[UNSTORED]),
+                'hit_rate': self.hit_rate}
+
+    def clear(self):
+        """Drops every entry and resets the counters"""
+        self.stamps[...] = 0
+        self.counters[...] = 0
+
+    def __repr__(self):
+        return ('TranspositionTable(%d/%d entries, %.1f MB, hit rate %.1f%%)'
+                % (len(self), self.stamps.size, self.nbytes / 2.**20,
+                   100 * self.hit_rate))
+
+
+# Table shared by the matches, see get_table
+shared_table = None
+
+
+def get_table():
+    """Returns the transposition table shared by the matches, created on
+    first use.
+    """
+    global shared_table
+    if shared_table is None:
+        shared_table = TranspositionTable()
+    return shared_table
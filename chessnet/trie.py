@@ -0,0 +1,104 @@
+from numpy import zeros, asarray, int64
+
+from . import util
+from .compute import parse_compute_tree_matrices
+from .pgn import MoveBuffer
+from .constants import (
+    MAXI, MAXJ, MAXPIECES, BOARDSZ, UCISZ,
+    )
+
+# Arrays of the board states of a trie, gathered for each match
+TRIE_ARRAYS = ('B', 'X', 'S', 'Kw', 'Kb', 'pieces', 'promoted')
+
+
+# Games that share their first movements go through the same board
+# states. A MoveTrie has one node per distinct sequence of movements
+# played from the initial position (node 0), and row n of its arrays is
+# the board state of node n, replayed and computed once whatever the
+# number of games going through it. The board states of game k are the
+# rows paths[k] of the arrays.
+
+def is_valid_movements(movements):
+    # Games that the Match constructor would flag as invalid
+    return len(movements) > 0 and all(len(m) >= UCISZ for m in movements)
+
+
+class MoveTrie:
+
+    def __init__(self, movements_set, engine='kernel', dtype=None):
+        """Builds the trie of a list of games and computes the board
+        state of each node.
+
+        INPUT:
+            movements_set: (list(list(bytes)))
+                uci movements of each game.
+            engine: (str)
+                only 'kernel', see Match.
+            dtype: (str, numpy dtype, None)
+                storage dtype of the arrays, see Match.
+        """
+        if engine != 'kernel':
+            raise ValueError('Unsupported engine for a MoveTrie: %s' % engine)
+        self.dtype = util.get_storage_dtype(dtype)
+        children = dict()
+        parents = [0]
+        moves = [b'a1a1']
+        self.paths = list()
+        for movements in movements_set:
+            if not is_valid_movements(movements):
+                self.paths.append(None)
+                continue
+            node = 0
+            path = [0]
+            for m in movements:
+                child = children.get((node, m))
+                if child is None:
+                    child = len(parents)
+                    children[(node, m)] = child
+                    parents.append(node)
+                    moves.append(m)
+                node = child
+                path.append(node)
+            self.paths.append(asarray(path, dtype=int64))
+        self.parents = asarray(parents, dtype=int64)
+        self.movements = MoveBuffer(moves).decode()
+
+        L = len(parents)
+        self.B = zeros((L, MAXI, MAXJ), dtype=self.dtype)
+        self.X = zeros((L, MAXPIECES, BOARDSZ), dtype=self.dtype)
+        self.S = zeros((L, MAXPIECES, BOARDSZ), dtype=self.dtype)
+        self.Kw = zeros((L, BOARDSZ), dtype=self.dtype)
+        self.Kb = zeros((L, BOARDSZ), dtype=self.dtype)
+        self.pieces = zeros((L, MAXPIECES), dtype=self.dtype)
+        self.promoted = zeros((L, MAXPIECES), dtype=self.dtype)
+        parse_compute_tree_matrices(
+            self.parents, self.movements, self.B, self.X, self.S,
+            self.pieces, self.promoted, self.Kw, self.Kb)
+        for name in TRIE_ARRAYS:
+            getattr(self, name).flags.writeable = False
+
+    def __len__(self):
+        """Number of nodes, i.e. of distinct board states computed"""
+        return len(self.parents)
+
+    def gather(self, path, name):
+        """Array name of the board states of a path"""
+        return getattr(self, name)[path]
+
+    @property
+    def plies(self):
+        """Board states of all the valid games"""
+        return sum(len(path) for path in self.paths if path is not None)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in TRIE_ARRAYS)
+
+    def stats(self):
+        """Number of nodes and of board states of the games, and the
+        fraction of the latter shared with other games.
+        """
+        plies = self.plies
+        return {'nodes': len(self), 'plies': plies,
+                'shared': 1. - len(self) / plies if plies else 0.,
+                'mbytes': self.nbytes / 2.**20}
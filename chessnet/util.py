@@ -1,11 +1,15 @@
 import os
-import chess
-import chess.pgn
 import logging
 import time
 import math
 
+from numpy import (
+    dtype as npdtype, packbits, unpackbits, uint8, uint32, int64, zeros,
+    cumsum, fromiter, frombuffer)
+
 from . import constants as K
+from . import pgn
+from . import parse
 
 
 def get_logger(name, level=logging.INFO, use_console=True, use_logfile=False):
@@ -85,60 +89,142 @@ def get_files_in_dir_recursive(inpath):
     return onlyfiles
 
 
-def load_pgn(fname=K.testfilename):
+def get_pgn_files(inpath, recursive=False):
+    """Sorted list of the pgn files (.pgn extension, any case) of a
+    directory, and of its subdirectories if recursive.
+    """
+    if recursive:
+        fnames = get_files_in_dir_recursive(inpath)
+    else:
+        fnames = get_files_in_dir(inpath)
+    return sorted(fname for fname in fnames
+                  if fname.lower().endswith('.pgn'))
+
+
+def load_pgn(fname=K.testfilename, native=True):
     """
     """
     with open(fname) as pgnfile:
+        return next(iter_pgn_stream(pgnfile, native))
+
+
+def iter_pgn_stream(pgnfile, native=True, validate=False):
+    """Generator over the games of an open pgn stream. Only one game is
+    held in memory at a time.
+
+    INPUT:
+        pgnfile: (file)
+            open pgn stream.
+        native: (bool)
+            use the native reader of pgn.py, which resolves the san
+            movements without building python-chess games. Games it can
+            not resolve are still read with python-chess.
+        validate: (bool)
+            read every game with python-chess as well and warn on any
+            difference with the native reader.
+
+    OUTPUT:
+        (movements, metadata, game) tuples for each game in the stream,
+        game is None for the native reader.
+    """
+    if native:
+        for movements, metadata in pgn.iter_pgn_games(pgnfile, validate):
+            yield movements, metadata, None
+        return
+    import chess.pgn
+    while True:
         game = chess.pgn.read_game(pgnfile)
-        metadata = game.headers
-        movements = [board.uci().encode() for board in game.mainline()]
-    return movements, metadata, game
+        if game is None:
+            break
+        movements = pgn.MoveBuffer.from_uci(
+            m.uci() for m in game.mainline_moves())
+        yield movements, game.headers, game
+
+
+def iter_multipgn_file(fname=K.testmultifilename, native=True):
+    """Generator over the games of a multi match pgn file
+    """
+    with open(fname) as pgnfile:
+        for item in iter_pgn_stream(pgnfile, native):
+            yield item
 
 
-def load_multipgn_file(fname=K.testmultifilename):
+def load_multipgn_file(fname=K.testmultifilename, native=True):
     """
     """
     mov_lst = list()
     meta_lst = list()
     game_lst = list()
-    
-    with open(fname) as pgnfile:
-        while True:
-            game = chess.pgn.read_game(pgnfile)
-            if game is not None:
-                meta_lst.append(game.headers)
-                movements = [b.uci().encode() for b in game.mainline()]
-                mov_lst.append(movements)
-                game_lst.append(game)
-            else:
-                break
-                
+    for movements, metadata, game in iter_multipgn_file(fname, native):
+        mov_lst.append(movements)
+        meta_lst.append(metadata)
+        game_lst.append(game)
     return mov_lst, meta_lst, game_lst
 
 
-def load_multipgn_directory(inpath=K.testdirectory, recursive=False):
+def load_multipgn_directory(inpath=K.testdirectory, recursive=False,
+                            native=True):
+    """Loads the games of all the pgn files of a directory, see
+    get_pgn_files.
     """
-    """
-    if recursive:
-        fnames = get_files_in_dir_recursive(inpath)
-    else:
-        fnames = get_files_in_dir(inpath)
-
     mov_lst  = list()
     meta_lst = list()
     game_lst = list()
-    for fname in fnames:
-        with open(fname) as pgnfile:
-            while True:
-                game = chess.pgn.read_game(pgnfile)
-                game_lst.append(game)
-                if game is not None:
-                    meta_lst.append(game.headers)
-                    movements = [b.uci().encode() for b in game.main_line()]
-                    mov_lst.append(movements)
-                else:
-                    break
-    return mov_lst, meta_lst,game_lst
+    for fname in get_pgn_files(inpath, recursive):
+        for movements, metadata, game in iter_multipgn_file(fname, native):
+            mov_lst.append(movements)
+            meta_lst.append(metadata)
+            game_lst.append(game)
+    return mov_lst, meta_lst, game_lst
+
+
+def get_storage_dtype(dtype=None):
+    """Returns the numpy dtype used to store the match arrays.
+
+    INPUT:
+        dtype: (str, numpy dtype, None)
+            one of K.STORAGE_DTYPES, defaults to K.NPDTYPE.
+    """
+    if dtype is None:
+        return npdtype(K.NPDTYPE)
+    dtype = npdtype(dtype)
+    if dtype.name not in K.STORAGE_DTYPES:
+        raise ValueError('Unsupported storage dtype: %s' % dtype.name)
+    return dtype
+
+
+def pack_bitmask(A):
+    """Packs the nonzero entries of a (L, MAXPIECES) array in one uint32
+    per row, bit k set when slot k is nonzero.
+    """
+    bits = packbits(A != 0, axis=1, bitorder='little')
+    return bits.view('<u4').reshape(-1).astype(uint32)
+
+
+def unpack_bitmask(mask, dtype=K.NPDTYPE, values=1):
+    """Inverse of pack_bitmask: returns a (L, MAXPIECES) array holding
+    values (scalar or one per slot) where the bit is set and zero elsewhere.
+    """
+    bits = unpackbits(mask.astype('<u4').view(uint8).reshape(-1, 4),
+                      axis=1, bitorder='little')
+    return (bits * values).astype(dtype)
+
+
+def pack_promoted(promoted):
+    """Packs a promoted array with pack_bitmask. The piece codes are
+    implied by the slot (see K.PROMOTION_CODES), anything else can not be
+    packed and raises ValueError.
+    """
+    nonzero = promoted != 0
+    if (promoted[nonzero] != (nonzero * K.PROMOTION_CODES)[nonzero]).any():
+        raise ValueError('Promoted pieces can not be packed as a bitmask')
+    return pack_bitmask(promoted)
+
+
+def unpack_promoted(mask, dtype=K.NPDTYPE):
+    """Inverse of pack_promoted"""
+    return unpack_bitmask(mask, dtype, K.PROMOTION_CODES)
+
 
 def get_closest_pair(n):
     #return (5, 12)
@@ -150,46 +236,47 @@ def get_closest_pair(n):
     else:
         return (root, root-1)
 
-# def parse_epd_board(board):
-#     epd_symbols = 'RNBKQPrnbkqp'
-#     overlap_map = {
-#         b'Z': b'B',
-#         b'Y': b'K',
-#         b'X': b'P',
-#         b'V': b'N',
-#         b'z': b'b',
-#         b'y': b'k',
-#         b'x': b'p',
-#         b'v': b'n',
-#     }
-
-#     epd_map = {
-#         'R': (b'A', b'H'),
-#         'N': (b'Z', b'G'),
-#         'B': (b'C', b'F'),
-#         'K': (b'D',),
-#         'Q': (b'E', b'E', b'E', b'E', b'E', b'E', b'E', b'E', b'E'),
-#         'P': (b'I', b'J', b'Y', b'L', b'M', b'V', b'O', b'X'),
-#         'r': (b'a', b'h'),
-#         'n': (b'z', b'g'),
-#         'b': (b'c', b'f'),
-#         'k': (b'd',),
-#         'q': (b'e', b'e', b'e', b'e', b'e', b'e', b'e', b'e', b'e'),
-#         'p': (b'i', b'j', b'y', b'l', b'm', b'v', b'o', b'x')}
-
-#     if isinstance(board, str):
-#         board = board.encode()
-#     board = board.split(b' ')[0]
-#     for i in range(1, 9):
-#         board = board.replace(str(i).encode(), b'0'*i)
-#     for symbol in epd_symbols:
-#         i = board.find(symbol.encode())
-#         count = 0
-#         while(i > -1):
-#             board = board.replace(symbol.encode(), epd_map[symbol][count], 1)
-#             count += 1
-#             i = board.find(symbol.encode())
-#     for key, rep in overlap_map.items():
-#         board = board.replace(key, rep)
-#     board = [list(row.decode()) for row in board.split(b'/')]
-#     return np.array(board, NPDTYPE='S1').T
+
+def parse_epd_boards(epds, dtype=None):
+    """Boards of a batch of EPD (or FEN) positions, parsed in a single
+    native call with the numerical codification of constants.py. Extra
+    pieces (e.g. a second queen) take the code of a missing pawn of
+    their color, flagged as promoted to their kind as in Match.
+
+    INPUT:
+        epds: (list(str, bytes))
+            positions, only their piece placement (first field) is used.
+        dtype: (str, numpy dtype, None)
+            storage dtype of the arrays, see get_storage_dtype.
+
+    OUTPUT:
+        (B, promoted), the (N, MAXI, MAXJ) boards and (N, MAXPIECES)
+        promoted vectors. Raises ValueError if a position can not be
+        parsed.
+    """
+    fields = list()
+    for epd in epds:
+        if isinstance(epd, str):
+            epd = epd.encode()
+        fields.append((epd.split(None, 1) or [b''])[0])
+    offsets = zeros(len(fields) + 1, int64)
+    offsets[1:] = cumsum(fromiter(map(len, fields), int64, len(fields)))
+    buffer = frombuffer(b''.join(fields), uint8)
+    dtype = get_storage_dtype(dtype)
+    B = zeros((len(fields), K.MAXI, K.MAXJ), dtype)
+    promoted = zeros((len(fields), K.MAXPIECES), dtype)
+    status = zeros(len(fields), int64)
+    parse.parse_epd_boards_num(buffer, offsets, B, promoted, status)
+    if status.any():
+        n = int(status.nonzero()[0][0])
+        reason = ('too many pieces' if status[n] == parse.EPD_TOO_MANY_PIECES
+                  else 'invalid piece placement')
+        raise ValueError('Can not parse EPD position %d (%s): %s' % (
+            n, reason, fields[n].decode(errors='replace')))
+    return B, promoted
+
+
+def parse_epd_board(board, dtype=None):
+    """Board and promoted vector of one EPD position, see parse_epd_boards"""
+    B, promoted = parse_epd_boards([board], dtype)
+    return B[0], promoted[0]
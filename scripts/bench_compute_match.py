@@ -0,0 +1,119 @@
+"""Plies per second of the match replay and compute pipeline, comparing
+the per-ply Python loop used up to chessnet 0.3.0 against the whole-match
+kernels in compute.py, and the cell-wise kernel against the bitboard
+engine (with and without expansion to the X/S matrices).
+
+Usage:
+    python bench_compute_match.py [pgn_file ...]
+"""
+import os
+import sys
+import time
+import logging
+
+import chessnet
+from chessnet import util, parse, compute
+from chessnet.bitboard import BitBoards
+from chessnet.constants import MAXI, MAXJ, data_path
+
+DEFAULT_FILES = ['fischer_60_mem.pgn', 'WCC1886-1985.pgn']
+REPEAT = 3
+
+
+def replay_per_ply(match):
+    # Legacy parse_match_from_movlst loop, one kernel call per ply
+    match.B[0, ...] = parse.__init_board_num(MAXI, MAXJ)
+    match.pieces[0, ...] = parse.__find_pieces_num(match.B[0, ...])
+    for m in range(len(match)):
+        match.B[m+1, ...] = parse.__move_board_num(
+            match.B[m, ...].copy(), match.movements[m])
+        match.pieces[m+1, ...] = parse.__find_pieces_num(match.B[m+1, ...])
+        match.promoted[m+1, ...] = parse.__find_promoted_num(
+            match.B[m+1, ...], match.pieces[m+1, ...],
+            match.promoted[m, ...].copy())
+
+
+def compute_per_ply(match):
+    # Legacy compute_match loop, one kernel call per ply
+    match.X[...] = 0
+    match.S[...] = 0
+    match.Kw[...] = 0
+    match.Kb[...] = 0
+    for moveno in range(len(match)+1):
+        compute.compute_state(match, moveno)
+
+
+def before(matches):
+    for match in matches:
+        replay_per_ply(match)
+        compute_per_ply(match)
+
+
+def after(matches):
+    for match in matches:
+        match.parse_compute()
+
+
+def compute_kernel(matches):
+    for match in matches:
+        compute.compute_match(match)
+
+
+def compute_bitboards(matches):
+    for match in matches:
+        BitBoards(match.B, match.promoted)
+
+
+def compute_bitboards_expand(matches):
+    for match in matches:
+        BitBoards(match.B, match.promoted).expand(match.B)
+
+
+def best_time(func, matches):
+    times = list()
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        func(matches)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main(fnames):
+    logging.disable(logging.INFO)
+    matchsets = list()
+    for fname in fnames:
+        movements, metadata, _ = util.load_multipgn_file(fname)
+        matches = [chessnet.Match(m, metadata=h)
+                   for m, h in zip(movements, metadata)]
+        matches = [m for m in matches if m.is_valid_match]
+        plies = sum(len(m) + 1 for m in matches)
+        matchsets.append((os.path.basename(fname), matches, plies))
+
+    print("Replay and compute")
+    print("%-22s %8s %14s %14s %8s" %
+          ('file', 'plies', 'before (pl/s)', 'after (pl/s)', 'speedup'))
+    for name, matches, plies in matchsets:
+        t_before = best_time(before, matches)
+        t_after = best_time(after, matches)
+        print("%-22s %8d %14.0f %14.0f %7.1fx" % (
+            name, plies, plies / t_before, plies / t_after,
+            t_before / t_after))
+
+    print("\nCompute only")
+    print("%-22s %8s %14s %14s %14s" %
+          ('file', 'plies', 'kernel (pl/s)', 'bitbrd (pl/s)', '+expand (pl/s)'))
+    for name, matches, plies in matchsets:
+        t_kernel = best_time(compute_kernel, matches)
+        t_bitboard = best_time(compute_bitboards, matches)
+        t_expand = best_time(compute_bitboards_expand, matches)
+        print("%-22s %8d %14.0f %14.0f %14.0f" % (
+            name, plies, plies / t_kernel, plies / t_bitboard,
+            plies / t_expand))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        fnames = sys.argv[1:]
+    else:
+        fnames = [os.path.join(data_path, f) for f in DEFAULT_FILES]
+    main(fnames)
@@ -0,0 +1,70 @@
+"""Startup time of chessnet: seconds to import the package and to compute
+the first match (which compiles the lazily compiled kernels) in a fresh
+interpreter, without the on-disk kernel cache, with an empty (cold) cache
+and with a populated (warm) one, and the peak resident memory after the
+import.
+
+Usage:
+    python bench_startup.py [runs]
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+REPEAT = 3
+
+# Runs in the child interpreter, prints the timings as json
+CHILD = """
+import json, time, logging, resource
+t0 = time.perf_counter()
+import chessnet
+t1 = time.perf_counter()
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+logging.disable(logging.INFO)
+chessnet.Match(chessnet.K.testfilename)
+t2 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'first_match': t2 - t1, 'rss': rss}))
+"""
+
+
+def run_child(env):
+    out = subprocess.run([sys.executable, '-c', CHILD], env=env, check=True,
+                         stdout=subprocess.PIPE, universal_newlines=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def best(runs):
+    return dict((key, min(r[key] for r in runs)) for key in runs[0])
+
+
+def main(repeat):
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in [env.get('PYTHONPATH')] if p])
+    cache_dir = tempfile.mkdtemp(prefix='chessnet_numba_')
+    try:
+        results = list()
+        nocache = dict(env, CHESSNET_JIT_CACHE='0')
+        results.append(('no cache', best([run_child(nocache)
+                                          for _ in range(repeat)])))
+        cached = dict(env, NUMBA_CACHE_DIR=cache_dir)
+        results.append(('cold cache', run_child(cached)))
+        results.append(('warm cache', best([run_child(cached)
+                                            for _ in range(repeat)])))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print("%-12s %12s %16s %10s %10s" %
+          ('mode', 'import (s)', 'first match (s)', 'total (s)', 'rss (MB)'))
+    for name, r in results:
+        print("%-12s %12.2f %16.2f %10.2f %10.0f" % (
+            name, r['import'], r['first_match'],
+            r['import'] + r['first_match'], r['rss']))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else REPEAT)
@@ -0,0 +1,193 @@
+"""Benchmark suite of the chessnet pipeline. Every stage is timed on each
+pgn file (best of several runs) and reported as plies per second, together
+with the peak memory allocated by the stage (traced in a separate run) and
+the peak resident memory of the process so far.
+
+Stages:
+    load_native       util.load_multipgn_file, native san reader
+    load_pychess      util.load_multipgn_file, python-chess games
+    parse             parse.parse_match_from_movlst on every match
+    compute           compute.compute_match (compute_board_matrices kernel)
+    compute_old       compute_old.compute_match, the per-ply legacy kernel
+    networks          Dw, Db, Aw, Ab, Iw, Ib, Cw, Cb and cm of every match
+    topandas          Match.ToPandas of every match
+    matchset          MatchSet(fname), load to computed matches
+
+Stages that can not run in this tree (e.g. compute_old, whose module does
+not import) are reported with an error instead of timings.
+
+Usage:
+    python bench_suite.py [--repeat N] [--dtype DTYPE] [--stages a,b,...]
+                          [--json PATH] [pgn_file ...]
+
+With --json the results are also written as a json document (to stdout
+with -), to compare runs and catch regressions.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import resource
+import tracemalloc
+
+import numpy
+import numba
+
+import chessnet
+from chessnet import util, parse, compute, memo
+from chessnet.constants import data_path, VERSION, KERNEL_VERSION
+
+REPEAT = 3
+
+NETWORKS = ('Dw', 'Db', 'Aw', 'Ab', 'Iw', 'Ib', 'Cw', 'Cb', 'cm')
+
+
+def load_native(data):
+    util.load_multipgn_file(data['fname'])
+
+
+def load_pychess(data):
+    util.load_multipgn_file(data['fname'], native=False)
+
+
+def parse_matches(data):
+    for match in data['matches']:
+        parse.parse_match_from_movlst(match, match.ucimovements)
+
+
+def compute_kernel(data):
+    for match in data['matches']:
+        compute.compute_match(match)
+
+
+def compute_legacy(data):
+    from chessnet import compute_old
+    for match in data['matches']:
+        compute_old.compute_match(match)
+
+
+def networks(data):
+    memo.derived_cache.clear()
+    for match in data['matches']:
+        for name in NETWORKS:
+            getattr(match, name)
+
+
+def topandas(data):
+    memo.derived_cache.clear()
+    for match in data['matches']:
+        match.ToPandas(None)
+
+
+def matchset(data):
+    chessnet.MatchSet(data['fname'], dtype=data['dtype'])
+
+
+STAGES = (
+    ('load_native', load_native),
+    ('load_pychess', load_pychess),
+    ('parse', parse_matches),
+    ('compute', compute_kernel),
+    ('compute_old', compute_legacy),
+    ('networks', networks),
+    ('topandas', topandas),
+    ('matchset', matchset),
+    )
+
+
+def max_rss():
+    # Peak resident memory of the process, in MB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def run_stage(func, data, repeat):
+    """Best time of repeat runs, and peak traced allocation of one more"""
+    times = list()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(data)
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    func(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak / 2.**20
+
+
+def load_data(fname, dtype):
+    movements, metadata, _ = util.load_multipgn_file(fname)
+    matches = [chessnet.Match(m, metadata=h, dtype=dtype)
+               for m, h in zip(movements, metadata)]
+    matches = [m for m in matches if m.is_valid_match]
+    return {'fname': fname, 'dtype': dtype, 'matches': matches,
+            'games': len(movements),
+            'plies': sum(len(m) + 1 for m in matches)}
+
+
+def environment(args):
+    return {'chessnet': VERSION, 'kernel': KERNEL_VERSION,
+            'python': platform.python_version(), 'numpy': numpy.__version__,
+            'numba': numba.__version__, 'machine': platform.machine(),
+            'cpus': os.cpu_count(), 'repeat': args.repeat,
+            'dtype': str(util.get_storage_dtype(args.dtype))}
+
+
+def main(args):
+    logging.disable(logging.INFO)
+    stages = [(name, func) for name, func in STAGES
+              if args.stages is None or name in args.stages.split(',')]
+    results = list()
+    print("%-20s %-13s %8s %10s %14s %12s %10s" % (
+        'file', 'stage', 'plies', 'time (s)', 'plies/s', 'alloc (MB)',
+        'rss (MB)'))
+    for fname in args.fnames:
+        data = load_data(fname, args.dtype)
+        name = os.path.basename(fname)
+        for stage, func in stages:
+            result = {'file': name, 'stage': stage, 'games': data['games'],
+                      'plies': data['plies']}
+            try:
+                seconds, alloc = run_stage(func, data, args.repeat)
+            except Exception as error:
+                result['error'] = '%s: %s' % (type(error).__name__, error)
+                print("%-20s %-13s %8d %s" % (
+                    name, stage, data['plies'], result['error']))
+            else:
+                result.update({'seconds': seconds,
+                               'plies_per_s': data['plies'] / seconds,
+                               'peak_alloc_mb': alloc,
+                               'max_rss_mb': max_rss()})
+                print("%-20s %-13s %8d %10.3f %14.0f %12.1f %10.0f" % (
+                    name, stage, data['plies'], seconds,
+                    result['plies_per_s'], alloc, result['max_rss_mb']))
+            results.append(result)
+        del data
+
+    if args.json is not None:
+        doc = {'environment': environment(args), 'results': results}
+        if args.json == '-':
+            json.dump(doc, sys.stdout, indent=1)
+            print()
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(doc, f, indent=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('fnames', nargs='*', help='pgn files, defaults to '
+                        'the pgn files bundled in chessnet/data')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--dtype', default=None,
+                        help='storage dtype of the match arrays')
+    parser.add_argument('--stages', default=None,
+                        help='comma separated stages, defaults to all')
+    parser.add_argument('--json', default=None,
+                        help='write the results as json to this path')
+    args = parser.parse_args()
+    if not args.fnames:
+        args.fnames = util.get_pgn_files(data_path)
+    main(args)
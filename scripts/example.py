@@ -8,25 +8,14 @@ match=matchset[0];
 match.plot_all()
 match.print_boards()
 
-import numpy as np
-lW=[ m.w_Dconnectance for m in matchset if m.winner[0] == 'White' ] + [ m.b_Dconnectance for m in matchset if m.winner[0] == 'Black' ]
-lL=[ m.b_Dconnectance for m in matchset if m.winner[0] == 'White' ] + [ m.w_Dconnectance for m in matchset if m.winner[0] == 'Black' ]
-a=max([len(l) for l in lW])
-
-mW=[]
-mL=[]
-for i in range(a):
-    mW+=[np.mean([lW[j][i] for j in range(len(lW)) if i < len(lW[j])])]
-for i in range(a):
-    mL+=[np.mean([lL[j][i] for j in range(len(lL)) if i < len(lL[j])])]
-#plt.plot(range(len(mW)),mW,'r-', range(len(mL)),mL,'k-')
-
-sW=[]
-sL=[]
-for i in range(a):
-    sW+=[np.std([lW[j][i] for j in range(len(lW)) if i < len(lW[j])])]
-for i in range(a):
-    sL+=[np.std([lL[j][i] for j in range(len(lL)) if i < len(lL[j])])]
+# Per ply mean and std of the D connectance of winners and losers, in one
+# streaming pass (chessnet.aggregate.PlyStats also takes the matches of
+# chessnet.iter_matches, so the games need not be held in memory)
+agg = matchset.aggregate(['Dconnectance'], align='winner')
+mW = agg.mean('winner_Dconnectance')
+mL = agg.mean('loser_Dconnectance')
+sW = agg.std('winner_Dconnectance')
+sL = agg.std('loser_Dconnectance')
 
 fig, ax = plt.subplots( 1, 1, figsize=(16,8) )
 ax.plot(range(len(mW)),mW,'r--', range(len(mL)),mL,'k--')
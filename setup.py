@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 # from distutils.core import setup
+import re
 from setuptools import setup
 
+# The version is kept only in chessnet/constants.py (the on-disk cache keys
+# depend on it), read without importing the package and its dependencies
+with open('chessnet/constants.py') as f:
+    version = re.search(r"^VERSION = '([^']+)'", f.read(), re.M).group(1)
+
 setup(
     name='chessnet',
-    version='0.3.0',
+    version=version,
     author='Jorge Ibáñez Gijón, Gonzalo S. Nido, & Alberto Pascual',
     author_email='jorge.ibannez@uam.es',
     packages=['chessnet'],